@@ -0,0 +1,135 @@
+# admission.py
+# Admission control перед пулом соединений: когда все соединения заняты,
+# запросы не копятся бесконечно в pool.connection(), а низкоприоритетные
+# сразу получают 503 + Retry-After — дешёвые и важные роуты остаются живыми.
+#
+# Классы (чем меньше, тем важнее):
+#   CRITICAL — чекаут, оплата, авторизация, любые записи (по умолчанию для не-GET)
+#   BROWSE   — каталог, карточка, отзывы, история заказов (по умолчанию для GET)
+#   LOW      — поиск, экспорт/импорт, админка
+# Правила (только когда кто-то уже ждёт соединение):
+#   - очередь ожидающих класса не длиннее ADMISSION_QUEUE_<КЛАСС>;
+#   - сглаженное ожидание checkout > ADMISSION_TARGET_MS — режем LOW,
+#     > 2 × target — режем и BROWSE; CRITICAL режет только длина очереди.
+import contextvars
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import Request
+
+from metrics import Counter, collector
+
+CRITICAL, BROWSE, LOW = 0, 1, 2
+CLASS_NAMES = {CRITICAL: "critical", BROWSE: "browse", LOW: "low"}
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "1").strip().lower() in ("1", "true", "yes")
+ADMISSION_TARGET_MS = float(os.getenv("ADMISSION_TARGET_MS", "100"))
+ADMISSION_QUEUE = {
+    CRITICAL: int(os.getenv("ADMISSION_QUEUE_CRITICAL", "64")),
+    BROWSE: int(os.getenv("ADMISSION_QUEUE_BROWSE", "24")),
+    LOW: int(os.getenv("ADMISSION_QUEUE_LOW", "4")),
+}
+# постоянная времени сглаживания ожидания: без новых замеров оценка затухает
+_DECAY_SEC = 1.0
+
+SHED = Counter("admission_shed_total", "Requests shed before waiting for a DB connection", ("pool", "class", "reason"))
+
+_priority: contextvars.ContextVar[int | None] = contextvars.ContextVar("admission_priority", default=None)
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: int = 1):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def priority(cls: int):
+    """Зависимость роута: класс приоритета для всех его обращений к БД."""
+
+    async def dep():
+        _priority.set(cls)
+
+    return dep
+
+
+async def search_priority(request: Request):
+    """Зависимость роута-списка: с полнотекстовым поиском — LOW, без него — BROWSE."""
+    if request.query_params.get("search"):
+        _priority.set(LOW)
+
+
+def default_priority(request: Request) -> int:
+    return BROWSE if request.method in ("GET", "HEAD") else CRITICAL
+
+
+def current_priority(default: int = BROWSE) -> int:
+    cls = _priority.get()
+    return default if cls is None else cls
+
+
+class AdmissionController:
+    def __init__(self, name: str):
+        self.name = name
+        self.waiting = 0
+        self._wait_ewma = 0.0     # секунды
+        self._updated = time.monotonic()
+
+    def wait_estimate(self) -> float:
+        # EWMA, затухающая со временем: после разгрузки не застреваем в режиме отказов
+        return self._wait_ewma * math.exp(-(time.monotonic() - self._updated) / _DECAY_SEC)
+
+    def _observe(self, wait: float):
+        self._wait_ewma = self.wait_estimate() * 0.8 + wait * 0.2
+        self._updated = time.monotonic()
+
+    def admit(self, cls: int):
+        if not ADMISSION_CONTROL or self.waiting == 0:
+            return
+        reason = None
+        if self.waiting >= ADMISSION_QUEUE[cls]:
+            reason = "queue"
+        elif cls != CRITICAL:
+            target = ADMISSION_TARGET_MS / 1000 * (1 if cls == LOW else 2)
+            if self.wait_estimate() > target:
+                reason = "latency"
+        if reason:
+            SHED.inc(self.name, CLASS_NAMES[cls], reason)
+            raise Overloaded(f"{self.name}: {reason}", retry_after=1 if cls == CRITICAL else 2)
+
+    @asynccontextmanager
+    async def connection(self, pool, cls: int):
+        self.admit(cls)
+        self.waiting += 1
+        queued = True
+        t0 = time.perf_counter()
+        try:
+            async with pool.connection() as conn:
+                queued = False
+                self.waiting -= 1
+                self._observe(time.perf_counter() - t0)
+                yield conn
+        finally:
+            if queued:
+                self.waiting -= 1
+
+
+_controllers: dict[str, AdmissionController] = {}
+
+
+def controller(pool_name: str) -> AdmissionController:
+    ctl = _controllers.get(pool_name)
+    if ctl is None:
+        ctl = _controllers[pool_name] = AdmissionController(pool_name)
+    return ctl
+
+
+@collector
+def _admission_metrics():
+    ctls = list(_controllers.values())
+    yield ("admission_waiting", "gauge", "Requests waiting for a DB connection",
+           [({"pool": c.name}, c.waiting) for c in ctls])
+    yield ("admission_wait_estimate_seconds", "gauge", "Smoothed DB checkout wait used for shedding",
+           [({"pool": c.name}, round(c.wait_estimate(), 6)) for c in ctls])
@@ -1,11 +1,21 @@
 # app.py
 import os
-from fastapi import FastAPI
+import time
+import psycopg
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
 
-from db import pool
-from routers import products, reviews, addresses, orders, auth, categories
+from admission import Overloaded
+from compression import CompressionMiddleware
+from metrics import MetricsMiddleware, render as render_metrics
+from outbound import close_clients, dependencies
+import catalog_snapshot
+import jobs
+import votes
+from db import pool, replica_pool, db_ready, query_cancel_reason, QUERIES_CANCELLED, PRIMARY_PIN_COOKIE, PRIMARY_PIN_SECONDS
+from routers import products, reviews, addresses, orders, auth, categories, admin
 from routers import payments
 from routers import locations
 from routers import geo
@@ -17,7 +27,23 @@ ALLOWED_ORIGINS = [
 
 async def lifespan(app: FastAPI):
     await pool.open()
+    await geo.startup()
+    await locations.startup()
+    await products.startup()
+    if replica_pool is not None:
+        await replica_pool.open()
+    votes.buffer.start()
+    jobs.workers.start()
+    await catalog_snapshot.startup()
     yield
+    await catalog_snapshot.shutdown()
+    # до закрытия пула: воркеры доделывают/возвращают задачи, голоса — последним flush'ем
+    await jobs.workers.stop()
+    await votes.buffer.close()
+    await close_clients()
+    await payments.shutdown()
+    if replica_pool is not None:
+        await replica_pool.close()
     await pool.close()
 
 app = FastAPI(title="Mira API", version="0.1.0", lifespan=lifespan)
@@ -28,11 +54,72 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# gzip/brotli; ответы с ETag (каталог, категории) жмутся один раз и берутся из кэша
+app.add_middleware(CompressionMiddleware)
+
+# латентность/статусы по шаблону роута, in-flight → /metrics
+app.add_middleware(MetricsMiddleware)
+
+# read-your-writes: после успешной записи клиент ещё PRIMARY_PIN_SECONDS
+# читает каталог/отзывы с primary, а не с отстающей реплики
+@app.middleware("http")
+async def pin_primary_after_write(request: Request, call_next):
+    response = await call_next(request)
+    if replica_pool is not None and request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        response.set_cookie(
+            PRIMARY_PIN_COOKIE,
+            str(int(time.time()) + PRIMARY_PIN_SECONDS),
+            max_age=PRIMARY_PIN_SECONDS,
+            httponly=True,
+            secure=True,
+            samesite="none",
+        )
+    return response
+
+# statement_timeout / отмена при уходе клиента — не 500
+@app.exception_handler(psycopg.errors.QueryCanceled)
+async def query_cancelled(request: Request, exc: psycopg.errors.QueryCanceled):
+    reason = query_cancel_reason(exc)
+    QUERIES_CANCELLED.inc(reason)
+    if reason == "timeout":
+        return JSONResponse({"detail": "Query took too long, try narrowing it"}, status_code=503, headers={"Retry-After": "1"})
+    # 499 (nginx: client closed request) — клиента уже нет, ответ никто не прочтёт
+    return JSONResponse({"detail": "Client closed request"}, status_code=499)
+
+@app.exception_handler(Overloaded)
+async def overloaded(request: Request, exc: Overloaded):
+    # пул БД перегружен: отказ сразу, а не ожидание в очереди до таймаута
+    return JSONResponse({"detail": "Service is overloaded, retry later"}, status_code=503,
+                        headers={"Retry-After": str(exc.retry_after)})
+
 @app.get("/health")
 async def health():
-    return {"api":"ok","db":True}
+    return {"api":"ok","db":await db_ready()}
+
+@app.get("/health/live")
+async def health_live():
+    # процесс жив и крутит event loop; БД не трогаем
+    return {"api":"ok"}
+
+@app.get("/health/ready")
+async def health_ready(response: Response):
+    # готов принимать трафик: БД отвечает (результат кэшируется на DB_PROBE_TTL сек)
+    ok = await db_ready()
+    if not ok:
+        response.status_code = 503
+    return {"api":"ok","db":ok}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/health/outbound")
+async def health_outbound():
+    # состояние breaker'ов и bulkhead'ов внешних зависимостей
+    return {name: dep.snapshot() for name, dep in dependencies.items()}
 
 # роутеры
 app.include_router(products)
@@ -41,6 +128,7 @@ app.include_router(addresses)
 app.include_router(orders)
 app.include_router(auth)
 app.include_router(categories)
+app.include_router(admin)
 
 app.include_router(payments.router)
 app.include_router(locations.router)
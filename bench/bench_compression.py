@@ -0,0 +1,53 @@
+# bench/bench_compression.py
+"""
+Цена сжатия ответа (CPU на ответ) против сэкономленных байт — для страниц
+каталога с полным description. Уровни: "dyn" — для динамических ответов,
+"cached" — для ответов с ETag, которые сжимаются один раз (compressed_cache).
+
+    python bench/bench_compression.py [--n 200]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_serialize import product_rows
+from compression import compress, brotli, CompressedCache
+from responses import RawJSONResponse
+
+
+def timeit(fn, n) -> float:
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=200)
+    args = ap.parse_args()
+
+    encodings = ["gzip"] + (["br"] if brotli is not None else [])
+    print(f"{'payload':<14}{'enc':<6}{'level':<8}{'bytes':>9}{'saved':>9}{'us/resp':>10}")
+    for size in (24, 100):
+        body = RawJSONResponse({"items": product_rows(size), "page": {"total": 1000, "limit": size, "offset": 0}}).body
+        print(f"{f'products x{size}':<14}{'-':<6}{'-':<8}{len(body):>9}{'':>9}{'':>10}")
+        for enc in encodings:
+            for cached in (False, True):
+                out = compress(body, enc, cached=cached)
+                us = timeit(lambda: compress(body, enc, cached=cached), args.n)
+                saved = 1 - len(out) / len(body)
+                print(f"{'':<14}{enc:<6}{'cached' if cached else 'dyn':<8}{len(out):>9}{saved:>8.0%}{us:>10.1f}")
+            # попадание в кэш сжатых тел — цена одного lookup
+            cache = CompressedCache(1 << 20)
+            cache.put(('W/"x"', enc), compress(body, enc, cached=True))
+            us = timeit(lambda: cache.get(('W/"x"', enc)), args.n)
+            print(f"{'':<14}{enc:<6}{'hit':<8}{'':>9}{'':>9}{us:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
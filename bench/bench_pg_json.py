@@ -0,0 +1,91 @@
+# bench/bench_pg_json.py
+"""
+Бенчмарк: JSON, собранный в Postgres (PG_JSON_ENDPOINTS), против текущего
+пути dict_row + Pydantic + сериализация FastAPI — на больших страницах.
+
+Нужна база со схемой mira и заполненной таблицей products (например, bench/seed.py):
+    DATABASE_URL=postgresql://... python bench/bench_pg_json.py --sizes 100,1000,10000
+Печатает время на запрос и пик памяти Python (tracemalloc) для обоих путей.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg
+from psycopg.rows import dict_row
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from models import ProductsPage, ProductOut, PageOut
+
+SQL_ITEMS = """
+  select p.id::text, p.slug, p.title, p.category, p.sub, p.leaf,
+         p.price::float, p.rating::float, p.short, p.description,
+         p.image_url as "imageUrl"
+  from products p
+  order by p.rating desc nulls last, p.price asc
+  limit %(limit)s
+"""
+SQL_COUNT = "select count(*) as c from products p"
+SQL_JSON = f"""
+  select json_build_object(
+    'items', coalesce((select json_agg(t) from ({SQL_ITEMS}) t), '[]'::json),
+    'page', json_build_object('total', ({SQL_COUNT}), 'limit', %(limit)s::int, 'offset', 0)
+  )::text
+"""
+
+
+async def python_path(conn, limit, field) -> int:
+    async with conn.cursor(row_factory=dict_row) as cur:
+        await cur.execute(SQL_COUNT)
+        total = (await cur.fetchone())["c"]
+        await cur.execute(SQL_ITEMS, {"limit": limit})
+        rows = await cur.fetchall()
+    page = ProductsPage(items=[ProductOut.model_validate(r) for r in rows], page=PageOut(total=total, limit=limit, offset=0))
+    content = await serialize_response(field=field, response_content=page)
+    return len(JSONResponse(content).body)
+
+
+async def pg_path(conn, limit, field) -> int:
+    async with conn.cursor() as cur:
+        await cur.execute(SQL_JSON, {"limit": limit})
+        (body,) = await cur.fetchone()
+    return len(body.encode())
+
+
+async def measure(fn, conn, limit, field, n):
+    await fn(conn, limit, field)  # прогрев
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    for _ in range(n):
+        size = await fn(conn, limit, field)
+    dt = (time.perf_counter() - t0) / n * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dt, peak / 1024, size
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="100,1000,10000")
+    ap.add_argument("--n", type=int, default=20)
+    args = ap.parse_args()
+
+    field = create_response_field(name="Response", type_=ProductsPage, mode="serialization")
+    async with await psycopg.AsyncConnection.connect(os.environ["DATABASE_URL"], autocommit=True) as conn:
+        await conn.execute("SET search_path TO mira, public")
+        print(f"{'rows':>7} {'path':<8}{'ms/req':>10}{'peak KiB':>12}{'bytes':>12}")
+        for limit in (int(s) for s in args.sizes.split(",")):
+            for name, fn in (("python", python_path), ("pg_json", pg_path)):
+                dt, peak, size = await measure(fn, conn, limit, field, args.n)
+                print(f"{limit:>7} {name:<8}{dt:>10.2f}{peak:>12.0f}{size:>12}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,133 @@
+# bench/bench_serialize.py
+"""
+Микробенчмарк сериализации ответа: старый путь (model_validate на строку +
+валидация/сериализация FastAPI по response_model + JSONResponse) против
+RawJSONResponse (строки из БД сразу в JSON-байты).
+
+Запуск из корня репозитория:
+    python bench/bench_serialize.py [--n 2000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from models import ProductsPage, ProductOut, PageOut, OrderOut, CartItemIn, Totals, Customer, Shipping
+from responses import RawJSONResponse
+
+
+def product_rows(n: int) -> list[dict]:
+    return [
+        {
+            "id": f"00000000-0000-0000-0000-{i:012d}",
+            "slug": f"product-{i}",
+            "title": f"Товар {i}",
+            "category": "health", "sub": "vitamins", "leaf": "multi",
+            "price": 9.99 + i, "rating": 4.5,
+            "short": "Короткое описание",
+            "description": "Длинное описание товара. " * 20,
+            "imageUrl": f"https://cdn.example.com/p/{i}.jpg",
+        }
+        for i in range(n)
+    ]
+
+
+def order_rows(n: int) -> list[tuple[dict, list[dict]]]:
+    res = []
+    for i in range(n):
+        o = {
+            "id": f"10000000-0000-0000-0000-{i:012d}",
+            "created_at": "2026-01-01 12:00:00+00",
+            "totals": {"subtotal": 30.0, "shipping": 4.9, "grand": 34.9, "vatIncluded": 5.57},
+            "customer": {"firstName": "Anna", "lastName": "Muster", "email": "anna@example.com", "phone": None},
+            "shipping": {"method": "dhl", "packType": None, "address": {"zip": "10115", "city": "Berlin"}},
+            "payment": {"status": "paid", "method": "card", "last4": "4242"},
+            "status": "processing",
+            "refund": None,
+        }
+        items = [
+            {"id": f"p-{j}", "qty": 1, "title": f"Товар {j}", "price": 10.0, "slug": f"product-{j}", "imageUrl": None}
+            for j in range(3)
+        ]
+        res.append((o, items))
+    return res
+
+
+async def old_products(rows, field):
+    page = ProductsPage(items=[ProductOut.model_validate(r) for r in rows], page=PageOut(total=1000, limit=len(rows), offset=0))
+    content = await serialize_response(field=field, response_content=page)
+    return JSONResponse(content).body
+
+
+async def new_products(rows, field):
+    return RawJSONResponse({"items": rows, "page": {"total": 1000, "limit": len(rows), "offset": 0}}).body
+
+
+async def old_orders(orders, field):
+    res = [
+        OrderOut(
+            id=o["id"], created_at=o["created_at"],
+            items=[CartItemIn.model_validate(i) for i in items],
+            totals=Totals.model_validate(o["totals"]),
+            customer=Customer.model_validate(o["customer"]),
+            shipping=Shipping.model_validate(o["shipping"]),
+            payment=o["payment"], status=o["status"], refund=o.get("refund"),
+        )
+        for o, items in orders
+    ]
+    content = await serialize_response(field=field, response_content=res)
+    return JSONResponse(content).body
+
+
+async def new_orders(orders, field):
+    # то же, что routers.orders._order_out
+    return RawJSONResponse([
+        {
+            "id": o["id"], "created_at": o["created_at"], "items": items,
+            "totals": o["totals"], "customer": o["customer"], "shipping": o["shipping"],
+            "payment": o["payment"], "status": o["status"], "refund": o.get("refund"),
+        }
+        for o, items in orders
+    ]).body
+
+
+async def timeit(fn, data, field, n) -> float:
+    await fn(data, field)  # прогрев
+    t0 = time.perf_counter()
+    for _ in range(n):
+        await fn(data, field)
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=2000)
+    args = ap.parse_args()
+
+    products_field = create_response_field(name="Response", type_=ProductsPage, mode="serialization")
+    orders_field = create_response_field(name="Response", type_=list[OrderOut], mode="serialization")
+
+    print(f"{'case':<22}{'old, us':>12}{'new, us':>12}{'speedup':>10}")
+    for size in (24, 100):
+        rows = product_rows(size)
+        assert await old_products(rows, products_field) == await new_products(rows, products_field)
+        old = await timeit(old_products, rows, products_field, args.n)
+        new = await timeit(new_products, rows, products_field, args.n)
+        print(f"{f'products x{size}':<22}{old:>12.1f}{new:>12.1f}{old / new:>9.1f}x")
+    for size in (10, 50):
+        orders = order_rows(size)
+        assert await old_orders(orders, orders_field) == await new_orders(orders, orders_field)
+        old = await timeit(old_orders, orders, orders_field, args.n)
+        new = await timeit(new_orders, orders, orders_field, args.n)
+        print(f"{f'orders x{size}':<22}{old:>12.1f}{new:>12.1f}{old / new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
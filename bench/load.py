@@ -0,0 +1,278 @@
+# bench/load.py
+"""
+Нагрузочный драйвер: виртуальные пользователи крутят сценарии
+(browse, search, product, checkout, history, login) против работающего API
+и по каждому эндпоинту считают пропускную способность и p50/p95/p99.
+
+    python bench/stubs.py &                      # заглушки DHL/geo/Stripe
+    uvicorn app:app --workers 4 &                # API с переменными из вывода stubs.py
+    python bench/load.py --base http://127.0.0.1:8000 --vus 64 --duration 60 --out run.json
+    python bench/load.py ... --baseline run.json # то же + дельты против прошлого прогона
+
+Данные — из bench/seed.py (пользователи bench{N}@mira.test, --bench-users
+должен совпадать с --users сида). Смесь сценариев: --mix browse=30,search=15,...
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from seed import BENCH_PASSWORD, CITIES, NOUN, user_email
+
+DEFAULT_MIX = "browse=30,search=15,product=30,checkout=5,history=10,login=10"
+
+
+class Stats:
+    def __init__(self):
+        self.samples: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.recording = False
+
+    def add(self, label: str, seconds: float, ok: bool):
+        if not self.recording:
+            return
+        self.samples.setdefault(label, []).append(seconds)
+        if not ok:
+            self.errors[label] = self.errors.get(label, 0) + 1
+
+    def report(self, duration: float) -> dict:
+        out = {}
+        for label, lat in sorted(self.samples.items()):
+            lat.sort()
+            n = len(lat)
+            pick = lambda q: lat[min(n - 1, int(q * n))] * 1000
+            out[label] = {
+                "count": n,
+                "errors": self.errors.get(label, 0),
+                "rps": round(n / duration, 2),
+                "p50_ms": round(pick(0.50), 2),
+                "p95_ms": round(pick(0.95), 2),
+                "p99_ms": round(pick(0.99), 2),
+                "max_ms": round(lat[-1] * 1000, 2),
+            }
+        return out
+
+
+class Session:
+    """Один виртуальный пользователь: свой токен, общие клиент и статистика."""
+
+    def __init__(self, client: httpx.AsyncClient, stats: Stats, data: dict, rng: random.Random, n_users: int):
+        self.client = client
+        self.stats = stats
+        self.data = data
+        self.rng = rng
+        self.n_users = n_users
+        self.token: str | None = None
+        self.since = "0"   # курсор ленты /products/changes
+        self.ip = f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+
+    async def req(self, label: str, method: str, url: str, **kwargs) -> httpx.Response | None:
+        headers = kwargs.pop("headers", {})
+        headers.setdefault("accept-encoding", "gzip, br")
+        if self.token:
+            headers["authorization"] = f"Bearer {self.token}"
+        t0 = time.perf_counter()
+        try:
+            r = await self.client.request(method, url, headers=headers, **kwargs)
+            await r.aread()
+        except httpx.HTTPError:
+            self.stats.add(label, time.perf_counter() - t0, False)
+            return None
+        self.stats.add(label, time.perf_counter() - t0, r.status_code < 400 or r.status_code == 404)
+        return r
+
+    def product(self) -> dict:
+        return self.rng.choice(self.data["products"])
+
+    async def login(self):
+        r = await self.req("POST /auth/login", "POST", "/auth/login", json={
+            "email": user_email(self.rng.randrange(self.n_users)), "password": BENCH_PASSWORD,
+        })
+        if r is not None and r.status_code == 200:
+            self.token = r.json()["access_token"]
+
+    async def ensure_login(self):
+        if self.token is None:
+            await self.login()
+
+    # ----- сценарии -----
+
+    async def browse(self):
+        await self.req("GET /categories", "GET", "/categories")
+        cat = self.rng.choice(self.data["categories"])
+        for page in range(self.rng.randint(1, 3)):
+            await self.req("GET /products?category", "GET", "/products", params={
+                "category": cat, "limit": 24, "offset": page * 24,
+                "sort": self.rng.choice(["popular", "price-asc", "price-desc"]),
+            })
+
+    async def search(self):
+        loc = self.rng.choice(["ru", "en", "de", "uk"])
+        word = self.rng.choice(NOUN["en"] if loc == "en" else NOUN[loc])
+        await self.req("GET /products?search", "GET", "/products", params={"search": word, "locale": loc, "limit": 24})
+
+    async def product_page(self):
+        p = self.product()
+        await self.req("GET /products/{slug}", "GET", f"/products/{p['slug']}", params={"locale": self.rng.choice(["de", "en"])})
+        await self.req("GET /reviews/summary", "GET", "/reviews/summary", params={"product_id": p["id"]})
+        r = await self.req("GET /reviews", "GET", "/reviews", params={"product_id": p["id"], "limit": 20})
+        if r is not None and r.status_code == 200 and r.json() and self.rng.random() < 0.2:
+            await self.req("POST /reviews/{id}/vote", "POST", f"/reviews/{r.json()[0]['id']}/vote")
+        if r is not None and r.headers.get("x-next-cursor") and self.rng.random() < 0.3:
+            await self.req("GET /reviews?cursor", "GET", "/reviews", params={
+                "product_id": p["id"], "limit": 20, "cursor": r.headers["x-next-cursor"],
+            })
+
+    async def checkout(self):
+        await self.ensure_login()
+        items = [self.product() for _ in range(self.rng.randint(1, 4))]
+        cart = [{"id": p["id"], "qty": self.rng.randint(1, 2), "title": p["title"], "price": p["price"],
+                 "slug": p["slug"], "imageUrl": p.get("imageUrl")} for p in items]
+        subtotal = round(sum(i["price"] * i["qty"] for i in cart), 2)
+        zip_, city = self.rng.choice(CITIES)
+
+        await self.req("GET /geo/country", "GET", "/geo/country", headers={"x-forwarded-for": self.ip})
+        await self.req("GET /locations", "GET", "/locations", params={"zip": zip_, "type": "packstation"})
+        await self.req("POST /payments/intent", "POST", "/payments/intent", json={"amount": max(50, int(subtotal * 100))})
+        await self.req("POST /orders", "POST", "/orders", json={
+            "items": cart,
+            "totals": {"subtotal": subtotal, "shipping": 0.0, "grand": subtotal, "vatIncluded": round(subtotal - subtotal / 1.19, 2)},
+            "customer": {"firstName": "Bench", "lastName": "User", "email": f"load-{uuid.uuid4().hex[:8]}@mira.test"},
+            "shipping": {"method": "dhl", "address": {"street": "Hauptstr.", "house": "1", "zip": zip_, "city": city}},
+            "payment_status": "paid",
+            "last4": "4242",
+        })
+
+    async def history(self):
+        await self.ensure_login()
+        r = await self.req("GET /orders", "GET", "/orders", params={"fields": "id,created_at,status,totals"})
+        if r is not None and r.status_code == 200 and r.json():
+            await self.req("GET /orders/{id}", "GET", f"/orders/{r.json()[0]['id']}")
+
+    async def sync(self):
+        # клиент с локальной копией каталога: первый раз выкачивает всё, дальше — дельты
+        for _ in range(100):
+            r = await self.req("GET /products/changes", "GET", "/products/changes", params={"since": self.since})
+            if r is None or r.status_code != 200:
+                return
+            body = r.json()
+            self.since = body["next"]
+            if not body["has_more"]:
+                return
+
+    async def fresh_login(self):
+        self.token = None
+        await self.login()
+
+
+SCENARIOS = {
+    "browse": Session.browse,
+    "search": Session.search,
+    "product": Session.product_page,
+    "checkout": Session.checkout,
+    "history": Session.history,
+    "login": Session.fresh_login,
+    "sync": Session.sync,
+}
+
+
+async def load_data(client: httpx.AsyncClient, pages: int) -> dict:
+    products = []
+    for page in range(pages):
+        r = await client.get("/products", params={"limit": 100, "offset": page * 100})
+        r.raise_for_status()
+        products.extend(r.json()["items"])
+    r = await client.get("/categories")
+    r.raise_for_status()
+    categories = [c["slug"] for c in r.json()]
+    if not products or not categories:
+        raise SystemExit("no products/categories — seed the database first (bench/seed.py)")
+    return {"products": products, "categories": categories}
+
+
+async def vu(session: Session, mix: list[tuple[str, int]], stop_at: float, think: float):
+    names, weights = zip(*mix)
+    while time.monotonic() < stop_at:
+        await SCENARIOS[session.rng.choices(names, weights)[0]](session)
+        if think:
+            await asyncio.sleep(session.rng.expovariate(1 / think))
+
+
+def print_report(report: dict, baseline: dict | None):
+    head = f"{'endpoint':<26}{'count':>8}{'err':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    print(head)
+    print("-" * len(head))
+    for label, r in report.items():
+        print(f"{label:<26}{r['count']:>8}{r['errors']:>6}{r['rps']:>9.1f}"
+              f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['max_ms']:>9.1f}")
+        base = (baseline or {}).get(label)
+        if base:
+            delta = lambda k: f"{(r[k] - base[k]) / base[k] * 100:+.0f}%" if base[k] else "n/a"
+            print(f"{'  vs baseline':<26}{'':>8}{'':>6}{delta('rps'):>9}"
+                  f"{delta('p50_ms'):>9}{delta('p95_ms'):>9}{delta('p99_ms'):>9}{delta('max_ms'):>9}")
+
+
+async def run(args):
+    mix = []
+    for part in args.mix.split(","):
+        name, _, w = part.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f"unknown scenario {name!r}; known: {', '.join(SCENARIOS)}")
+        mix.append((name.strip(), int(w or 1)))
+
+    stats = Stats()
+    limits = httpx.Limits(max_connections=args.vus, max_keepalive_connections=args.vus)
+    async with httpx.AsyncClient(base_url=args.base, timeout=args.timeout, limits=limits) as client:
+        data = await load_data(client, args.sample_pages)
+        rng = random.Random(args.seed)
+        sessions = [Session(client, stats, data, random.Random(rng.random()), args.bench_users) for _ in range(args.vus)]
+
+        start = time.monotonic()
+        stop_at = start + args.warmup + args.duration
+        tasks = [asyncio.create_task(vu(s, mix, stop_at, args.think)) for s in sessions]
+        await asyncio.sleep(args.warmup)
+        stats.recording = True
+        measured_from = time.monotonic()
+        await asyncio.gather(*tasks)
+        measured = time.monotonic() - measured_from
+
+    report = stats.report(measured)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["endpoints"]
+    print_report(report, baseline)
+    total = sum(r["count"] for r in report.values())
+    print(f"\n{total} requests in {measured:.1f}s — {total / measured:.1f} req/s, {args.vus} VUs")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "duration": measured, "endpoints": report}, f, indent=2)
+
+
+def main(argv: list[str] | None = None):
+    ap = argparse.ArgumentParser(description="Нагрузочный драйвер Mira API")
+    ap.add_argument("--base", default="http://127.0.0.1:8000")
+    ap.add_argument("--vus", type=int, default=32, help="виртуальных пользователей")
+    ap.add_argument("--duration", type=float, default=60.0, help="секунд измерения")
+    ap.add_argument("--warmup", type=float, default=10.0, help="секунд прогрева (не в статистике)")
+    ap.add_argument("--think", type=float, default=0.0, help="средняя пауза между сценариями, сек")
+    ap.add_argument("--mix", default=DEFAULT_MIX)
+    ap.add_argument("--bench-users", type=int, default=10_000, help="= --users у bench/seed.py")
+    ap.add_argument("--sample-pages", type=int, default=20, help="страниц по 100 товаров для выборки")
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="сохранить результаты в JSON")
+    ap.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    asyncio.run(run(ap.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+# bench/seed.py
+"""
+Синтетический набор данных для нагрузочных тестов и бенчмарков.
+
+Заливает в схему mira (она уже должна быть применена) через COPY:
+дерево категорий, товары с переводами ru/en/de/uk, пользователей,
+отзывы и заказы с позициями. Данные детерминированы (--seed): один и тот же
+запуск даёт те же slug'и, id и e-mail'ы — результаты прогонов сравнимы.
+
+    DATABASE_URL=postgresql://... python bench/seed.py --products 100000 --orders 1000000 --truncate --yes
+
+Пользователи — bench{N}@mira.test с паролем BENCH_PASSWORD (см. bench/load.py).
+--truncate чистит таблицы каталога, отзывов, заказов и пользователей — только
+для локальной базы.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from array import array
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bcrypt
+import psycopg
+
+BENCH_PASSWORD = "bench-password"
+LOCALES = ("ru", "en", "de", "uk")
+
+ROOTS = ["vitamins", "sport", "beauty", "home", "kids", "pets", "food", "health"]
+SUBS = ["basic", "premium", "organic", "travel", "daily", "gift"]
+LEAVES = ["small", "medium", "large", "set", "refill"]
+
+ADJ = {
+    "en": ["fresh", "natural", "classic", "smart", "gentle", "strong", "light", "pure", "daily", "active"],
+    "de": ["frisch", "natuerlich", "klassisch", "smart", "sanft", "stark", "leicht", "rein", "taeglich", "aktiv"],
+    "ru": ["свежий", "натуральный", "классический", "умный", "нежный", "сильный", "лёгкий", "чистый", "ежедневный", "активный"],
+    "uk": ["свіжий", "натуральний", "класичний", "розумний", "ніжний", "сильний", "легкий", "чистий", "щоденний", "активний"],
+}
+NOUN = {
+    "en": ["tea", "cream", "bottle", "vitamin", "shampoo", "mat", "towel", "brush", "snack", "balm", "candle", "bag"],
+    "de": ["tee", "creme", "flasche", "vitamin", "shampoo", "matte", "handtuch", "buerste", "snack", "balsam", "kerze", "tasche"],
+    "ru": ["чай", "крем", "бутылка", "витамин", "шампунь", "коврик", "полотенце", "щётка", "снек", "бальзам", "свеча", "сумка"],
+    "uk": ["чай", "крем", "пляшка", "вітамін", "шампунь", "килимок", "рушник", "щітка", "снек", "бальзам", "свічка", "сумка"],
+}
+FIRST = ["Anna", "Max", "Olga", "Jonas", "Iryna", "Lukas", "Marta", "Paul", "Sofia", "Felix"]
+LAST = ["Schmidt", "Kovalenko", "Müller", "Ivanova", "Weber", "Shevchenko", "Fischer", "Petrova"]
+CITIES = [("10115", "Berlin"), ("20095", "Hamburg"), ("80331", "München"), ("50667", "Köln"), ("60311", "Frankfurt")]
+STATUSES = ["processing", "packed", "shipped", "delivered", "delivered", "delivered", "cancelled", "refunded"]
+
+
+def uid(seed: int, kind: str, i: int) -> str:
+    """Стабильный uuid по (seed, вид, номер): одни и те же id между прогонами."""
+    return str(uuid.UUID(bytes=hashlib.blake2b(f"{seed}:{kind}:{i}".encode(), digest_size=16).digest(), version=4))
+
+
+def product_words(i: int, locale: str) -> tuple[str, str]:
+    adj, noun = ADJ[locale], NOUN[locale]
+    return adj[i % len(adj)], noun[(i // len(adj)) % len(noun)]
+
+
+def product_slug(i: int) -> str:
+    a, n = product_words(i, "en")
+    return f"{a}-{n}-{i}"
+
+
+def product_leaf(i: int) -> tuple[str, str, str]:
+    return ROOTS[i % len(ROOTS)], SUBS[(i // 7) % len(SUBS)], LEAVES[(i // 11) % len(LEAVES)]
+
+
+def user_email(n: int) -> str:
+    return f"bench{n}@mira.test"
+
+
+class Seeder:
+    def __init__(self, conn: psycopg.Connection, seed: int, batch: int = 20_000):
+        self.conn = conn
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.batch = batch
+        self.prices = array("d")
+
+    def _copy(self, table: str, columns: str, rows) -> int:
+        n = 0
+        with self.conn.cursor() as cur, cur.copy(f"copy {table} ({columns}) from stdin") as copy:
+            for r in rows:
+                copy.write_row(r)
+                n += 1
+        return n
+
+    def _step(self, what: str, fn, *args) -> int:
+        t0 = time.perf_counter()
+        n = fn(*args)
+        self.conn.commit()
+        print(f"{what:>14}: {n:>10,} rows in {time.perf_counter() - t0:6.1f}s", file=sys.stderr)
+        return n
+
+    def truncate(self):
+        with self.conn.cursor() as cur:
+            cur.execute("""
+              truncate order_items, orders, reviews, product_i18n, products, categories, users
+              restart identity cascade
+            """)
+        self.conn.commit()
+
+    def categories(self) -> int:
+        def rows():
+            for a, root in enumerate(ROOTS):
+                rid = uid(self.seed, "cat", a)
+                yield rid, root.title(), root, None
+                for b, sub in enumerate(SUBS):
+                    sid = uid(self.seed, "cat", (a + 1) * 100 + b)
+                    yield sid, sub.title(), f"{root}-{sub}", rid
+                    for c, leaf in enumerate(LEAVES):
+                        yield uid(self.seed, "cat", (a + 1) * 10_000 + (b + 1) * 100 + c), leaf.title(), f"{root}-{sub}-{leaf}", sid
+        return self._copy("categories", "id, title, slug, parent_id", rows())
+
+    def products(self, n: int) -> int:
+        rng = self.rng
+
+        def rows():
+            for i in range(n):
+                a, w = product_words(i, "en")
+                root, sub, leaf = product_leaf(i)
+                price = round(rng.uniform(1.5, 150.0), 2)
+                self.prices.append(price)
+                yield (
+                    uid(self.seed, "product", i), product_slug(i), f"{a.title()} {w} {i}", root, sub, leaf,
+                    price, None, f"{a} {w} for everyday use",
+                    f"{a.title()} {w} #{i}. " + " ".join(rng.choices(NOUN["en"], k=24)),
+                    f"https://img.mira.test/p/{i % 500}.webp",
+                )
+        return self._copy(
+            "products", "id, slug, title, category, sub, leaf, price, rating, short, description, image_url", rows()
+        )
+
+    def product_i18n(self, n: int) -> int:
+        def rows():
+            for i in range(n):
+                pid = uid(self.seed, "product", i)
+                for loc in LOCALES:
+                    a, w = product_words(i, loc)
+                    yield pid, loc, f"{a} {w} {i}", f"{a} {w}", f"{a} {w} — {loc} #{i}", f"{product_slug(i)}-{loc}"
+        return self._copy("product_i18n", "product_id, locale, title, short, description, slug", rows())
+
+    def users(self, n: int) -> int:
+        # bcrypt дорогой — один хэш на всех, пароль у всех одинаковый
+        pwd = bcrypt.hashpw(BENCH_PASSWORD.encode(), bcrypt.gensalt(rounds=10)).decode()
+        now = datetime.now(timezone.utc)
+        rows = (
+            (uid(self.seed, "user", u), user_email(u), f"{FIRST[u % len(FIRST)]} {LAST[u % len(LAST)]}", pwd, now)
+            for u in range(n)
+        )
+        return self._copy("users", "id, email, name, password_hash, created_at", rows)
+
+    def reviews(self, n_products: int, per_product: float) -> int:
+        rng = self.rng
+        now = datetime.now(timezone.utc)
+
+        def rows():
+            k = 0
+            for i in range(n_products):
+                # длинный хвост: у большинства пара отзывов, у популярных — сотни
+                cnt = min(int(rng.paretovariate(1.6) * per_product / 2.6), 2000)
+                pid = uid(self.seed, "product", i)
+                for _ in range(cnt):
+                    yield (
+                        uid(self.seed, "review", k), pid, FIRST[k % len(FIRST)],
+                        rng.choices((1, 2, 3, 4, 5), weights=(1, 1, 2, 4, 6))[0],
+                        " ".join(rng.choices(NOUN["en"], k=12)),
+                        now - timedelta(minutes=rng.randrange(2 * 365 * 24 * 60)),
+                        int(rng.expovariate(0.5)),
+                    )
+                    k += 1
+        n = self._copy("reviews", "id, product_id, author, rating, text, created_at, helpful", rows())
+        with self.conn.cursor() as cur:
+            # при session_replication_role=replica триггер сводки не срабатывал —
+            # review_stats и products.rating пересчитываем целиком (schema_patch_reviews.sql)
+            cur.execute("select rebuild_review_stats()")
+        return n
+
+    def orders(self, n: int, n_users: int, n_products: int, items_per_order: float) -> int:
+        rng = self.rng
+        now = datetime.now(timezone.utc)
+        done = 0
+        while done < n:
+            chunk = range(done, min(done + self.batch, n))
+            orders, items = [], []
+            for o in chunk:
+                u = rng.randrange(n_users) if n_users else None
+                email = user_email(u) if u is not None else f"guest{o}@mira.test"
+                zip_, city = CITIES[o % len(CITIES)]
+                oid = uid(self.seed, "order", o)
+                subtotal = 0.0
+                for j in range(max(1, int(rng.expovariate(1 / items_per_order)) + 1)):
+                    i = rng.randrange(n_products)
+                    qty = rng.randint(1, 3)
+                    price = self.prices[i] if i < len(self.prices) else 9.99
+                    subtotal += price * qty
+                    a, w = product_words(i, "en")
+                    items.append((
+                        uid(self.seed, f"item:{o}", j), oid, uid(self.seed, "product", i),
+                        f"{a.title()} {w} {i}", product_slug(i), price, qty, f"https://img.mira.test/p/{i % 500}.webp",
+                    ))
+                shipping_cost = 0.0 if subtotal >= 50 else 4.99
+                grand = round(subtotal + shipping_cost, 2)
+                status = STATUSES[rng.randrange(len(STATUSES))]
+                orders.append((
+                    oid, now - timedelta(minutes=rng.randrange(2 * 365 * 24 * 60)), "EUR", 0.19,
+                    json.dumps({"subtotal": round(subtotal, 2), "shipping": shipping_cost, "grand": grand,
+                                "vatIncluded": round(grand - grand / 1.19, 2)}),
+                    json.dumps({"firstName": FIRST[o % len(FIRST)], "lastName": LAST[o % len(LAST)],
+                                "email": email, "phone": None}),
+                    json.dumps({"method": "dhl", "packType": None,
+                                "address": {"street": "Hauptstr.", "house": str(o % 200 + 1), "zip": zip_, "city": city}}),
+                    json.dumps({"status": "paid", "method": "card", "last4": "4242"}),
+                    status,
+                    json.dumps({"status": "refunded"}) if status == "refunded" else None,
+                    uid(self.seed, "user", u) if u is not None else None,
+                    email,
+                ))
+            self._copy(
+                "orders", "id, created_at, currency, vat_rate, totals, customer, shipping, payment, status, refund, user_id, email",
+                orders,
+            )
+            self._copy("order_items", "id, order_id, product_id, title, slug, price, qty, image_url", items)
+            self.conn.commit()
+            done = chunk.stop
+        return done
+
+    def invalidate(self) -> int:
+        # session_replication_role=replica выключил и триггеры версий кэша (schema_patch_cache.sql),
+        # и лога изменений (schema_patch_changes.sql): ETag, снимок каталога и /products/changes
+        # не узнали бы о залитом — поднимаем версии и дописываем лог сами
+        n = 0
+        with self.conn.cursor() as cur:
+            cur.execute("select to_regclass('cache_versions') is not null, to_regclass('catalog_changes') is not null")
+            has_versions, has_changes = cur.fetchone()
+            if has_versions:
+                cur.execute("select bump_cache_version(k) from unnest(array['catalog', 'categories']) k")
+                cur.execute("select bump_cache_version('reviews:' || id::text) from products")
+                n += 2 + cur.rowcount
+            if has_changes:
+                # новыми записями, а не только недостающими: клиент с курсором после
+                # прошлой заливки иначе не увидел бы перезалитые товары
+                cur.execute("insert into catalog_changes (entity, product_id) select 'product', id from products")
+                n += cur.rowcount
+                cur.execute("""
+                  insert into catalog_changes (entity, product_id, locale)
+                  select 'product_i18n', product_id, locale from product_i18n
+                """)
+                n += cur.rowcount
+                cur.execute("select compact_catalog_changes()")
+        return n
+
+    def analyze(self) -> int:
+        with self.conn.cursor() as cur:
+            cur.execute("analyze categories, products, product_i18n, users, reviews, orders, order_items")
+        return 0
+
+
+def main(argv: list[str] | None = None):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    ap = argparse.ArgumentParser(description="Синтетические данные для нагрузочных тестов (COPY)")
+    ap.add_argument("--products", type=int, default=100_000)
+    ap.add_argument("--users", type=int, default=10_000)
+    ap.add_argument("--reviews", type=float, default=5.0, help="в среднем отзывов на товар")
+    ap.add_argument("--orders", type=int, default=200_000)
+    ap.add_argument("--items", type=float, default=2.5, help="в среднем позиций в заказе")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--truncate", action="store_true", help="очистить таблицы перед заливкой")
+    ap.add_argument("--yes", action="store_true", help="подтвердить --truncate")
+    args = ap.parse_args(argv)
+
+    if args.truncate and not args.yes:
+        ap.error("--truncate удаляет каталог, заказы и пользователей; добавьте --yes")
+
+    with psycopg.connect(os.environ["DATABASE_URL"]) as conn:
+        conn.execute("SET search_path TO mira, public")
+        triggers_off = True
+        try:
+            # без FK/триггеров на время заливки (статистика кэша, счётчики) — если есть права
+            conn.execute("SET session_replication_role = replica")
+        except psycopg.errors.InsufficientPrivilege:
+            triggers_off = False
+            conn.rollback()
+            conn.execute("SET search_path TO mira, public")
+            print("note: no superuser, triggers and FK checks stay on (slower)", file=sys.stderr)
+        conn.commit()
+
+        s = Seeder(conn, args.seed)
+        if args.truncate:
+            s.truncate()
+        t0 = time.perf_counter()
+        s._step("categories", s.categories)
+        s._step("products", s.products, args.products)
+        s._step("product_i18n", s.product_i18n, args.products)
+        s._step("users", s.users, args.users)
+        s._step("reviews", s.reviews, args.products, args.reviews)
+        s._step("orders", s.orders, args.orders, args.users, args.products, args.items)
+        if triggers_off:
+            s._step("invalidate", s.invalidate)
+        s._step("analyze", s.analyze)
+        print(f"done in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
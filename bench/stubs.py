@@ -0,0 +1,131 @@
+# bench/stubs.py
+"""
+Локальные заглушки внешних сервисов для нагрузочных прогонов: DHL Location
+Finder, ipwho.is / ipinfo и Stripe PaymentIntents — одним процессом.
+
+    python bench/stubs.py --port 9100 --latency-ms 80 --error-rate 0.01
+
+API направляется на них переменными окружения (печатаются при старте):
+    DHL_API_KEY=bench DHL_BASE_URL=http://127.0.0.1:9100/dhl/locations
+    GEO_IPWHOIS_URL=http://127.0.0.1:9100/ipwhois GEO_IPINFO_URL=http://127.0.0.1:9100/ipinfo
+    STRIPE_SECRET_KEY=sk_test_bench STRIPE_API_BASE=http://127.0.0.1:9100/stripe
+
+--latency-ms / --jitter-ms задают задержку ответа, --error-rate — долю 503
+(проверка breaker'ов и таймаутов из outbound.py).
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import sys
+import time
+from urllib.parse import parse_qs
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+COUNTRIES = ["DE", "DE", "DE", "AT", "CH", "UA", "PL", "NL", "FR", "US"]
+
+
+class Behaviour:
+    latency_ms = 50.0
+    jitter_ms = 20.0
+    error_rate = 0.0
+
+
+async def _delay() -> JSONResponse | None:
+    ms = max(0.0, random.gauss(Behaviour.latency_ms, Behaviour.jitter_ms))
+    await asyncio.sleep(ms / 1000)
+    if Behaviour.error_rate and random.random() < Behaviour.error_rate:
+        return JSONResponse({"error": "stub failure"}, status_code=503)
+    return None
+
+
+def _country(ip: str) -> str:
+    return COUNTRIES[hashlib.blake2b(ip.encode(), digest_size=1).digest()[0] % len(COUNTRIES)]
+
+
+async def ipwhois(request: Request):
+    if err := await _delay():
+        return err
+    return JSONResponse({"success": True, "country_code": _country(request.path_params["ip"])})
+
+
+async def ipinfo(request: Request):
+    if err := await _delay():
+        return err
+    return JSONResponse({"ip": request.path_params["ip"], "country": _country(request.path_params["ip"])})
+
+
+async def dhl_locations(request: Request):
+    if err := await _delay():
+        return err
+    zip_ = request.query_params.get("postalCode", "10115")
+    type_ = request.query_params.get("types", "packstation")
+    limit = int(request.query_params.get("limit", "10"))
+    base = int(hashlib.blake2b(zip_.encode(), digest_size=2).hexdigest(), 16)
+    lat0, lng0 = 47.5 + (base % 500) / 100, 6.0 + (base // 500) / 10
+    locations = []
+    for k in range(limit):
+        locations.append({
+            "locationId": f"stub-{zip_}-{type_}-{k}",
+            "name": f"{type_.title()} {100 + k}",
+            "types": [type_],
+            "address": {"streetAddress": "Stubstraße", "streetNumber": str(k + 1), "postalCode": zip_, "city": "Stubstadt"},
+            "location": {"geo": {"latitude": lat0 + k * 0.003, "longitude": lng0 + k * 0.004}},
+            "openingHours": [],
+        })
+    return JSONResponse({"locations": locations})
+
+
+async def stripe_payment_intents(request: Request):
+    if err := await _delay():
+        return JSONResponse({"error": {"type": "api_error", "message": "stub failure"}}, status_code=500)
+    # form-urlencoded без python-multipart
+    form = {k: v[0] for k, v in parse_qs((await request.body()).decode()).items()}
+    pid = "pi_" + hashlib.blake2b(f"{time.time_ns()}{random.random()}".encode(), digest_size=12).hexdigest()
+    return JSONResponse({
+        "id": pid,
+        "object": "payment_intent",
+        "amount": int(form.get("amount", 0)),
+        "currency": form.get("currency", "eur"),
+        "status": "requires_payment_method",
+        "client_secret": f"{pid}_secret_stub",
+        "livemode": False,
+    })
+
+
+app = Starlette(routes=[
+    Route("/ipwhois/{ip}", ipwhois),
+    Route("/ipinfo/{ip}", ipinfo),
+    Route("/dhl/locations", dhl_locations),
+    Route("/stripe/v1/payment_intents", stripe_payment_intents, methods=["POST"]),
+])
+
+
+def main(argv: list[str] | None = None):
+    import uvicorn
+
+    ap = argparse.ArgumentParser(description="Заглушки DHL / geo / Stripe для нагрузочных тестов")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9100)
+    ap.add_argument("--latency-ms", type=float, default=50.0)
+    ap.add_argument("--jitter-ms", type=float, default=20.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    args = ap.parse_args(argv)
+    Behaviour.latency_ms, Behaviour.jitter_ms, Behaviour.error_rate = args.latency_ms, args.jitter_ms, args.error_rate
+
+    base = f"http://{args.host}:{args.port}"
+    print(
+        f"DHL_API_KEY=bench DHL_BASE_URL={base}/dhl/locations "
+        f"GEO_IPWHOIS_URL={base}/ipwhois GEO_IPINFO_URL={base}/ipinfo "
+        f"STRIPE_SECRET_KEY=sk_test_bench STRIPE_API_BASE={base}/stripe",
+        file=sys.stderr,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# caching.py
+import hashlib
+import uuid
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Callable
+
+from fastapi import Depends, HTTPException, Request
+
+from db import get_read_conn, dict_cursor, LazyConn
+
+# Cache-Control по типам ресурсов: каталог меняется редко, отзывы — часто,
+# поэтому отзывы кэшируем, но всегда ревалидируем (304 дешёвый)
+CACHE_CONTROL = {
+    "catalog": "public, max-age=60, stale-while-revalidate=300",
+    "categories": "public, max-age=300, stale-while-revalidate=3600",
+    "reviews": "public, no-cache",
+}
+
+
+async def load_version(conn: LazyConn, key: str) -> tuple[int, datetime | None]:
+    # см. schema_patch_cache.sql — счётчик поднимают триггеры
+    async with dict_cursor(conn) as cur:
+        await cur.execute("select version, updated_at from cache_versions where key = %s", (key,))
+        row = await cur.fetchone()
+    return (row["version"], row["updated_at"]) if row else (0, None)
+
+
+def _etag(key: str, version: int, request: Request) -> str:
+    # ответ зависит и от версии данных, и от параметров запроса (фильтры, locale, slug)
+    variant = f"{key}:{version}:{request.url.path}?{request.url.query}"
+    return 'W/"' + hashlib.blake2b(variant.encode(), digest_size=12).hexdigest() + '"'
+
+
+def _etag_matches(etag: str, if_none_match: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # сравнение weak: W/"x" == "x"
+    tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+    return etag.removeprefix("W/") in tags
+
+
+def _not_modified_since(updated_at: datetime | None, if_modified_since: str) -> bool:
+    if updated_at is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return updated_at.replace(microsecond=0) <= since
+
+
+def reviews_key(request: Request) -> str:
+    # ключ как в триггере: 'reviews:' || product_id::text (канонический uuid)
+    pid = request.query_params.get("product_id", "")
+    try:
+        pid = str(uuid.UUID(pid))
+    except ValueError:
+        pass
+    return f"reviews:{pid}"
+
+
+def conditional_get(kind: str, key: Callable[[Request], str] | None = None):
+    """
+    Зависимость для GET-ручек: считает версию ресурса (один запрос по PK),
+    отвечает 304 на If-None-Match / If-Modified-Since ещё до основного запроса,
+    иначе возвращает заголовки (ETag, Last-Modified, Cache-Control) для ответа.
+    """
+    cache_control = CACHE_CONTROL[kind]
+
+    async def dep(request: Request, conn: LazyConn = Depends(get_read_conn)) -> dict[str, str]:
+        k = key(request) if key else kind
+        version, updated_at = await load_version(conn, k)
+        # для хэндлера: например, снимок каталога годен, только если он этой версии
+        request.state.cache_version = version
+        headers = {"ETag": _etag(k, version, request), "Cache-Control": cache_control}
+        if updated_at is not None:
+            headers["Last-Modified"] = format_datetime(updated_at.astimezone(timezone.utc), usegmt=True)
+
+        inm = request.headers.get("if-none-match")
+        ims = request.headers.get("if-modified-since")
+        if (inm and _etag_matches(headers["ETag"], inm)) or (not inm and ims and _not_modified_since(updated_at, ims)):
+            raise HTTPException(304, headers=headers)
+        return headers
+
+    return dep
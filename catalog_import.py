@@ -0,0 +1,345 @@
+# catalog_import.py
+# Массовая загрузка каталога и переводов: тело запроса (NDJSON или CSV)
+# читается потоком, каждая строка сразу уходит в COPY во временную staging-
+# таблицу, затем одним set-based upsert — в products / product_i18n.
+# Память не зависит от размера файла: в Python держим только текущий чанк
+# тела и первые IMPORT_MAX_REPORTED ошибок.
+#
+# Кэш каталога сбрасывается один раз: триггеры версий на products /
+# product_i18n statement-level (schema_patch_cache.sql), upsert — один statement.
+# Неизменившиеся строки не переписываются (where ... is distinct from).
+import codecs
+import csv
+import io
+import json
+import math
+import os
+import uuid
+from typing import Any, AsyncIterator, Callable
+
+from db import LazyConn, dict_cursor
+from locales import normalize_locale
+
+IMPORT_MAX_REPORTED = int(os.getenv("IMPORT_MAX_REPORTED", "100"))
+
+
+class RowError(ValueError):
+    pass
+
+
+# ----- разбор входного потока -----
+
+async def _ndjson_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, Any]]:
+    buf = b""
+    line_no = 0
+    async for chunk in chunks:
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                yield line_no, _json_line(line)
+    if buf.strip():
+        yield line_no + 1, _json_line(buf)
+
+
+def _json_line(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return RowError(f"invalid JSON: {e}")
+
+
+async def _csv_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, Any]]:
+    # запись CSV может занимать несколько строк (перевод строки внутри кавычек):
+    # копим строки, пока число кавычек нечётное, и только потом разбираем
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    header: list[str] | None = None
+    pending: list[str] = []
+    quotes = 0
+    tail = ""
+    line_no = start = 0
+
+    def parse(text: str) -> list[str]:
+        return next(csv.reader(io.StringIO(text)), [])
+
+    async def lines():
+        nonlocal tail
+        async for chunk in chunks:
+            tail += decoder.decode(chunk)
+            *complete, tail = tail.split("\n")
+            for line in complete:
+                yield line
+        tail += decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
+    async for line in lines():
+        line_no += 1
+        if not pending:
+            start = line_no
+        pending.append(line)
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        text = "\n".join(pending).rstrip("\r")
+        pending, quotes = [], 0
+        if not text.strip():
+            continue
+        values = parse(text)
+        if header is None:
+            header = [h.strip() for h in values]
+            continue
+        if len(values) != len(header):
+            yield start, RowError(f"expected {len(header)} columns, got {len(values)}")
+            continue
+        yield start, {k: (v if v != "" else None) for k, v in zip(header, values)}
+    if pending:
+        yield start, RowError("unterminated quoted field")
+
+
+def records(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[tuple[int, Any]]:
+    return _csv_records(chunks) if fmt == "csv" else _ndjson_records(chunks)
+
+
+# ----- проверка строк -----
+
+def _text(rec: dict, key: str, required: bool = False) -> str | None:
+    v = rec.get(key)
+    if v is None or (isinstance(v, str) and not v.strip()):
+        if required:
+            raise RowError(f"{key} is required")
+        return None
+    if not isinstance(v, (str, int, float)):
+        raise RowError(f"{key} must be a string")
+    return str(v).strip() if key in ("slug", "locale", "product_slug") else str(v)
+
+
+def _uuid(rec: dict, key: str) -> str | None:
+    v = _text(rec, key)
+    if v is None:
+        return None
+    try:
+        return str(uuid.UUID(v))
+    except ValueError:
+        raise RowError(f"{key} is not a uuid")
+
+
+def product_row(rec: dict) -> tuple:
+    price = rec.get("price")
+    try:
+        price = float(price)
+    except (TypeError, ValueError):
+        raise RowError("price must be a number")
+    # nan/inf float() пропускает, а в numeric они ломают сортировку по цене
+    if not math.isfinite(price) or price < 0:
+        raise RowError("price must be a finite number >= 0")
+    image = rec.get("image_url", rec.get("imageUrl"))
+    return (
+        _uuid(rec, "id"), _text(rec, "slug", True), _text(rec, "title", True), _text(rec, "category", True),
+        _text(rec, "sub"), _text(rec, "leaf"), price, _text(rec, "short"), _text(rec, "description"),
+        _text({"image_url": image}, "image_url"),
+    )
+
+
+def i18n_row(rec: dict) -> tuple:
+    raw = _text(rec, "locale", True)
+    locale = normalize_locale(raw)
+    if locale is None:
+        raise RowError(f"unsupported locale {raw!r}")
+    product_id, product_slug = _uuid(rec, "product_id"), _text(rec, "product_slug")
+    if product_id is None and product_slug is None:
+        raise RowError("product_id or product_slug is required")
+    return (
+        product_id, product_slug, locale, _text(rec, "title", True),
+        _text(rec, "short"), _text(rec, "description"), _text(rec, "slug", True),
+    )
+
+
+# ----- загрузка -----
+
+class ImportSpec:
+    """staging-таблица, разбор строки и SQL шагов слияния для одной целевой таблицы."""
+
+    def __init__(self, table: str, staging: str, columns: str, row: Callable[[dict], tuple],
+                 prepare: list[str], conflicts: str, upsert: str):
+        self.table = table
+        self.staging = staging
+        self.columns = columns
+        self.row = row
+        self.prepare = prepare
+        self.conflicts = conflicts
+        self.upsert = upsert
+
+
+PRODUCTS = ImportSpec(
+    table="_products_import",
+    staging="""
+      create temp table _products_import (
+        line int, id uuid, slug text, title text, category text, sub text, leaf text,
+        price numeric, short text, description text, image_url text
+      ) on commit drop
+    """,
+    columns="line, id, slug, title, category, sub, leaf, price, short, description, image_url",
+    row=product_row,
+    prepare=[
+        # без id — ищем товар по slug: в каталоге, затем среди строк импорта с id;
+        # не нашли — новый, один id на slug (повторы slug — правки одного товара)
+        "update _products_import s set id = p.id from products p where s.id is null and p.slug = s.slug",
+        """
+        update _products_import s set id = o.id
+        from (select distinct on (slug) slug, id from _products_import where id is not null
+              order by slug, line desc) o
+        where s.id is null and s.slug = o.slug
+        """,
+        """
+        update _products_import s set id = n.id
+        from (select slug, gen_random_uuid() as id from _products_import where id is null group by slug) n
+        where s.id is null and s.slug = n.slug
+        """,
+    ],
+    conflicts="""
+      with ranked as (
+        select line, slug, id, first_value(id) over w as winner, row_number() over w as rn
+        from _products_import window w as (partition by slug order by line desc)
+      ), bad as (
+        select distinct on (line) line, slug, reason from (
+          select s.line, s.slug, 'slug is used by product ' || p.id::text as reason
+          from _products_import s join products p on p.slug = s.slug and p.id <> s.id
+          union all
+          select line, slug, 'slug is reused later in this import by another product'
+          from ranked where rn > 1 and id <> winner
+        ) c
+        order by line
+      ), del as (
+        delete from _products_import s using bad where s.line = bad.line
+        returning bad.line, bad.slug, bad.reason
+      )
+      select count(*) as n,
+             (select json_agg(d) from (select * from del order by line limit %(limit)s) d) as sample
+      from del
+    """,
+    upsert="""
+      with src as (
+        select distinct on (id) id, slug, title, category, sub, leaf, price, short, description, image_url
+        from _products_import order by id, line desc
+      ), up as (
+        insert into products as p (id, slug, title, category, sub, leaf, price, short, description, image_url)
+        select * from src
+        on conflict (id) do update set
+          slug = excluded.slug, title = excluded.title, category = excluded.category, sub = excluded.sub,
+          leaf = excluded.leaf, price = excluded.price, short = excluded.short,
+          description = excluded.description, image_url = excluded.image_url
+        where (p.slug, p.title, p.category, p.sub, p.leaf, p.price, p.short, p.description, p.image_url)
+              is distinct from
+              (excluded.slug, excluded.title, excluded.category, excluded.sub, excluded.leaf, excluded.price,
+               excluded.short, excluded.description, excluded.image_url)
+        returning (xmax = 0) as inserted
+      )
+      select (select count(*) from src) as rows,
+             count(*) filter (where inserted) as inserted,
+             count(*) filter (where not inserted) as updated
+      from up
+    """,
+)
+
+PRODUCT_I18N = ImportSpec(
+    table="_i18n_import",
+    staging="""
+      create temp table _i18n_import (
+        line int, product_id uuid, product_slug text, locale text,
+        title text, short text, description text, slug text
+      ) on commit drop
+    """,
+    columns="line, product_id, product_slug, locale, title, short, description, slug",
+    row=i18n_row,
+    prepare=[
+        "update _i18n_import s set product_id = p.id from products p where s.product_id is null and p.slug = s.product_slug",
+    ],
+    conflicts="""
+      with ranked as (
+        select line, locale, slug, product_id, first_value(product_id) over w as winner, row_number() over w as rn
+        from _i18n_import window w as (partition by locale, slug order by line desc)
+      ), bad as (
+        select distinct on (line) line, locale, slug, reason from (
+          select s.line, s.locale, s.slug, 'unknown product' as reason
+          from _i18n_import s
+          where s.product_id is null or not exists (select 1 from products p where p.id = s.product_id)
+          union all
+          select s.line, s.locale, s.slug, '(locale, slug) is used by product ' || i.product_id::text
+          from _i18n_import s
+          join product_i18n i on i.locale = s.locale and i.slug = s.slug and i.product_id <> s.product_id
+          union all
+          select line, locale, slug, '(locale, slug) is reused later in this import by another product'
+          from ranked where rn > 1 and product_id <> winner
+        ) c
+        order by line
+      ), del as (
+        delete from _i18n_import s using bad where s.line = bad.line
+        returning bad.line, bad.locale, bad.slug, bad.reason
+      )
+      select count(*) as n,
+             (select json_agg(d) from (select * from del order by line limit %(limit)s) d) as sample
+      from del
+    """,
+    upsert="""
+      with src as (
+        select distinct on (product_id, locale) product_id, locale, title, short, description, slug
+        from _i18n_import order by product_id, locale, line desc
+      ), up as (
+        insert into product_i18n as i (product_id, locale, title, short, description, slug)
+        select * from src
+        on conflict (product_id, locale) do update set
+          title = excluded.title, short = excluded.short, description = excluded.description, slug = excluded.slug
+        where (i.title, i.short, i.description, i.slug)
+              is distinct from (excluded.title, excluded.short, excluded.description, excluded.slug)
+        returning (xmax = 0) as inserted
+      )
+      select (select count(*) from src) as rows,
+             count(*) filter (where inserted) as inserted,
+             count(*) filter (where not inserted) as updated
+      from up
+    """,
+)
+
+
+async def run_import(conn: LazyConn, spec: ImportSpec, chunks: AsyncIterator[bytes], fmt: str) -> dict:
+    """Весь импорт — одна транзакция: ошибка посреди — ничего не записано."""
+    received = 0
+    errors: list[dict] = []
+    error_count = 0
+    async with conn.acquire() as c:
+        async with dict_cursor(c) as cur:
+            await cur.execute(spec.staging)
+            async with cur.copy(f"copy {spec.table} ({spec.columns}) from stdin") as copy:
+                async for line, rec in records(chunks, fmt):
+                    received += 1
+                    try:
+                        if isinstance(rec, Exception):
+                            raise rec
+                        if not isinstance(rec, dict):
+                            raise RowError("row must be an object")
+                        row = spec.row(rec)
+                    except RowError as e:
+                        error_count += 1
+                        if len(errors) < IMPORT_MAX_REPORTED:
+                            errors.append({"line": line, "error": str(e)})
+                        continue
+                    await copy.write_row((line, *row))
+            for sql in spec.prepare:
+                await cur.execute(sql)
+            await cur.execute(spec.conflicts, {"limit": IMPORT_MAX_REPORTED})
+            conflicts = await cur.fetchone()
+            await cur.execute(spec.upsert)
+            merged = await cur.fetchone()
+    staged = merged["rows"]
+    return {
+        "received": received,
+        "inserted": merged["inserted"],
+        "updated": merged["updated"],
+        "unchanged": staged - merged["inserted"] - merged["updated"],
+        "error_count": error_count,
+        "errors": errors,
+        "conflict_count": conflicts["n"],
+        "conflicts": conflicts["sample"] or [],
+    }
@@ -0,0 +1,369 @@
+# catalog_snapshot.py
+# Снимок каталога в одном бинарном файле на хост: все воркеры uvicorn
+# mmap'ят его read-only — одна копия в page cache вместо N копий в куче,
+# старт воркера — открыть файл, без прогрева.
+#
+# Формат (порядок байт — нативный: файл строится и читается на одном хосте):
+#   MAGIC | u32 длина каталога | JSON-каталог | секции, выровненные по 8
+#   каталог: версия 'catalog' из cache_versions, число строк, локали,
+#            секции {имя: [смещение, typecode, count]}, группы category/sub/leaf
+#   str_offsets/str_blob  — таблица строк (UTF-8), столбцы хранят её индексы
+#   id, slug, title, ...  — u32 индексы строк (NULL = 0xFFFFFFFF)
+#   price, rating         — float64 (rating NULL = NaN)
+#   <loc>.slug, ...       — переводы, тот же формат
+#   by_slug, <loc>.by_slug, by_price, by_price_desc — перестановки строк для
+#                           поиска/сортировки; при равной цене — порядок popular
+#   postings              — номера строк групп category/sub/leaf
+# Строки лежат в порядке сортировки popular, так что она — без сортировки вовсе.
+#
+# Снимок отдаётся, только если его версия = текущей версии каталога (её уже
+# читает conditional_get), иначе — обычный SQL. Фоновый цикл в каждом воркере
+# замечает новую версию; перестраивает один (flock), пишет во временный файл
+# и атомарно подменяет os.replace, остальные просто перечитывают.
+import array
+import asyncio
+import bisect
+import fcntl
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+
+from admission import LOW, Overloaded
+from db import LazyConn, dict_cursor, pool
+from locales import LOCALES
+from metrics import collector
+
+logger = logging.getLogger(__name__)
+
+CATALOG_SNAPSHOT = os.getenv("CATALOG_SNAPSHOT", "0").strip().lower() in ("1", "true", "yes")
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH") or os.path.join(tempfile.gettempdir(), "mira_catalog.snap")
+CATALOG_SNAPSHOT_INTERVAL = float(os.getenv("CATALOG_SNAPSHOT_INTERVAL", "5"))
+# фильтры без постингов (цена, рейтинг) и сортировка по цене внутри группы — проход
+# по кандидатам в Python; больше стольких строк — отдаём запрос в SQL
+CATALOG_SNAPSHOT_SCAN_MAX = int(os.getenv("CATALOG_SNAPSHOT_SCAN_MAX", "20000"))
+
+MAGIC = b"MIRACAT2"
+NULL = 0xFFFFFFFF
+STR_COLUMNS = ("id", "slug", "title", "category", "sub", "leaf", "short", "description", "image_url")
+I18N_COLUMNS = ("slug", "title", "short", "description")
+GROUPS = ("category", "sub", "leaf")
+# поле ответа (алиас ProductOut) → столбец снимка
+FIELD_COLUMNS = {"imageUrl": "image_url"}
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+# ----- чтение -----
+
+class Snapshot:
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:8] != MAGIC:
+            raise ValueError(f"{path}: not a catalog snapshot")
+        (dir_len,) = struct.unpack_from("=I", self._mm, 8)
+        meta = json.loads(self._mm[12:12 + dir_len])
+        base = _align(12 + dir_len)
+        buf = memoryview(self._mm)
+        self.version: int = meta["version"]
+        self.rows: int = meta["rows"]
+        self.size = len(self._mm)
+        self._col: dict[str, memoryview] = {}
+        for name, (off, typecode, count) in meta["sections"].items():
+            size = array.array(typecode).itemsize
+            self._col[name] = buf[base + off: base + off + count * size].cast(typecode)
+        self._offsets = self._col["str_offsets"]
+        self._blob = self._col["str_blob"]
+        # группы — сотни ключей: словарь в памяти воркера, сами номера строк — в mmap
+        self._groups: dict[str, dict[str, tuple[int, int, int]]] = {
+            g: {k: tuple(v) for k, v in meta["groups"][g].items()} for g in GROUPS
+        }
+
+    def s(self, idx: int) -> str | None:
+        if idx == NULL:
+            return None
+        return str(self._blob[self._offsets[idx]:self._offsets[idx + 1]], "utf-8")
+
+    def _value(self, row: int, field: str, loc: str | None):
+        col = FIELD_COLUMNS.get(field, field)
+        if col == "price":
+            return self._col["price"][row]
+        if col == "rating":
+            r = self._col["rating"][row]
+            return None if math.isnan(r) else r
+        if loc and col in I18N_COLUMNS:
+            v = self._col[f"{loc}.{col}"][row]
+            if v != NULL:
+                return self.s(v)
+        return self.s(self._col[col][row])
+
+    def row(self, row: int, fields: list[str], loc: str | None) -> dict:
+        """Строка в форме ProductOut; loc — как coalesce(i_loc.*, p.*) в SQL."""
+        return {f: self._value(row, f, loc) for f in fields}
+
+    def find_slug(self, slug: str, loc: str | None = None) -> int | None:
+        col = self._col[f"{loc}.slug" if loc else "slug"]
+        perm = self._col[f"{loc}.by_slug" if loc else "by_slug"]
+        i = bisect.bisect_left(perm, slug, key=lambda r: self.s(col[r]))
+        if i < len(perm) and self.s(col[perm[i]]) == slug:
+            return perm[i]
+        return None
+
+    def query(
+        self, *, category=None, sub=None, leaf=None, price_min=None, price_max=None, rating_min=None,
+        sort: str = "popular", limit: int = 24, offset: int = 0,
+    ) -> tuple[int, list[int]] | None:
+        """(total, номера строк страницы); None — дорого для снимка, пусть отвечает SQL."""
+        # кандидаты — самый короткий постинг из заданных групп, остальные группы проверяем построчно
+        cand, chosen = range(self.rows), None
+        checks: list[tuple[str, int]] = []
+        for g, value in zip(GROUPS, (category, sub, leaf)):
+            # пустое значение — без фильтра, как в SQL-ветке list_products
+            if not value:
+                continue
+            hit = self._groups[g].get(value)
+            if hit is None:
+                return 0, []
+            off, count, sidx = hit
+            checks.append((g, sidx))
+            if chosen is None or count < len(cand):
+                cand, chosen = self._col["postings"][off:off + count], g
+        scan = [(g, sidx) for g, sidx in checks if g != chosen]
+        price, rating = self._col["price"], self._col["rating"]
+        needs_filter = bool(scan) or price_min is not None or price_max is not None or rating_min is not None
+
+        if not needs_filter:
+            n = len(cand)
+            if sort == "popular":
+                return n, list(cand[offset:offset + limit])
+            if chosen is None:
+                perm = self._col["by_price" if sort == "price-asc" else "by_price_desc"]
+                return n, list(perm[offset:offset + limit])
+
+        if len(cand) > CATALOG_SNAPSHOT_SCAN_MAX:
+            return None
+        cols = {g: self._col[g] for g, _ in scan}
+        rows = [
+            r for r in cand
+            if all(cols[g][r] == sidx for g, sidx in scan)
+            and (price_min is None or price[r] >= price_min)
+            and (price_max is None or price[r] <= price_max)
+            and (rating_min is None or (not math.isnan(rating[r]) and rating[r] >= rating_min))
+        ]
+        if sort != "popular":
+            # сортировка устойчива и с reverse: равные цены остаются в порядке popular, как в by_price*
+            rows.sort(key=price.__getitem__, reverse=sort == "price-desc")
+        return len(rows), rows[offset:offset + limit]
+
+
+# ----- сборка -----
+
+def _write(path: str, version: int, products: list[tuple], i18n: dict[str, dict[str, tuple]]) -> int:
+    strings: dict[str, int] = {}
+    blob = bytearray()
+    offsets = array.array("Q", [0])
+
+    def sid(v: str | None) -> int:
+        if v is None:
+            return NULL
+        i = strings.get(v)
+        if i is None:
+            i = strings[v] = len(offsets) - 1
+            blob.extend(v.encode())
+            offsets.append(len(blob))
+        return i
+
+    n = len(products)
+    cols = {c: array.array("I") for c in STR_COLUMNS}
+    tr = {f"{loc}.{c}": array.array("I") for loc in LOCALES for c in I18N_COLUMNS}
+    price, rating = array.array("d"), array.array("d")
+    groups: dict[str, dict[str, list[int]]] = {g: {} for g in GROUPS}
+    for r, (pid, slug, title, category, sub, leaf, p, rt, short, description, image_url) in enumerate(products):
+        for c, v in zip(STR_COLUMNS, (pid, slug, title, category, sub, leaf, short, description, image_url)):
+            cols[c].append(sid(v))
+        price.append(p)
+        rating.append(math.nan if rt is None else rt)
+        for g, v in zip(GROUPS, (category, sub, leaf)):
+            if v is not None:
+                groups[g].setdefault(v, []).append(r)
+        for loc in LOCALES:
+            t = i18n[loc].get(pid, (None,) * len(I18N_COLUMNS))
+            for c, v in zip(I18N_COLUMNS, t):
+                tr[f"{loc}.{c}"].append(sid(v))
+
+    sections: dict[str, array.array | bytes] = {"str_offsets": offsets, "str_blob": bytes(blob)}
+    sections.update(cols)
+    sections["price"], sections["rating"] = price, rating
+    sections.update(tr)
+    sections["by_slug"] = array.array("I", sorted(range(n), key=lambda r: products[r][1] or ""))
+    sections["by_price"] = array.array("I", sorted(range(n), key=lambda r: products[r][6]))
+    sections["by_price_desc"] = array.array("I", sorted(range(n), key=lambda r: products[r][6], reverse=True))
+    for loc in LOCALES:
+        slugs = tr[f"{loc}.slug"]
+        has = [r for r in range(n) if slugs[r] != NULL]
+        by_loc = {pid: t[0] for pid, t in i18n[loc].items()}
+        sections[f"{loc}.by_slug"] = array.array("I", sorted(has, key=lambda r: by_loc[products[r][0]]))
+    postings = array.array("I")
+    meta_groups: dict[str, dict[str, list[int]]] = {g: {} for g in GROUPS}
+    for g in GROUPS:
+        for value, rows in groups[g].items():
+            meta_groups[g][value] = [len(postings), len(rows), strings[value]]
+            postings.extend(rows)
+    sections["postings"] = postings
+
+    layout, off = {}, 0
+    for name, data in sections.items():
+        if isinstance(data, array.array):
+            layout[name] = [off, data.typecode, len(data)]
+            off = _align(off + len(data) * data.itemsize)
+        else:
+            layout[name] = [off, "B", len(data)]
+            off = _align(off + len(data))
+    meta = json.dumps({"version": version, "rows": n, "locales": LOCALES, "sections": layout,
+                       "groups": meta_groups}, ensure_ascii=False).encode()
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("=I", len(meta)) + meta)
+        f.write(b"\0" * (_align(12 + len(meta)) - 12 - len(meta)))
+        for name, data in sections.items():
+            raw = data.tobytes() if isinstance(data, array.array) else data
+            f.write(raw)
+            f.write(b"\0" * (_align(len(raw)) - len(raw)))
+        f.flush()
+        os.fsync(f.fileno())
+    # rename атомарен: читатель видит либо старый файл целиком, либо новый
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+
+async def build(path: str = CATALOG_SNAPSHOT_PATH) -> int:
+    """Снять каталог одним согласованным снимком БД и записать файл; возвращает версию."""
+    conn = LazyConn(pool, priority=LOW)
+    i18n: dict[str, dict[str, tuple]] = {loc: {} for loc in LOCALES}
+    async with conn.acquire() as c:
+        async with c.cursor() as cur:
+            # версия и данные — из одного снимка: файл не может оказаться новее своей версии
+            await cur.execute("set transaction isolation level repeatable read, read only")
+            await cur.execute("select coalesce((select version from cache_versions where key = 'catalog'), 0)")
+            (version,) = await cur.fetchone()
+            products = [r async for r in cur.stream("""
+              select id::text, slug, title, category, sub, leaf, price::float, rating::float,
+                     short, description, image_url
+              from products
+              order by rating desc nulls last, price asc, id
+            """)]
+            async for pid, loc, slug, title, short, description in cur.stream(
+                "select product_id::text, locale, slug, title, short, description from product_i18n"
+            ):
+                if loc in i18n:
+                    i18n[loc][pid] = (slug, title, short, description)
+    size = await asyncio.to_thread(_write, path, version, products, i18n)
+    logger.info("catalog snapshot v%d: %d products, %.1f MB", version, len(products), size / 2**20)
+    return version
+
+
+# ----- жизненный цикл в воркере -----
+
+_current: Snapshot | None = None
+_task: asyncio.Task | None = None
+
+
+def fresh(version: int | None) -> Snapshot | None:
+    """Снимок, если он ровно той версии каталога, что видит запрос."""
+    snap = _current
+    if snap is None or version is None or snap.version != version:
+        return None
+    return snap
+
+
+def _file_version(path: str) -> int | None:
+    try:
+        with open(path, "rb") as f:
+            head = f.read(12)
+            if head[:8] != MAGIC:
+                return None
+            return json.loads(f.read(struct.unpack_from("=I", head, 8)[0]))["version"]
+    except (OSError, ValueError):
+        return None
+
+
+def _load(path: str):
+    global _current
+    try:
+        _current = Snapshot(path)
+    except (OSError, ValueError) as e:
+        logger.warning("catalog snapshot %s is not usable: %s", path, e)
+
+
+async def _catalog_version() -> int:
+    async with dict_cursor(LazyConn(pool, priority=LOW)) as cur:
+        await cur.execute("select version from cache_versions where key = 'catalog'")
+        row = await cur.fetchone()
+    return row["version"] if row else 0
+
+
+async def refresh(path: str = CATALOG_SNAPSHOT_PATH):
+    version = await _catalog_version()
+    if _current is not None and _current.version == version:
+        return
+    if _file_version(path) != version:
+        with open(path + ".lock", "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # строит другой воркер — подхватим на следующем круге
+            try:
+                if _file_version(path) != version:
+                    await build(path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    # старый Snapshot освобождается, когда на него не останется ссылок у запросов
+    _load(path)
+
+
+async def _run():
+    while True:
+        try:
+            await refresh()
+        except Overloaded:
+            pass
+        except Exception:
+            logger.exception("catalog snapshot refresh failed")
+        await asyncio.sleep(CATALOG_SNAPSHOT_INTERVAL)
+
+
+async def startup():
+    # вызывается из lifespan: готовый файл — сразу в работу, свежесть проверит цикл
+    global _task
+    if not CATALOG_SNAPSHOT:
+        return
+    if os.path.exists(CATALOG_SNAPSHOT_PATH):
+        _load(CATALOG_SNAPSHOT_PATH)
+    _task = asyncio.create_task(_run())
+
+
+async def shutdown():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+@collector
+def _snapshot_metrics():
+    snap = _current
+    yield ("catalog_snapshot_version", "gauge", "Catalog version of the mapped snapshot",
+           [({}, snap.version)] if snap else [])
+    yield ("catalog_snapshot_bytes", "gauge", "Size of the mapped catalog snapshot",
+           [({}, snap.size)] if snap else [])
@@ -0,0 +1,209 @@
+# compression.py
+import os
+import zlib
+from collections import OrderedDict
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from metrics import collector
+
+try:
+    import brotli  # опционально: pip install brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_CACHE_MB = int(os.getenv("COMPRESS_CACHE_MB", "32"))
+
+# динамические ответы жмём быстро; ответы с ETag жмём один раз и сильнее —
+# дальше они отдаются из кэша
+GZIP_LEVEL, GZIP_LEVEL_CACHED = 5, 9
+BR_QUALITY, BR_QUALITY_CACHED = 4, 6
+
+_COMPRESSIBLE = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+
+def negotiate_encoding(accept_encoding: str) -> str | None:
+    """br > gzip по Accept-Encoding (с учётом q=0); None — не сжимаем."""
+    prefs: dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            prefs[name.strip()] = q
+    wildcard = prefs.get("*", 0.0)
+    for enc in ("br", "gzip"):
+        if enc == "br" and brotli is None:
+            continue
+        if prefs.get(enc, wildcard) > 0:
+            return enc
+    return None
+
+
+def compress(data: bytes, encoding: str, cached: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=BR_QUALITY_CACHED if cached else BR_QUALITY)
+    c = zlib.compressobj(GZIP_LEVEL_CACHED if cached else GZIP_LEVEL, zlib.DEFLATED, 31)
+    return c.compress(data) + c.flush()
+
+
+class _StreamCompressor:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=BR_QUALITY)
+            self.process, self.finish = self._c.process, self._c.finish
+        else:
+            self._c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self.process, self.finish = self._c.compress, self._c.flush
+
+
+class CompressedCache:
+    """LRU сжатых тел по (ETag, encoding) с лимитом по байтам."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+
+    def get(self, key: tuple[str, str]) -> bytes | None:
+        body = self._data.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def put(self, key: tuple[str, str], body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self._data[key] = body
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self.size -= len(evicted)
+
+
+compressed_cache = CompressedCache(COMPRESS_CACHE_MB * 1024 * 1024)
+
+
+@collector
+def _cache_metrics():
+    c = compressed_cache
+    yield "compressed_cache_hits_total", "counter", "Compressed body cache hits", [({}, c.hits)]
+    yield "compressed_cache_misses_total", "counter", "Compressed body cache misses", [({}, c.misses)]
+    yield "compressed_cache_bytes", "gauge", "Compressed body cache size", [({}, c.size)]
+
+
+class CompressionMiddleware:
+    """
+    gzip/brotli по Accept-Encoding для ответов от minimum_size байт.
+    Ответы с ETag (каталог, дерево категорий, отзывы — см. caching.py) жмутся
+    один раз и дальше берутся из compressed_cache. Стриминговые ответы
+    сжимаются на лету.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESS_MIN_SIZE, cache: CompressedCache = compressed_cache):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache = cache
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _Responder(self, encoding, send).send)
+
+
+class _Responder:
+    def __init__(self, mw: CompressionMiddleware, encoding: str, send: Send):
+        self.mw = mw
+        self.encoding = encoding
+        self._send = send
+        self.start: Message | None = None
+        self.mode: str | None = None  # None → ждём первое тело; "plain" | "stream"
+        self.stream: _StreamCompressor | None = None
+
+    def _compressible(self, headers: MutableHeaders) -> bool:
+        if self.start["status"] in (204, 304) or "content-encoding" in headers:
+            return False
+        ctype = headers.get("content-type", "")
+        return ctype.startswith(_COMPRESSIBLE)
+
+    def _mark_encoded(self, headers: MutableHeaders):
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+
+    async def send(self, message: Message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        if self.mode == "plain":
+            await self._send(message)
+            return
+        if self.mode == "stream":
+            more = message.get("more_body", False)
+            out = self.stream.process(message.get("body", b""))
+            if not more:
+                out += self.stream.finish()
+            if out or not more:
+                await self._send({"type": "http.response.body", "body": out, "more_body": more})
+            return
+
+        headers = MutableHeaders(raw=self.start["headers"])
+        body = message.get("body", b"")
+        more = message.get("more_body", False)
+
+        if not self._compressible(headers) or (not more and len(body) < self.mw.minimum_size):
+            self.mode = "plain"
+            await self._send(self.start)
+            await self._send(message)
+            return
+
+        if more:
+            # стриминг: длина заранее неизвестна
+            self.mode = "stream"
+            self.stream = _StreamCompressor(self.encoding)
+            self._mark_encoded(headers)
+            del headers["content-length"]
+            await self._send(self.start)
+            out = self.stream.process(body)
+            if out:
+                await self._send({"type": "http.response.body", "body": out, "more_body": True})
+            return
+
+        # целое тело: для ответов с ETag — через кэш сжатых тел
+        cc = headers.get("cache-control", "")
+        etag = headers.get("etag")
+        cacheable = bool(etag) and "no-store" not in cc and "private" not in cc
+        compressed = self.mw.cache.get((etag, self.encoding)) if cacheable else None
+        if compressed is None:
+            compressed = compress(body, self.encoding, cached=cacheable)
+            if cacheable:
+                self.mw.cache.put((etag, self.encoding), compressed)
+
+        self.mode = "plain"
+        self._mark_encoded(headers)
+        headers["Content-Length"] = str(len(compressed))
+        await self._send(self.start)
+        await self._send({"type": "http.response.body", "body": compressed, "more_body": False})
@@ -1,27 +1,333 @@
 # db.py
+import asyncio
+import contextvars
 import os
+import time
+from contextlib import asynccontextmanager, AsyncExitStack
+from typing import Any, AsyncIterator
+
 from dotenv import load_dotenv
+from fastapi import Request
+from psycopg import AsyncConnection
+from psycopg.adapt import Loader
 from psycopg_pool import AsyncConnectionPool
 from psycopg.rows import dict_row
 
+from admission import BROWSE, controller, current_priority, default_priority
+from metrics import Counter, Histogram, collector
+from profiling import QUERY_PROFILE, ProfiledCursor, current_route
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL is not set.")
 
+# реплика для чтения каталога; если не задана — всё читаем с primary
+DATABASE_REPLICA_URL = (os.getenv("DATABASE_REPLICA_URL") or "").strip() or None
+
+# эндпоинты, где JSON ответа собирает сам Postgres (json_build_object/json_agg),
+# а Python только пересылает байты: PG_JSON_ENDPOINTS=products,orders,reviews
+PG_JSON_ENDPOINTS = {
+    e.strip() for e in (os.getenv("PG_JSON_ENDPOINTS") or "").split(",") if e.strip()
+}
+
+# read-your-writes: после записи сессия читает с primary ещё N секунд
+PRIMARY_PIN_COOKIE = "mira_primary_until"
+PRIMARY_PIN_SECONDS = int(os.getenv("PRIMARY_PIN_SECONDS", "5"))
+
+# statement_timeout по умолчанию для всех соединений (мс, 0 — без лимита);
+# тяжёлым роутам задаётся свой бюджет зависимостью statement_timeout(ms)
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+# клиент ушёл — отменяем его запрос на сервере, а не держим соединение пула.
+# Только для чтения (get_read_conn): отмена записи откатила бы, например, заказ,
+# уже оплаченный в Stripe
+DB_CANCEL_ON_DISCONNECT = os.getenv("DB_CANCEL_ON_DISCONNECT", "1").strip().lower() in ("1", "true", "yes")
+
+
+async def _configure(conn: AsyncConnection):
+    # 👇 фикс: схема выставляется один раз на физическое соединение,
+    # а не на каждый checkout (иначе лишний round trip на каждый блок запросов)
+    await conn.execute("SET search_path TO mira, public")
+    if DB_STATEMENT_TIMEOUT_MS:
+        await conn.execute(f"SET statement_timeout = {DB_STATEMENT_TIMEOUT_MS}")
+    await conn.commit()
+    if QUERY_PROFILE:
+        # все cursor()/execute() соединения идут через профилирующий курсор
+        conn.cursor_factory = ProfiledCursor
+
+
 pool = AsyncConnectionPool(
     DATABASE_URL,
     min_size=1,
     max_size=10,
     open=False,
+    configure=_configure,
+    name="primary",
+)
+
+replica_pool = AsyncConnectionPool(
+    DATABASE_REPLICA_URL,
+    min_size=1,
+    max_size=10,
+    open=False,
+    configure=_configure,
+    name="replica",
+) if DATABASE_REPLICA_URL else None
+
+CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds", "Time waiting for a connection from the pool", ("pool",),
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+
+QUERIES_CANCELLED = Counter(
+    "db_queries_cancelled_total", "Queries cancelled by statement_timeout or client disconnect", ("reason",),
 )
 
-async def get_conn():
-    async with pool.connection() as conn:
-        # 👇 фикс: явно выставляем схему для каждой сессии
-        await conn.execute("SET search_path TO mira, public")
-        yield conn
+# бюджет statement_timeout текущего запроса (мс); ставится зависимостью statement_timeout
+_statement_timeout: contextvars.ContextVar[int | None] = contextvars.ContextVar("statement_timeout", default=None)
+
+
+def statement_timeout(ms: int):
+    """
+    Зависимость роута: statement_timeout для всех запросов хэндлера.
+    Применяется при checkout'е как SET LOCAL — действует до конца транзакции
+    блока и сам сбрасывается на дефолт соединения.
+    """
+
+    async def dep():
+        _statement_timeout.set(ms)
+
+    return dep
+
+
+# мгновенные значения из get_stats(); остальное — накопительные счётчики
+_POOL_GAUGES = {"pool_min", "pool_max", "pool_size", "pool_available", "requests_waiting"}
+
+
+@collector
+def _pool_metrics():
+    pools = [p for p in (pool, replica_pool) if p is not None]
+    stats = {p.name: p.get_stats() for p in pools}
+    keys = sorted({k for st in stats.values() for k in st})
+    for key in keys:
+        kind = "gauge" if key in _POOL_GAUGES else "counter"
+        name = f"db_{key}" if kind == "gauge" else f"db_{key}_total"
+        samples = [({"pool": n}, st[key]) for n, st in stats.items() if key in st]
+        yield name, kind, f"psycopg_pool stat {key}", samples
+
+
+class LazyConn:
+    """
+    Ленивый хэндл соединения: из пула берём только на время блока запросов.
+
+    `cursor()` / `transaction()` сами берут соединение и отдают его обратно
+    на выходе (commit/rollback — как у `pool.connection()`). Вложенные блоки
+    переиспользуют уже взятое соединение.
 
-def dict_cursor(conn):
+    Контракт: запрос — не одна транзакция, каждый внешний блок коммитится сам.
+    Хэндлер, который пишет больше чем в одном блоке (или читает в одном, а
+    решение о записи принимает в другом), оборачивает их в
+    `async with conn.acquire():` — как update_me в routers/auth.py.
+
+    Один хэндл на запрос (кэш зависимостей FastAPI), параллельно из одного
+    запроса не использовать.
+    """
+
+    def __init__(self, pool: AsyncConnectionPool, receive=None, priority: int = BROWSE):
+        self._pool = pool
+        self._conn: AsyncConnection | None = None
+        # ASGI receive запроса: по http.disconnect отменяем текущий запрос в БД;
+        # только для чтения — наблюдатель ещё и забирает сообщения receive
+        self._receive = receive
+        # класс admission control по методу; роут может переопределить зависимостью priority()
+        self._priority = priority
+        self.disconnected = False
+
+    @property
+    def acquired(self) -> bool:
+        return self._conn is not None
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[AsyncConnection]:
+        if self._conn is not None:
+            yield self._conn
+            return
+        t0 = time.perf_counter()
+        # при перегрузке пула низкий приоритет получает Overloaded сразу, не вставая в очередь
+        async with controller(self._pool.name).connection(self._pool, current_priority(self._priority)) as conn:
+            CHECKOUT_SECONDS.observe(time.perf_counter() - t0, self._pool.name)
+            self._conn = conn
+            watcher = asyncio.ensure_future(self._watch_disconnect(conn)) if self._receive else None
+            try:
+                ms = _statement_timeout.get()
+                if ms is not None and ms != DB_STATEMENT_TIMEOUT_MS:
+                    # is_local=true: только до конца транзакции этого блока
+                    await conn.execute("select set_config('statement_timeout', %s, true)", (str(ms),))
+                yield conn
+            finally:
+                self._conn = None
+                if watcher is not None:
+                    # дожидаемся остановки до возврата соединения в пул: поздний
+                    # cancel иначе попал бы в запрос следующего владельца
+                    watcher.cancel()
+                    await asyncio.wait([watcher])
+
+    async def _watch_disconnect(self, conn: AsyncConnection):
+        # тело запроса FastAPI уже прочитал: следующее сообщение — только http.disconnect
+        while True:
+            message = await self._receive()
+            if message["type"] == "http.disconnect":
+                break
+        self.disconnected = True
+        if self._conn is not conn:
+            return  # блок уже вышел — отменять нечего
+        # без запроса в полёте отмена — no-op; с запросом — он падает с QueryCanceled
+        await conn.cancel_safe()
+
+    @asynccontextmanager
+    async def cursor(self, *args, **kwargs):
+        async with self.acquire() as conn:
+            async with conn.cursor(*args, **kwargs) as cur:
+                yield cur
+
+    @asynccontextmanager
+    async def transaction(self):
+        async with self.acquire() as conn:
+            async with conn.transaction() as tx:
+                yield tx
+
+    @asynccontextmanager
+    async def pipeline(self):
+        # pipeline mode: запросы копятся и уходят одним flush'ем
+        async with self.acquire() as conn:
+            async with conn.pipeline() as p:
+                yield p
+
+
+def _mark_route(request: Request):
+    # для профилировщика: из какого роута идут запросы
+    route = request.scope.get("route")
+    current_route.set(getattr(route, "path", None) or request.url.path)
+
+def _receive_for(request: Request):
+    return request.receive if DB_CANCEL_ON_DISCONNECT else None
+
+async def get_conn(request: Request) -> LazyConn:
+    # соединение из пула не занимаем, пока хэндлер реально не пошёл в БД;
+    # без отмены по disconnect — через primary идут записи
+    if QUERY_PROFILE:
+        _mark_route(request)
+    return LazyConn(pool, priority=default_priority(request))
+
+async def get_conn_ro(request: Request) -> LazyConn:
+    # primary, но хэндлер только читает (нужна свежесть, реплика не годится):
+    # ушедший клиент отменяет запрос, как в get_read_conn
+    if QUERY_PROFILE:
+        _mark_route(request)
+    return LazyConn(pool, _receive_for(request), default_priority(request))
+
+# readiness: результат проверки БД кэшируется, чтобы частые пробы балансировщика
+# не занимали соединения пула
+DB_PROBE_TTL = float(os.getenv("DB_PROBE_TTL", "2"))
+DB_PROBE_TIMEOUT = float(os.getenv("DB_PROBE_TIMEOUT", "2"))
+_probe: tuple[float, bool] = (0.0, False)
+_probe_lock = asyncio.Lock()
+
+
+async def db_ready() -> bool:
+    global _probe
+    async with _probe_lock:
+        checked_at, ok = _probe
+        if time.monotonic() - checked_at < DB_PROBE_TTL:
+            return ok
+        ok = await _probe_db()
+        _probe = (time.monotonic(), ok)
+        return ok
+
+async def _probe_db() -> bool:
+    try:
+        async with pool.connection(timeout=DB_PROBE_TIMEOUT) as conn:
+            await conn.execute("select 1")
+        return True
+    except Exception:
+        return False
+
+def _pinned_to_primary(request: Request) -> bool:
+    raw = request.cookies.get(PRIMARY_PIN_COOKIE)
+    try:
+        return bool(raw) and float(raw) > time.time()
+    except ValueError:
+        return False
+
+async def get_read_conn(request: Request) -> LazyConn:
+    # только чтение: реплика, если она есть и сессия недавно ничего не писала
+    if QUERY_PROFILE:
+        _mark_route(request)
+    if replica_pool is None or _pinned_to_primary(request):
+        return LazyConn(pool, _receive_for(request), default_priority(request))
+    return LazyConn(replica_pool, _receive_for(request), default_priority(request))
+
+def dict_cursor(conn: LazyConn | AsyncConnection):
     return conn.cursor(row_factory=dict_row)
+
+async def fetch_pipelined(conn: LazyConn, *queries: tuple[str, Any]) -> list[list[dict]]:
+    """
+    Независимые друг от друга select'ы за один round trip (pipeline mode).
+    Возвращает fetchall() каждого запроса в том же порядке.
+    Если упал один запрос — остальные в этом pipeline тоже отменяются.
+    """
+    async with conn.pipeline(), AsyncExitStack() as stack:
+        curs = [await stack.enter_async_context(dict_cursor(conn)) for _ in queries]
+        for cur, (sql, params) in zip(curs, queries):
+            await cur.execute(sql, params)
+        return [await cur.fetchall() for cur in curs]
+
+class _RawJSONLoader(Loader):
+    # json из Postgres — сразу bytes, без json.loads в dict
+    def load(self, data) -> bytes:
+        return bytes(data)
+
+def pg_json_enabled(endpoint: str) -> bool:
+    return endpoint in PG_JSON_ENDPOINTS
+
+async def fetch_json(conn: LazyConn, sql: str, params: Any = None) -> bytes:
+    """Запрос, возвращающий одно json-значение (json_build_object/json_agg) → сырые байты."""
+    row = await fetch_json_row(conn, sql, params)
+    return row[0] if row and row[0] is not None else b"null"
+
+async def fetch_json_row(conn: LazyConn, sql: str, params: Any = None) -> tuple | None:
+    """Как fetch_json, но вся строка: json-колонки — сырыми байтами, остальные как обычно."""
+    async with conn.cursor() as cur:
+        cur.adapters.register_loader("json", _RawJSONLoader)
+        await cur.execute(sql, params)
+        return await cur.fetchone()
+
+async def stream_json_array(
+    conn: LazyConn, sql: str, params: Any = None, chunk_size: int = 64 * 1024
+) -> AsyncIterator[bytes]:
+    """
+    Запрос, где каждая строка — один json-объект, стримится как JSON-массив.
+    Строки идут из single-row mode, в памяти держим только текущий чанк.
+    Соединение занято, пока клиент читает ответ.
+    """
+    async with conn.cursor() as cur:
+        cur.adapters.register_loader("json", _RawJSONLoader)
+        buf = bytearray(b"[")
+        first = True
+        async for (obj,) in cur.stream(sql, params):
+            if not first:
+                buf += b","
+            buf += obj
+            first = False
+            if len(buf) >= chunk_size:
+                yield bytes(buf)
+                buf.clear()
+        buf += b"]"
+        yield bytes(buf)
+
+
+def query_cancel_reason(exc: Exception) -> str:
+    """QueryCanceled: сработал statement_timeout или отмена (клиент ушёл)."""
+    msg = (getattr(exc, "diag", None) and exc.diag.message_primary) or str(exc)
+    return "timeout" if "statement timeout" in msg else "disconnect"
@@ -0,0 +1,246 @@
+# dhl_index.py
+# Локальный пространственный индекс точек DHL для /locations:
+# сетка по lat/lng в памяти + центроиды PLZ (zip → координаты).
+# Данные — таблицы dhl_locations / postal_centroids (schema_patch_locations.sql),
+# заливаются импортёром:
+#   python dhl_index.py locations dump.json [dump2.json ...] [--type packstation]
+#   python dhl_index.py centroids plz.csv        (колонки plz|zip, lat, lon|lng[, ort|city])
+import argparse
+import csv
+import json
+import logging
+import math
+import os
+import sys
+from array import array
+
+logger = logging.getLogger(__name__)
+
+EARTH_KM = 6371.0088
+KM_PER_DEG_LAT = 111.32
+
+
+def normalize_location(loc: dict) -> dict:
+    """Точка DHL Location Finder → элемент ответа /locations."""
+    addr = (loc.get("address") or {})
+    geo = ((loc.get("location") or {}).get("geo")) or (loc.get("coordinates") or {})
+    types_list = loc.get("types") or []
+    loc_type = (types_list[0] if types_list else loc.get("type"))
+    return {
+        "id": loc.get("locationId") or loc.get("id"),
+        "name": loc.get("name") or loc_type,
+        "type": loc_type,
+        "street": addr.get("streetAddress") or addr.get("street") or "",
+        "house": addr.get("streetNumber") or "",
+        "zip": addr.get("postalCode") or "",
+        "city": addr.get("city") or "",
+        "openingHours": loc.get("openingHours") or loc.get("openingTimes") or [],
+        "lat": geo.get("latitude"),
+        "lng": geo.get("longitude"),
+    }
+
+
+def location_types(loc: dict) -> set[str]:
+    types = loc.get("types") or [loc.get("type")]
+    return {str(t).lower() for t in types if t}
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_KM * math.asin(math.sqrt(a))
+
+
+class GridIndex:
+    """
+    Равномерная сетка cell_deg × cell_deg: ячейка → номера точек.
+    Запрос радиуса смотрит только ячейки в bounding box круга,
+    nearest-k — k ближайших из попавших в радиус.
+    """
+
+    def __init__(self, cell_deg: float = 0.05):
+        self.cell_deg = cell_deg
+        self.items: list[dict] = []
+        self.types: list[frozenset[str]] = []
+        self.lat = array("d")
+        self.lng = array("d")
+        self.cells: dict[tuple[int, int], list[int]] = {}
+        self.by_id: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def _cell(self, lat: float, lng: float) -> tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def add(self, item: dict, types: set[str]):
+        if item.get("id") is None or item.get("lat") is None or item.get("lng") is None:
+            return
+        lat, lng = float(item["lat"]), float(item["lng"])
+        i = self.by_id.get(item["id"])
+        if i is not None:
+            # обновление точки: переносим между ячейками при смене координат
+            self.cells[self._cell(self.lat[i], self.lng[i])].remove(i)
+            self.items[i], self.types[i] = item, frozenset(types)
+            self.lat[i], self.lng[i] = lat, lng
+        else:
+            i = len(self.items)
+            self.items.append(item)
+            self.types.append(frozenset(types))
+            self.lat.append(lat)
+            self.lng.append(lng)
+            self.by_id[item["id"]] = i
+        self.cells.setdefault(self._cell(lat, lng), []).append(i)
+
+    def nearest(self, lat: float, lng: float, radius_km: float, k: int, type_: str | None = None) -> list[dict]:
+        dlat = radius_km / KM_PER_DEG_LAT
+        dlng = radius_km / (KM_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01))
+        c0 = self._cell(lat - dlat, lng - dlng)
+        c1 = self._cell(lat + dlat, lng + dlng)
+        found: list[tuple[float, int]] = []
+        for ci in range(c0[0], c1[0] + 1):
+            for cj in range(c0[1], c1[1] + 1):
+                for i in self.cells.get((ci, cj), ()):
+                    if type_ and type_ not in self.types[i]:
+                        continue
+                    d = haversine_km(lat, lng, self.lat[i], self.lng[i])
+                    if d <= radius_km:
+                        found.append((d, i))
+        found.sort()
+        return [self.items[i] for _, i in found[:k]]
+
+
+class LocalLocations:
+    """Индекс точек + центроиды PLZ; подменяется целиком при перезагрузке."""
+
+    def __init__(self):
+        self.index = GridIndex()
+        self.centroids: dict[str, tuple[float, float]] = {}
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.centroids) and len(self.index) > 0
+
+    def nearest(self, zip_: str, radius_km: float, k: int, type_: str | None) -> list[dict] | None:
+        """None — ответить локально нельзя (нет PLZ или точек рядом) → идём в DHL."""
+        c = self.centroids.get(zip_.strip())
+        if c is None:
+            return None
+        return self.index.nearest(c[0], c[1], radius_km, k, type_) or None
+
+    @classmethod
+    async def load(cls, conn) -> "LocalLocations":
+        from db import dict_cursor
+
+        self = cls()
+        async with dict_cursor(conn) as cur:
+            await cur.execute("select zip, lat, lng from postal_centroids")
+            async for r in cur:
+                self.centroids[r["zip"]] = (r["lat"], r["lng"])
+            await cur.execute("""
+              select id, types, name, type, street, house, zip, city,
+                     opening_hours as "openingHours", lat, lng
+              from dhl_locations
+            """)
+            async for r in cur:
+                types = set(r.pop("types") or ())
+                self.index.add(r, types)
+        return self
+
+
+# ===== импорт =====
+
+def _iter_dump(path: str):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    # один ответ Location Finder, список ответов или просто список точек
+    chunks = data if isinstance(data, list) else [data]
+    for chunk in chunks:
+        if isinstance(chunk, dict) and ("locations" in chunk or "items" in chunk):
+            yield from (chunk.get("locations") or chunk.get("items") or [])
+        elif isinstance(chunk, dict):
+            yield chunk
+
+
+def import_locations(conn, paths: list[str], extra_type: str | None = None) -> int:
+    rows = []
+    for path in paths:
+        for loc in _iter_dump(path):
+            item = normalize_location(loc)
+            if item["id"] is None or item["lat"] is None or item["lng"] is None:
+                continue
+            types = location_types(loc) | ({extra_type} if extra_type else set())
+            rows.append((
+                str(item["id"]), sorted(types), item["name"], item["type"], item["street"],
+                item["house"], item["zip"], item["city"], json.dumps(item["openingHours"]),
+                float(item["lat"]), float(item["lng"]),
+            ))
+    with conn.cursor() as cur:
+        cur.execute("create temp table _dhl_import (like dhl_locations including defaults) on commit drop")
+        with cur.copy(
+            "copy _dhl_import (id, types, name, type, street, house, zip, city, opening_hours, lat, lng) from stdin"
+        ) as copy:
+            for r in rows:
+                copy.write_row(r)
+        cur.execute("""
+          insert into dhl_locations (id, types, name, type, street, house, zip, city, opening_hours, lat, lng, updated_at)
+          select distinct on (id) id, types, name, type, street, house, zip, city, opening_hours, lat, lng, now()
+          from _dhl_import
+          on conflict (id) do update set
+            types = (select array(select distinct unnest(dhl_locations.types || excluded.types))),
+            name = excluded.name, type = excluded.type, street = excluded.street, house = excluded.house,
+            zip = excluded.zip, city = excluded.city, opening_hours = excluded.opening_hours,
+            lat = excluded.lat, lng = excluded.lng, updated_at = now()
+        """)
+        return cur.rowcount
+
+
+def import_centroids(conn, path: str) -> int:
+    rows = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for r in csv.DictReader(f):
+            r = {k.strip().lower(): (v or "").strip() for k, v in r.items() if k}
+            zip_ = r.get("plz") or r.get("zip") or r.get("postal_code")
+            lat, lng = r.get("lat"), r.get("lng") or r.get("lon")
+            if not zip_ or not lat or not lng:
+                continue
+            rows.append((zip_, r.get("ort") or r.get("city") or None, float(lat), float(lng)))
+    with conn.cursor() as cur:
+        cur.execute("create temp table _plz_import (like postal_centroids) on commit drop")
+        with cur.copy("copy _plz_import (zip, city, lat, lng) from stdin") as copy:
+            for r in rows:
+                copy.write_row(r)
+        cur.execute("""
+          insert into postal_centroids (zip, city, lat, lng)
+          select distinct on (zip) zip, city, lat, lng from _plz_import
+          on conflict (zip) do update set city = excluded.city, lat = excluded.lat, lng = excluded.lng
+        """)
+        return cur.rowcount
+
+
+def main(argv: list[str] | None = None):
+    import psycopg
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    ap = argparse.ArgumentParser(description="Импорт точек DHL / центроидов PLZ в локальные таблицы")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_loc = sub.add_parser("locations", help="JSON-дампы ответов DHL Location Finder")
+    p_loc.add_argument("paths", nargs="+")
+    p_loc.add_argument("--type", help="доп. тип для всех точек дампа (packstation, postoffice, ...)")
+    p_plz = sub.add_parser("centroids", help="CSV: plz|zip, lat, lon|lng[, ort|city]")
+    p_plz.add_argument("path")
+    args = ap.parse_args(argv)
+
+    with psycopg.connect(os.environ["DATABASE_URL"]) as conn:
+        conn.execute("SET search_path TO mira, public")
+        if args.cmd == "locations":
+            n = import_locations(conn, args.paths, args.type)
+        else:
+            n = import_centroids(conn, args.path)
+    print(f"{args.cmd}: {n} rows upserted", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# geoip.py
+# Офлайн IP → страна по локальной базе диапазонов (CSV):
+#   start,end,country      — IP строками (1.0.0.0,1.0.0.255,AU) или числами
+# Подходит формат DB-IP/ip2location lite (лишние колонки игнорируются).
+# Диапазоны лежат в отсортированных array'ах, поиск — бинарный.
+import asyncio
+import bisect
+import csv
+import ipaddress
+import logging
+import os
+import time
+from array import array
+
+logger = logging.getLogger(__name__)
+
+_MASK64 = (1 << 64) - 1
+
+
+def _pack_cc(cc: str) -> int:
+    return (ord(cc[0]) << 8) | ord(cc[1])
+
+
+def _unpack_cc(v: int) -> str:
+    return chr(v >> 8) + chr(v & 0xFF)
+
+
+def _parse_ip(raw: str) -> ipaddress.IPv4Address | ipaddress.IPv6Address:
+    raw = raw.strip()
+    if raw.isdigit():
+        n = int(raw)
+        return ipaddress.IPv4Address(n) if n <= 0xFFFFFFFF else ipaddress.IPv6Address(n)
+    return ipaddress.ip_address(raw)
+
+
+class IPRangeDB:
+    """
+    Неизменяемый снимок базы: IPv4 — array('I') начал/концов,
+    IPv6 — пары array('Q') (старшие/младшие 64 бита), страна — array('H').
+    """
+
+    def __init__(self):
+        self.v4_start, self.v4_end, self.v4_cc = array("I"), array("I"), array("H")
+        self.v6_start_hi, self.v6_start_lo = array("Q"), array("Q")
+        self.v6_end_hi, self.v6_end_lo = array("Q"), array("Q")
+        self.v6_cc = array("H")
+
+    def __len__(self) -> int:
+        return len(self.v4_cc) + len(self.v6_cc)
+
+    @classmethod
+    def load(cls, path: str) -> "IPRangeDB":
+        v4: list[tuple[int, int, int]] = []
+        v6: list[tuple[int, int, int]] = []
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.reader(f):
+                if len(row) < 3 or row[0].startswith("#"):
+                    continue
+                cc = row[2].strip().upper()
+                if len(cc) != 2 or not cc.isalpha() or cc == "ZZ":
+                    continue
+                try:
+                    start, end = _parse_ip(row[0]), _parse_ip(row[1])
+                except ValueError:
+                    continue  # заголовок или мусор
+                if start.version != end.version:
+                    continue
+                (v4 if start.version == 4 else v6).append((int(start), int(end), _pack_cc(cc)))
+
+        db = cls()
+        v4.sort()
+        for s, e, c in v4:
+            db.v4_start.append(s)
+            db.v4_end.append(e)
+            db.v4_cc.append(c)
+        v6.sort()
+        for s, e, c in v6:
+            db.v6_start_hi.append(s >> 64)
+            db.v6_start_lo.append(s & _MASK64)
+            db.v6_end_hi.append(e >> 64)
+            db.v6_end_lo.append(e & _MASK64)
+            db.v6_cc.append(c)
+        return db
+
+    def lookup(self, ip: str) -> str | None:
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if addr.version == 6 and addr.ipv4_mapped:
+            addr = addr.ipv4_mapped
+        n = int(addr)
+        if addr.version == 4:
+            i = bisect.bisect_right(self.v4_start, n) - 1
+            if i >= 0 and n <= self.v4_end[i]:
+                return _unpack_cc(self.v4_cc[i])
+            return None
+        return self._lookup_v6(n >> 64, n & _MASK64)
+
+    def _lookup_v6(self, hi: int, lo: int) -> str | None:
+        # правый бинпоиск по парам (hi, lo): последний диапазон с началом <= ip
+        starts_hi, starts_lo = self.v6_start_hi, self.v6_start_lo
+        a, b = 0, len(starts_hi)
+        while a < b:
+            mid = (a + b) // 2
+            if (hi, lo) < (starts_hi[mid], starts_lo[mid]):
+                b = mid
+            else:
+                a = mid + 1
+        i = a - 1
+        if i >= 0 and (hi, lo) <= (self.v6_end_hi[i], self.v6_end_lo[i]):
+            return _unpack_cc(self.v6_cc[i])
+        return None
+
+
+class LocalGeoDB:
+    """
+    Обёртка с горячей перезагрузкой: не чаще раза в check_interval секунд
+    сверяем mtime файла и, если он изменился, перечитываем его в потоке
+    и атомарно подменяем снимок. Поиск всегда идёт по текущему снимку.
+    """
+
+    def __init__(self, path: str, check_interval: float = 60.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.db: IPRangeDB | None = None
+        self._mtime: float | None = None
+        self._next_check = 0.0
+        self._reloading: asyncio.Task | None = None
+
+    async def load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            logger.warning("geoip: cannot stat %s: %s", self.path, e)
+            return
+        t0 = time.perf_counter()
+        try:
+            db = await asyncio.to_thread(IPRangeDB.load, self.path)
+        except Exception:
+            # битый/недописанный файл — остаёмся на прежнем снимке
+            logger.exception("geoip: failed to load %s", self.path)
+            return
+        self.db, self._mtime = db, mtime
+        logger.info("geoip: loaded %d ranges from %s in %.2fs", len(db), self.path, time.perf_counter() - t0)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_check or (self._reloading and not self._reloading.done()):
+            return
+        self._next_check = now + self.check_interval
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self._reloading = asyncio.ensure_future(self.load())
+
+    def lookup(self, ip: str) -> str | None:
+        self._maybe_reload()
+        return self.db.lookup(ip) if self.db is not None else None
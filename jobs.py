@@ -0,0 +1,330 @@
+# jobs.py
+# Фоновые задачи на Postgres (schema_patch_jobs.sql): хэндлер запроса только
+# ставит задачу — enqueue() в своей же транзакции, — а медленная работа идёт
+# в воркерах, которые lifespan запускает в каждом процессе API.
+#
+#   @job("dhl.persist")
+#   async def persist(payload: dict, conn: LazyConn): ...
+#
+#   await jobs.enqueue(conn, "dhl.persist", {...})
+#
+# Разбор: пачкой до JOBS_BATCH строк через FOR UPDATE SKIP LOCKED — воркеры
+# разных процессов не ждут друг друга. Будит LISTEN mira_jobs (триггер на
+# insert), страховка — опрос раз в JOBS_POLL_SEC. Доставка at-least-once:
+# задача, не завершённая за JOBS_LEASE_SEC (процесс упал), берётся снова,
+# поэтому хэндлеры должны быть идемпотентны. Lease отсчитывается от старта
+# каждой задачи (пачка идёт по одной), поэтому JOBS_LEASE_SEC > JOBS_TIMEOUT_SEC.
+# Ошибка — повтор с экспоненциальной задержкой, после max_attempts —
+# status = 'failed'.
+#
+# Что сюда не переносим: пересчёт рейтинга после add_review — O(1)-триггер
+# review_stats (schema_patch_reviews.sql), атомарен с самой вставкой; у смены
+# статуса заказа (routers/orders.py) побочных эффектов нет — ни сводок, ни
+# кэшей по заказам. Появятся — enqueue(conn, ...) внутри той же транзакции,
+# что и update orders, чтобы задача не пережила откат.
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+from typing import Awaitable, Callable
+
+import psycopg
+from psycopg import AsyncConnection
+from psycopg.types.json import Jsonb
+
+from admission import LOW, Overloaded
+from db import DATABASE_URL, LazyConn, dict_cursor, pool
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# 0 — воркеры в этом процессе не запускаются (например, отдельный деплой под задачи)
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+JOBS_BATCH = int(os.getenv("JOBS_BATCH", "10"))
+JOBS_POLL_SEC = float(os.getenv("JOBS_POLL_SEC", "5"))
+JOBS_LEASE_SEC = float(os.getenv("JOBS_LEASE_SEC", "300"))
+JOBS_TIMEOUT_SEC = float(os.getenv("JOBS_TIMEOUT_SEC", "60"))
+JOBS_BACKOFF_BASE = float(os.getenv("JOBS_BACKOFF_BASE", "5"))
+JOBS_BACKOFF_MAX = float(os.getenv("JOBS_BACKOFF_MAX", "3600"))
+JOBS_SHUTDOWN_GRACE = float(os.getenv("JOBS_SHUTDOWN_GRACE", "10"))
+# LISTEN нужен отдельным соединением вне пула; за pgbouncer в transaction mode — выключить
+JOBS_LISTEN = os.getenv("JOBS_LISTEN", "1").strip().lower() in ("1", "true", "yes")
+CHANNEL = "mira_jobs"
+
+JOB_SECONDS = Histogram("job_run_seconds", "Background job run time", ("kind", "outcome"))
+JOB_WAIT_SECONDS = Histogram(
+    "job_wait_seconds", "Time from run_at to a worker picking the job up", ("kind",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 1800.0),
+)
+
+Handler = Callable[[dict, LazyConn], Awaitable[None]]
+handlers: dict[str, tuple[Handler, int]] = {}
+
+
+def job(kind: str, *, max_attempts: int = 5):
+    """Регистрирует хэндлер задачи: async def handler(payload, conn)."""
+
+    def deco(fn: Handler) -> Handler:
+        handlers[kind] = (fn, max_attempts)
+        return fn
+
+    return deco
+
+
+async def enqueue(
+    conn: LazyConn | AsyncConnection | None,
+    kind: str,
+    payload: dict | None = None,
+    *,
+    delay: float = 0.0,
+    dedupe_key: str | None = None,
+) -> None:
+    """
+    Поставить задачу. С conn внутри `async with conn.acquire()` — в той же
+    транзакции, что и запись хэндлера: откат отменяет и задачу, воркеры
+    узнают о ней только после commit. Без conn — отдельным коротким
+    соединением из пула.
+    dedupe_key: пока такая задача ждёт в очереди, повторные enqueue — no-op.
+    """
+    if kind not in handlers:
+        raise ValueError(f"unknown job kind {kind!r}")
+    params = (kind, Jsonb(payload or {}), delay, handlers[kind][1], dedupe_key)
+    sql = """
+      insert into jobs (kind, payload, run_at, max_attempts, dedupe_key)
+      values (%s, %s, now() + %s * interval '1 second', %s, %s)
+      on conflict (dedupe_key) where status = 'queued' do nothing
+    """
+    if conn is None:
+        conn = LazyConn(pool, priority=LOW)
+    async with conn.cursor() as cur:
+        await cur.execute(sql, params)
+
+
+def _backoff(attempts: int) -> float:
+    # 5 с, 10 с, 20 с ... до JOBS_BACKOFF_MAX, с джиттером, чтобы повторы не шли стеной
+    delay = min(JOBS_BACKOFF_MAX, JOBS_BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class Workers:
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._tasks: list[asyncio.Task] = []
+        self._listener: asyncio.Task | None = None
+
+    def _wake_all(self):
+        # set() будит всех, кто уже ждёт; clear() сразу — следующее ожидание снова блокирует
+        self._wake.set()
+        self._wake.clear()
+
+    def start(self):
+        if JOBS_WORKERS <= 0 or self._tasks:
+            return
+        if JOBS_LEASE_SEC <= JOBS_TIMEOUT_SEC:
+            # задача, ещё идущая у нас, досталась бы другому воркеру — двойной запуск
+            raise RuntimeError(
+                f"JOBS_LEASE_SEC ({JOBS_LEASE_SEC:g}) must be greater than JOBS_TIMEOUT_SEC ({JOBS_TIMEOUT_SEC:g})"
+            )
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(JOBS_WORKERS)]
+        if JOBS_LISTEN:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if not self._tasks:
+            return
+        self._stopping = True
+        self._wake_all()
+        if self._listener is not None:
+            self._listener.cancel()
+        # текущие задачи доделываются в пределах grace, остальное — отмена
+        _, pending = await asyncio.wait(self._tasks, timeout=JOBS_SHUTDOWN_GRACE)
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*self._tasks, *(t for t in (self._listener,) if t), return_exceptions=True)
+        self._tasks, self._listener = [], None
+        # взятые, но не сделанные — сразу обратно в очередь, не дожидаясь lease;
+        # по одной: дубль по dedupe_key не должен мешать вернуть остальные
+        try:
+            async with pool.connection() as conn:
+                cur = await conn.execute(
+                    "select id from jobs where status = 'running' and locked_by = %s", (self.worker_id,)
+                )
+                for (job_id,) in await cur.fetchall():
+                    await _requeue(conn, job_id, "attempts = greatest(attempts - 1, 0)")
+        except Exception:
+            logger.exception("jobs: failed to release running jobs on shutdown")
+
+    async def _listen(self):
+        while True:
+            try:
+                conn = await AsyncConnection.connect(DATABASE_URL, autocommit=True)
+                async with conn:
+                    await conn.execute(f"LISTEN {CHANNEL}")
+                    # пока не слушали, уведомления могли пройти мимо
+                    self._wake_all()
+                    async for _ in conn.notifies():
+                        self._wake_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("jobs: LISTEN connection lost (%s), polling every %.0fs", e, JOBS_POLL_SEC)
+                await asyncio.sleep(JOBS_POLL_SEC)
+
+    async def _worker(self):
+        while not self._stopping:
+            try:
+                batch = await self._dequeue()
+            except Overloaded:
+                # пул занят запросами — фоновая работа уступает
+                batch = []
+            except Exception:
+                logger.exception("jobs: dequeue failed")
+                batch = []
+            if not batch:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), JOBS_POLL_SEC)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run_batch(batch)
+
+    async def _dequeue(self) -> list[dict]:
+        conn = LazyConn(pool, priority=LOW)
+        async with dict_cursor(conn) as cur:
+            await cur.execute("""
+              with picked as (
+                select id from jobs
+                where (status = 'queued' and run_at <= now())
+                   or (status = 'running' and started_at < now() - %(lease)s * interval '1 second')
+                order by run_at, id
+                limit %(n)s
+                for update skip locked
+              )
+              update jobs j set status = 'running', attempts = j.attempts + 1,
+                                started_at = now(), locked_by = %(me)s
+              from picked where j.id = picked.id
+              returning j.id, j.kind, j.payload, j.attempts, j.max_attempts,
+                        extract(epoch from now() - j.run_at)::float as waited
+            """, {"lease": JOBS_LEASE_SEC, "n": JOBS_BATCH, "me": self.worker_id})
+            return await cur.fetchall()
+
+    async def _run_batch(self, batch: list[dict]):
+        done: list[int] = []
+        try:
+            for i, row in enumerate(batch):
+                # первая стартует сразу после dequeue, остальным lease продлеваем перед запуском
+                if i and not await self._renew(row["id"]):
+                    continue
+                if await self._run(row):
+                    done.append(row["id"])
+        finally:
+            if done:
+                # успешные удаляем одним запросом на пачку
+                async with pool.connection() as conn:
+                    await conn.execute("delete from jobs where id = any(%s) and locked_by = %s", (done, self.worker_id))
+
+    async def _renew(self, job_id: int) -> bool:
+        # False — lease уже истёк и задачу взял другой воркер: не запускаем
+        async with pool.connection() as conn:
+            cur = await conn.execute(
+                "update jobs set started_at = now() where id = %s and status = 'running' and locked_by = %s",
+                (job_id, self.worker_id),
+            )
+            return cur.rowcount == 1
+
+    async def _run(self, row: dict) -> bool:
+        kind = row["kind"]
+        JOB_WAIT_SECONDS.observe(max(row["waited"], 0.0), kind)
+        entry = handlers.get(kind)
+        t0 = time.perf_counter()
+        try:
+            if entry is None:
+                raise LookupError(f"no handler for job kind {kind!r}")
+            await asyncio.wait_for(entry[0](row["payload"], LazyConn(pool, priority=LOW)), JOBS_TIMEOUT_SEC)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            JOB_SECONDS.observe(time.perf_counter() - t0, kind, "error")
+            await self._failed(row, e)
+            return False
+        JOB_SECONDS.observe(time.perf_counter() - t0, kind, "ok")
+        return True
+
+    async def _failed(self, row: dict, exc: Exception):
+        error = f"{type(exc).__name__}: {exc}"[:2000]
+        final = row["attempts"] >= row["max_attempts"] or row["kind"] not in handlers
+        if final:
+            logger.error("jobs: %s #%d failed permanently after %d attempts: %s",
+                         row["kind"], row["id"], row["attempts"], error)
+        else:
+            logger.warning("jobs: %s #%d attempt %d failed: %s", row["kind"], row["id"], row["attempts"], error)
+        try:
+            async with pool.connection() as conn:
+                if final:
+                    await conn.execute(
+                        "update jobs set status = 'failed', finished_at = now(), locked_by = null, last_error = %s"
+                        " where id = %s",
+                        (error, row["id"]),
+                    )
+                else:
+                    await _requeue(conn, row["id"], "run_at = now() + %s * interval '1 second', last_error = %s",
+                                   (_backoff(row["attempts"]), error))
+        except Exception:
+            # не записали — задачу вернёт lease
+            logger.exception("jobs: failed to record failure of #%d", row["id"])
+
+
+async def _requeue(conn: AsyncConnection, job_id: int, sets: str, params: tuple = ()) -> None:
+    """
+    Вернуть взятую задачу в queued. Если с тем же dedupe_key уже ждёт свежая,
+    уникальный индекс не пустит — тогда эта строка лишняя: удаляем, работу
+    сделает свежая.
+    """
+    try:
+        async with conn.transaction():
+            await conn.execute(
+                f"update jobs set status = 'queued', locked_by = null, {sets} where id = %s", (*params, job_id)
+            )
+    except psycopg.errors.UniqueViolation:
+        await conn.execute("delete from jobs where id = %s", (job_id,))
+
+
+workers = Workers()
+
+
+async def overview(conn: LazyConn, failed_limit: int = 20) -> dict:
+    """Глубина очереди и задержка по видам задач — для /admin/jobs."""
+    async with dict_cursor(conn) as cur:
+        await cur.execute("""
+          select kind,
+                 count(*) filter (where status = 'queued' and run_at <= now()) as ready,
+                 count(*) filter (where status = 'queued' and run_at > now())  as delayed,
+                 count(*) filter (where status = 'running')                    as running,
+                 count(*) filter (where status = 'failed')                     as failed,
+                 extract(epoch from now() - min(run_at) filter (
+                   where status = 'queued' and run_at <= now()))::float        as oldest_ready_sec
+          from jobs
+          group by kind
+          order by kind
+        """)
+        kinds = await cur.fetchall()
+        await cur.execute("""
+          select id, kind, attempts, last_error, finished_at::text as finished_at
+          from jobs where status = 'failed'
+          order by finished_at desc
+          limit %s
+        """, (failed_limit,))
+        failed = await cur.fetchall()
+    return {
+        "worker": workers.worker_id,
+        "workers": len(workers._tasks),
+        "listen": workers._listener is not None and not workers._listener.done(),
+        "handlers": sorted(handlers),
+        "kinds": kinds,
+        "failed": failed,
+    }
@@ -0,0 +1,12 @@
+# locales.py
+# Локали каталога — одно определение для роутеров, импорта и снимка.
+LOCALES = ("ru", "en", "de", "uk")
+SUPPORTED_LOCALES = set(LOCALES)
+ALIASES = {"ua": "uk"}                         # принимать ua как алиас
+
+def normalize_locale(locale: str | None) -> str | None:
+    if not locale:
+        return None
+    loc = locale.lower()
+    loc = ALIASES.get(loc, loc)
+    return loc if loc in SUPPORTED_LOCALES else None
@@ -0,0 +1,168 @@
+# metrics.py
+# Метрики в текстовом формате Prometheus без внешних зависимостей:
+# Counter / Gauge / Histogram с метками + коллекторы (снимки состояния на момент
+# скрейпа: пул соединений, breaker'ы, кэши). Значения — на процесс (воркер uvicorn).
+import bisect
+import time
+from typing import Callable, Iterable
+
+PREFIX = "mira_"
+
+# латентность HTTP-запросов / внешних вызовов, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _fmt_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_: str, labels: tuple[str, ...] = ()):
+        self.name = PREFIX + name
+        self.help = help_
+        self.labels = labels
+        registry.append(self)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help_, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        out = self._header()
+        for key, v in self._values.items():
+            out.append(f"{self.name}{_fmt_labels(self.labels, key)} {_fmt_value(v)}")
+        return out
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, *labels, value: float):
+        self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_: str, labels: tuple[str, ...] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_, labels)
+        self.buckets = tuple(sorted(buckets))
+        # метки → [счётчики по корзинам (+Inf последней), сумма]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def render(self) -> list[str]:
+        out = self._header()
+        for key, (counts, total) in self._values.items():
+            acc = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le_label = 'le="' + _fmt_value(le) + '"'
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le_label)} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {_fmt_value(total)}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {acc}")
+        return out
+
+
+registry: list[_Metric] = []
+# коллектор → список (имя без префикса, тип, help, [(метки dict, значение)])
+_collectors: list[Callable[[], Iterable[tuple[str, str, str, list[tuple[dict, float]]]]]] = []
+
+
+def collector(fn):
+    """Регистрирует функцию, которая на каждый скрейп отдаёт текущие значения."""
+    _collectors.append(fn)
+    return fn
+
+
+def render() -> str:
+    out: list[str] = []
+    for m in registry:
+        out.extend(m.render())
+    for fn in _collectors:
+        for name, kind, help_, samples in fn():
+            full = PREFIX + name
+            out.append(f"# HELP {full} {help_}")
+            out.append(f"# TYPE {full} {kind}")
+            for labels, v in samples:
+                names, values = tuple(labels), tuple(labels.values())
+                out.append(f"{full}{_fmt_labels(names, values)} {_fmt_value(v)}")
+    out.append("")
+    return "\n".join(out)
+
+
+# ===== HTTP =====
+
+HTTP_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency by route template", ("method", "route"))
+HTTP_RESPONSES = Counter("http_responses_total", "HTTP responses by route template and status", ("method", "route", "status"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served")
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI: латентность до конца отправки тела, статус, in-flight.
+    Метка route — шаблон пути FastAPI (/products/{slug}), не сам путь:
+    число временных рядов не растёт от id/slug; не сматченные → "<unmatched>".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "<unmatched>"
+            method = scope["method"]
+            HTTP_SECONDS.observe(time.perf_counter() - started, method, path)
+            HTTP_RESPONSES.inc(method, path, status)
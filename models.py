@@ -38,6 +38,26 @@ class ProductsPage(BaseModel):
     items: List[ProductOut]
     page: PageOut
 
+class ProductTranslationOut(BaseModel):
+    locale: str
+    slug: str
+    title: str
+    short: Optional[str] = None
+    description: Optional[str] = None
+
+class CatalogChange(BaseModel):
+    entity: Literal["product","product_i18n"]
+    op: Literal["upsert","delete"]
+    product_id: str
+    locale: Optional[str] = None                       # только для product_i18n
+    product: ProductOut | None = None                  # upsert товара — текущая строка
+    translation: ProductTranslationOut | None = None   # upsert перевода
+
+class CatalogChanges(BaseModel):
+    changes: List[CatalogChange]
+    next: str         # передать в since следующего запроса
+    has_more: bool
+
 # ===== REVIEWS =====
 class ReviewOut(BaseModel):
     id: str
@@ -54,6 +74,12 @@ class ReviewCreate(BaseModel):
     rating: conint(ge=1, le=5)
     text: str
 
+class ReviewSummary(BaseModel):
+    product_id: str
+    count: int
+    average: float | None = None
+    histogram: dict[str, int]   # "1".."5" → число отзывов
+
 # ===== ADDRESSES =====
 class Address(BaseModel):
     id: str
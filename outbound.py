@@ -0,0 +1,361 @@
+# outbound.py
+# Общая инфраструктура исходящих вызовов (geo, DHL, Stripe):
+# клиенты на всё время жизни приложения (keep-alive), TTL/LRU-кэш,
+# склейка одинаковых одновременных запросов, circuit breaker + bulkhead +
+# дедлайн запроса на каждую внешнюю зависимость.
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+import httpx
+
+from metrics import Histogram, collector
+
+_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def http_client(name: str, timeout: float = 5.0, max_connections: int = 20) -> httpx.AsyncClient:
+    """Один httpx.AsyncClient на внешний сервис: без нового TLS-хэндшейка на каждый запрос."""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=30.0,
+            ),
+        )
+        _clients[name] = client
+    return client
+
+
+async def close_clients():
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    LRU с TTL на запись. ttl можно задать на конкретную запись —
+    например, короткий для негативных результатов (None / ошибка).
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = _MISSING) -> Any:
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class SingleFlight:
+    """Одновременные вызовы с одним ключом ждут один и тот же запрос."""
+
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: отмена одного ожидающего (клиент ушёл) не отменяет запрос для остальных
+        return await asyncio.shield(task)
+
+
+class SWRCache:
+    """
+    Кэш со stale-while-revalidate: свежая запись (ttl) отдаётся сразу;
+    устаревшая, но не старше ttl + stale_ttl, тоже отдаётся сразу, а обновление
+    уходит в фон; без записи — ждём загрузку. Загрузки по ключу склеиваются.
+    Ошибки загрузки не кэшируются; при фоновом обновлении остаётся старое значение.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, stale_ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._flight = SingleFlight()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    async def _load(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        value = await fetch()
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        return value
+
+    def _refresh_in_background(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]):
+        task = asyncio.ensure_future(self._flight.do(key, lambda: self._load(key, fetch)))
+        # результат не нужен; ошибку забираем, чтобы не было "exception was never retrieved"
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._data.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._refresh_in_background(key, fetch)
+                return entry[1]
+            del self._data[key]
+        self.misses += 1
+        return await self._flight.do(key, lambda: self._load(key, fetch))
+
+
+# ===== circuit breaker / bulkhead / дедлайны =====
+
+OUTBOUND_SECONDS = Histogram(
+    "outbound_call_duration_seconds", "Outbound call latency by dependency and outcome", ("dependency", "outcome"),
+)
+
+class UpstreamUnavailable(Exception):
+    """Вызов не выполнялся: цепь разомкнута, нет свободных слотов или вышел бюджет времени."""
+
+    def __init__(self, dependency: str, reason: str, retry_after: float = 1.0):
+        super().__init__(f"{dependency}: {reason}")
+        self.dependency = dependency
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# абсолютный дедлайн текущего запроса (time.monotonic); ставится зависимостью request_budget
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("outbound_deadline", default=None)
+
+
+def request_budget(seconds: float):
+    """
+    Зависимость FastAPI: бюджет времени на все исходящие вызовы запроса.
+    Каждый вызов получает timeout = min(таймаут зависимости, остаток бюджета).
+    """
+
+    async def dep():
+        _deadline.set(time.monotonic() + seconds)
+
+    return dep
+
+
+class Dependency:
+    """
+    Защита одной внешней зависимости:
+      - circuit breaker: failure_threshold ошибок подряд → open на reset_timeout сек,
+        затем half-open (до half_open_max пробных вызовов); успех → closed;
+      - bulkhead: не больше max_concurrency одновременных вызовов,
+        ожидание слота — не дольше queue_timeout;
+      - таймаут: min(timeout, остаток бюджета запроса).
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float,
+        max_concurrency: int = 20,
+        queue_timeout: float = 0.5,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        half_open_max: int = 1,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max = half_open_max
+
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_inflight = 0
+        # номер текущего окна half-open: пробу из прошлого окна не засчитываем в нынешнее
+        self._half_open_epoch = 0
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+        # метрики
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = {"open": 0, "bulkhead": 0, "deadline": 0}
+        self.latency_sum = 0.0
+
+    def _admit(self) -> int | None:
+        """Пропустить вызов или UpstreamUnavailable; для пробы half-open — номер её окна."""
+        if self.state == self.OPEN:
+            wait = self._opened_at + self.reset_timeout - time.monotonic()
+            if wait > 0:
+                self.rejected["open"] += 1
+                raise UpstreamUnavailable(self.name, "circuit open", retry_after=wait)
+            self.state = self.HALF_OPEN
+            self._half_open_inflight = 0
+            self._half_open_epoch += 1
+        if self.state == self.HALF_OPEN:
+            if self._half_open_inflight >= self.half_open_max:
+                self.rejected["open"] += 1
+                raise UpstreamUnavailable(self.name, "circuit half-open", retry_after=1.0)
+            self._half_open_inflight += 1
+            return self._half_open_epoch
+        return None
+
+    def _release_probe(self, probe: int | None):
+        # только вызовы, допущенные как проба этого окна; начатые при CLOSED слот не занимали
+        if probe is not None and probe == self._half_open_epoch and self.state == self.HALF_OPEN:
+            self._half_open_inflight -= 1
+
+    def _record(self, ok: bool, probe: int | None):
+        self._release_probe(probe)
+        if ok:
+            self._failures = 0
+            self.state = self.CLOSED
+            return
+        self.failures += 1
+        self._failures += 1
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def _call_timeout(self) -> float:
+        deadline = _deadline.get()
+        if deadline is None:
+            return self.timeout
+        left = deadline - time.monotonic()
+        if left <= 0:
+            self.rejected["deadline"] += 1
+            raise UpstreamUnavailable(self.name, "request deadline exceeded", retry_after=1.0)
+        return min(self.timeout, left)
+
+    async def call(
+        self,
+        fn: Callable[[float], Awaitable[Any]],
+        failed: Callable[[Any], bool] | None = None,
+        ok_errors: tuple[type[Exception], ...] = (),
+    ) -> Any:
+        """
+        fn(timeout) — сам вызов; failed(result) — считать ли результат отказом
+        (например, HTTP 5xx). Исключения fn пробрасываются и считаются отказом,
+        кроме ok_errors — ответов апстрима, за которые он не виноват (4xx и т.п.).
+        """
+        timeout = self._call_timeout()
+        probe = self._admit()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), min(self.queue_timeout, timeout))
+        except BaseException as e:
+            self._release_probe(probe)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected["bulkhead"] += 1
+                raise UpstreamUnavailable(self.name, "too many concurrent calls", retry_after=1.0)
+            raise
+
+        self.calls += 1
+        self.in_flight += 1
+        t0 = time.monotonic()
+        ok: bool | None = False
+        outcome = "error"
+        try:
+            result = await asyncio.wait_for(fn(timeout), timeout)
+            ok = not (failed and failed(result))
+            outcome = "ok" if ok else "error"
+            return result
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            outcome = "timeout"
+            raise
+        except asyncio.CancelledError:
+            ok = None  # клиент ушёл — это не отказ апстрима
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            ok = isinstance(e, ok_errors)
+            outcome = "ok" if ok else "error"
+            raise
+        finally:
+            elapsed = time.monotonic() - t0
+            self.latency_sum += elapsed
+            OUTBOUND_SECONDS.observe(elapsed, self.name, outcome)
+            self.in_flight -= 1
+            self._slots.release()
+            if ok is None:
+                self._release_probe(probe)
+            else:
+                self._record(ok, probe)
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rejected": dict(self.rejected),
+            "latency_sum": round(self.latency_sum, 6),
+        }
+
+
+dependencies: dict[str, Dependency] = {}
+
+
+def dependency(name: str, **kwargs) -> Dependency:
+    """Реестр зависимостей: одна Dependency на имя (параметры — при первом вызове)."""
+    dep = dependencies.get(name)
+    if dep is None:
+        dep = dependencies[name] = Dependency(name, **kwargs)
+    return dep
+
+
+_STATE_VALUE = {Dependency.CLOSED: 0, Dependency.HALF_OPEN: 1, Dependency.OPEN: 2}
+
+
+@collector
+def _dependency_metrics():
+    deps = list(dependencies.values())
+    yield ("outbound_circuit_state", "gauge", "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+           [({"dependency": d.name}, _STATE_VALUE[d.state]) for d in deps])
+    yield ("outbound_in_flight", "gauge", "Outbound calls in flight",
+           [({"dependency": d.name}, d.in_flight) for d in deps])
+    yield ("outbound_rejected_total", "counter", "Outbound calls rejected without touching the network",
+           [({"dependency": d.name, "reason": r}, n) for d in deps for r, n in d.rejected.items()])
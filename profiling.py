@@ -0,0 +1,190 @@
+# profiling.py
+# Профилирование SQL на уровне курсора psycopg: нормализованный отпечаток запроса,
+# время, число строк, роут-источник; лог медленных запросов, опционально —
+# EXPLAIN (ANALYZE, BUFFERS) для медленных select'ов (в read-only транзакции с откатом).
+#
+# Включается QUERY_PROFILE=1: тогда пул ставит ProfiledCursor как cursor_factory
+# каждого соединения (db._configure). Выключено — обычный AsyncCursor, накладных нет.
+#   QUERY_SLOW_MS         порог медленного запроса, мс (200)
+#   QUERY_PROFILE_SAMPLE  доля запросов, попадающих в статистику (1.0); медленные — всегда
+#   QUERY_EXPLAIN         1 — снимать план медленных select'ов (не чаще раза
+#                         в QUERY_EXPLAIN_INTERVAL сек на отпечаток)
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import re
+import time
+from typing import Any
+
+from psycopg import AsyncCursor
+
+logger = logging.getLogger(__name__)
+
+QUERY_PROFILE = os.getenv("QUERY_PROFILE", "0").strip().lower() in ("1", "true", "yes")
+QUERY_SLOW_MS = float(os.getenv("QUERY_SLOW_MS", "200"))
+QUERY_PROFILE_SAMPLE = float(os.getenv("QUERY_PROFILE_SAMPLE", "1.0"))
+QUERY_EXPLAIN = os.getenv("QUERY_EXPLAIN", "0").strip().lower() in ("1", "true", "yes")
+QUERY_EXPLAIN_INTERVAL = float(os.getenv("QUERY_EXPLAIN_INTERVAL", "300"))
+# сколько разных отпечатков держим; новые сверх лимита не заводятся
+QUERY_STATS_MAX = int(os.getenv("QUERY_STATS_MAX", "2000"))
+
+# шаблон роута, из которого идут запросы; ставится в db.get_conn / get_read_conn
+current_route: contextvars.ContextVar[str] = contextvars.ContextVar("query_route", default="-")
+
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_PARAM = re.compile(r"%\(\w+\)s|%s|\$\d+")
+_RE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_SPACE = re.compile(r"\s+")
+
+_fingerprints: dict[str, str] = {}
+
+
+def fingerprint(sql: str) -> str:
+    """Текст запроса без литералов/параметров и лишних пробелов: одинаковые запросы — один ключ."""
+    fp = _fingerprints.get(sql)
+    if fp is None:
+        fp = _RE_STRING.sub("?", sql)
+        fp = _RE_PARAM.sub("?", fp)
+        fp = _RE_NUMBER.sub("?", fp)
+        fp = _RE_LIST.sub("(?...)", fp)
+        fp = _RE_SPACE.sub(" ", fp).strip()
+        if len(_fingerprints) < QUERY_STATS_MAX * 4:
+            _fingerprints[sql] = fp
+    return fp
+
+
+class QueryStats:
+    __slots__ = ("calls", "total_ms", "max_ms", "rows", "slow", "routes", "plan", "plan_at")
+
+    def __init__(self):
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.slow = 0
+        self.routes: dict[str, int] = {}
+        self.plan: str | None = None
+        self.plan_at = 0.0
+
+    def as_dict(self, fp: str) -> dict:
+        return {
+            "query": fp,
+            "calls": self.calls,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "rows": self.rows,
+            "slow": self.slow,
+            "routes": dict(sorted(self.routes.items(), key=lambda kv: -kv[1])),
+            "plan": self.plan,
+        }
+
+
+stats: dict[str, QueryStats] = {}
+
+
+def top(n: int = 20, order: str = "total_ms") -> list[dict]:
+    rows = [st.as_dict(fp) for fp, st in stats.items()]
+    rows.sort(key=lambda r: r[order], reverse=True)
+    return rows[:n]
+
+
+def reset():
+    stats.clear()
+
+
+def _record(cur: "ProfiledCursor", query: Any, params: Any, elapsed_ms: float, rows: int):
+    slow = elapsed_ms >= QUERY_SLOW_MS
+    if not slow and QUERY_PROFILE_SAMPLE < 1.0 and random.random() >= QUERY_PROFILE_SAMPLE:
+        return
+    sql = query if isinstance(query, str) else query.as_string(cur)
+    fp = fingerprint(sql)
+    route = current_route.get()
+
+    st = stats.get(fp)
+    if st is None:
+        if len(stats) >= QUERY_STATS_MAX:
+            return
+        st = stats[fp] = QueryStats()
+    st.calls += 1
+    st.total_ms += elapsed_ms
+    st.max_ms = max(st.max_ms, elapsed_ms)
+    st.rows += max(rows, 0)
+    st.routes[route] = st.routes.get(route, 0) + 1
+
+    if slow:
+        st.slow += 1
+        logger.warning("slow query %.1f ms, %d rows, route %s: %s", elapsed_ms, rows, route, fp)
+        now = time.monotonic()
+        if QUERY_EXPLAIN and now - st.plan_at >= QUERY_EXPLAIN_INTERVAL and _is_select(sql):
+            st.plan_at = now
+            task = asyncio.ensure_future(_explain(st, fp, sql, params))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+def _is_select(sql: str) -> bool:
+    # грубый отбор по тексту; `select fn()` с побочными эффектами сюда проходит —
+    # защищает от них read-only транзакция в _explain
+    head = sql.lstrip().lower()
+    return head.startswith("select") and not re.search(r"\b(insert|update|delete|for\s+update)\b", head)
+
+
+async def _explain(st: QueryStats, fp: str, sql: str, params: Any):
+    # отдельное соединение из пула: не в транзакции запроса и не занимая его соединение
+    from db import pool
+
+    try:
+        async with pool.connection(timeout=1.0) as conn:
+            # ANALYZE выполняет запрос ещё раз: в read-only транзакции с откатом
+            # любая запись (в т.ч. из функции в select) — ошибка, а не повтор.
+            # Обычный cursor, иначе EXPLAIN сам попадёт в статистику
+            async with conn.transaction(force_rollback=True), AsyncCursor(conn) as cur:
+                await cur.execute("SET TRANSACTION READ ONLY")
+                await cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+                plan = "\n".join(r[0] for r in await cur.fetchall())
+    except Exception as e:
+        logger.info("explain failed for %s: %s", fp, e)
+        return
+    st.plan = plan
+    logger.warning("plan for slow query %s:\n%s", fp, plan)
+
+
+class ProfiledCursor(AsyncCursor):
+    """
+    AsyncCursor, который замеряет execute/executemany/stream.
+    Запросы внутри pipeline не замеряются: execute там только ставит их в очередь.
+    """
+
+    def _pipelined(self) -> bool:
+        return self._conn._pipeline is not None
+
+    async def execute(self, query, params=None, **kwargs):
+        if self._pipelined():
+            return await super().execute(query, params, **kwargs)
+        t0 = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            _record(self, query, params, (time.perf_counter() - t0) * 1000, self.rowcount)
+
+    async def executemany(self, query, params_seq, **kwargs):
+        if self._pipelined():
+            return await super().executemany(query, params_seq, **kwargs)
+        t0 = time.perf_counter()
+        try:
+            return await super().executemany(query, params_seq, **kwargs)
+        finally:
+            _record(self, query, None, (time.perf_counter() - t0) * 1000, self.rowcount)
+
+    async def stream(self, query, params=None, **kwargs):
+        t0 = time.perf_counter()
+        rows = 0
+        try:
+            async for row in super().stream(query, params, **kwargs):
+                rows += 1
+                yield row
+        finally:
+            _record(self, query, params, (time.perf_counter() - t0) * 1000, rows)
@@ -0,0 +1,39 @@
+# responses.py
+from typing import Any, Iterable
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+from pydantic_core import to_json
+
+
+class RawJSONResponse(Response):
+    """
+    Быстрый путь ответа: доверенные строки из БД (уже в форме response_model)
+    сразу в JSON-байты, без model_validate + повторной валидации FastAPI.
+
+    response_model в декораторе оставляем — он нужен только для OpenAPI:
+    если хэндлер вернул Response, FastAPI его не валидирует.
+    Готовые bytes (например, JSON, собранный в Postgres) отдаются как есть.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            return bytes(content)
+        return to_json(content)
+
+
+def parse_fields(raw: str | None, allowed: Iterable[str]) -> list[str]:
+    """
+    Sparse fieldsets: `?fields=id,slug,price` → поля в порядке модели.
+    Пусто — все поля; неизвестное поле — 400.
+    """
+    allowed = list(allowed)
+    if not raw:
+        return allowed
+    wanted = {f.strip() for f in raw.split(",") if f.strip()}
+    unknown = wanted.difference(allowed)
+    if unknown:
+        raise HTTPException(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+    return [f for f in allowed if f in wanted] or allowed
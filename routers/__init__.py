@@ -4,4 +4,5 @@ from .reviews import router as reviews
 from .addresses import router as addresses
 from .orders import router as orders
 from .auth import router as auth
-from .categories import router as categories
\ No newline at end of file
+from .categories import router as categories
+from .admin import router as admin
\ No newline at end of file
@@ -1,18 +1,19 @@
 # routers/addresses.py
 import uuid
 from fastapi import APIRouter, Depends, HTTPException
-from psycopg import AsyncConnection
-from db import get_conn, dict_cursor
+from admission import CRITICAL, priority
+from db import get_conn, dict_cursor, LazyConn
 from models import Address, AddressCreate, AddressUpdate, UserPublic
 from security import get_optional_user, get_current_user
 
-router = APIRouter(prefix="/addresses", tags=["addresses"])
+# адреса — часть чекаута, в том числе чтение
+router = APIRouter(prefix="/addresses", tags=["addresses"], dependencies=[Depends(priority(CRITICAL))])
 
 @router.get("", response_model=list[Address])
 async def list_addresses(
     email: str | None = None,
     current: UserPublic | None = Depends(get_optional_user),
-    conn: AsyncConnection = Depends(get_conn),
+    conn: LazyConn = Depends(get_conn),
 ):
     # если есть авторизация — игнорируем query email и берём свой
     effective_email = (current.email if current else None) or email
@@ -34,7 +35,7 @@ async def list_addresses(
 async def create_address(
     body: AddressCreate,
     current: UserPublic = Depends(get_current_user),
-    conn: AsyncConnection = Depends(get_conn),
+    conn: LazyConn = Depends(get_conn),
 ):
     # насильно привязываем адрес к текущему пользователю
     aid = str(uuid.uuid4())
@@ -62,7 +63,7 @@ async def update_address(
     addr_id: str,
     body: AddressUpdate,
     current: UserPublic = Depends(get_current_user),
-    conn: AsyncConnection = Depends(get_conn),
+    conn: LazyConn = Depends(get_conn),
 ):
     user_email = current.email
     async with dict_cursor(conn) as cur:
@@ -93,7 +94,7 @@ async def update_address(
 async def delete_address(
     addr_id: str,
     current: UserPublic = Depends(get_current_user),
-    conn: AsyncConnection = Depends(get_conn),
+    conn: LazyConn = Depends(get_conn),
 ):
     async with dict_cursor(conn) as cur:
         await cur.execute("delete from addresses where id=%s and lower(user_email)=lower(%s)", (addr_id, current.email))
@@ -106,7 +107,7 @@ async def delete_address(
 async def make_default(
     addr_id: str,
     current: UserPublic = Depends(get_current_user),
-    conn: AsyncConnection = Depends(get_conn),
+    conn: LazyConn = Depends(get_conn),
 ):
     async with dict_cursor(conn) as cur:
         await cur.execute("update addresses set is_default=false where lower(user_email)=lower(%s)", (current.email,))
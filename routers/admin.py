@@ -0,0 +1,87 @@
+# routers/admin.py
+import os
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+import psycopg
+
+import catalog_import
+import jobs
+import profiling
+from admission import LOW, priority
+from db import get_conn, statement_timeout, LazyConn
+from security import require_admin
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin), Depends(priority(LOW))])
+
+# импорт каталога: merge сотен тысяч строк — дольше обычного statement_timeout
+IMPORT_TIMEOUT_MS = int(os.getenv("IMPORT_TIMEOUT_MS", "600000"))
+
+@router.get("/queries")
+async def top_queries(
+    limit: int = Query(20, ge=1, le=500),
+    order: Literal["total_ms", "mean_ms", "max_ms", "calls", "rows", "slow"] = "total_ms",
+):
+    """Топ отпечатков SQL этого воркера (QUERY_PROFILE=1), по умолчанию — по суммарному времени."""
+    return {
+        "enabled": profiling.QUERY_PROFILE,
+        "slow_ms": profiling.QUERY_SLOW_MS,
+        "sample": profiling.QUERY_PROFILE_SAMPLE,
+        "fingerprints": len(profiling.stats),
+        "items": profiling.top(limit, order),
+    }
+
+@router.delete("/queries", status_code=204)
+async def reset_queries():
+    profiling.reset()
+
+@router.get("/jobs")
+async def jobs_overview(
+    failed: int = Query(20, ge=0, le=200),
+    conn: LazyConn = Depends(get_conn),
+):
+    """Очередь фоновых задач: готовые/отложенные/в работе/упавшие и возраст самой старой готовой по видам."""
+    return await jobs.overview(conn, failed)
+
+@router.post("/jobs/{job_id}/retry")
+async def retry_job(job_id: int, conn: LazyConn = Depends(get_conn)):
+    """Вернуть упавшую задачу в очередь с новым набором попыток."""
+    async with conn.cursor() as cur:
+        try:
+            await cur.execute("""
+              update jobs set status = 'queued', attempts = 0, run_at = now(), finished_at = null, locked_by = null
+              where id = %s and status = 'failed'
+            """, (job_id,))
+        except psycopg.errors.UniqueViolation:
+            raise HTTPException(409, "A job with the same dedupe key is already queued")
+        if cur.rowcount == 0:
+            raise HTTPException(404, "Failed job not found")
+    return {"ok": True}
+
+def _import_format(request: Request, fmt: str | None) -> str:
+    if fmt:
+        return fmt
+    return "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+
+async def _import(request: Request, conn: LazyConn, spec: catalog_import.ImportSpec, fmt: str | None) -> dict:
+    return await catalog_import.run_import(conn, spec, request.stream(), _import_format(request, fmt))
+
+@router.post("/products:import", dependencies=[Depends(statement_timeout(IMPORT_TIMEOUT_MS))])
+async def import_products(
+    request: Request,
+    format: Literal["ndjson", "csv"] | None = None,
+    conn: LazyConn = Depends(get_conn),
+):
+    """
+    Товары из NDJSON/CSV (формат — ?format= или Content-Type): id?, slug, title, category,
+    sub?, leaf?, price, short?, description?, image_url?. Без id товар ищется по slug.
+    """
+    return await _import(request, conn, catalog_import.PRODUCTS, format)
+
+@router.post("/product_i18n:import", dependencies=[Depends(statement_timeout(IMPORT_TIMEOUT_MS))])
+async def import_product_i18n(
+    request: Request,
+    format: Literal["ndjson", "csv"] | None = None,
+    conn: LazyConn = Depends(get_conn),
+):
+    """Переводы: product_id или product_slug, locale, title, short?, description?, slug."""
+    return await _import(request, conn, catalog_import.PRODUCT_I18N, format)
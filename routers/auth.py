@@ -1,10 +1,9 @@
 # routers/auth.py
 import uuid
 from fastapi import APIRouter, Depends, HTTPException
-from psycopg import AsyncConnection
 from psycopg.rows import dict_row
 
-from db import get_conn
+from db import get_conn, LazyConn
 from models import (
     UserUpsertIn, UserPublic, RegisterIn, LoginIn, TokenOut, MeOut, UserUpdateIn
 )
@@ -13,7 +12,9 @@ from security import hash_password, verify_password, create_access_token, get_cu
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 @router.post("/register", response_model=TokenOut, status_code=201)
-async def register(body: RegisterIn, conn: AsyncConnection = Depends(get_conn)):
+async def register(body: RegisterIn, conn: LazyConn = Depends(get_conn)):
+    # bcrypt — до того, как взять соединение из пула (как в login)
+    pwd_hash = hash_password(body.password)
     async with conn.cursor(row_factory=dict_row) as cur:
         # уже есть такой email?
         await cur.execute("select 1 from users where lower(email)=lower(%s)", (body.email,))
@@ -21,7 +22,6 @@ async def register(body: RegisterIn, conn: AsyncConnection = Depends(get_conn)):
             raise HTTPException(409, "Email already registered")
 
         uid = str(uuid.uuid4())
-        pwd_hash = hash_password(body.password)
         await cur.execute(
             "insert into users(id,email,name,password_hash,created_at) values(%s,%s,%s,%s,now())",
             (uid, body.email, body.name.strip(), pwd_hash),
@@ -31,15 +31,16 @@ async def register(body: RegisterIn, conn: AsyncConnection = Depends(get_conn)):
 
 
 @router.post("/login", response_model=TokenOut)
-async def login(body: LoginIn, conn: AsyncConnection = Depends(get_conn)):
+async def login(body: LoginIn, conn: LazyConn = Depends(get_conn)):
     async with conn.cursor(row_factory=dict_row) as cur:
         await cur.execute(
             "select id::text, email, name, password_hash from users where lower(email)=lower(%s)",
             (body.email,),
         )
         row = await cur.fetchone()
-        if not row or not verify_password(body.password, row.get("password_hash")):
-            raise HTTPException(401, "Invalid email or password")
+    # bcrypt — уже после возврата соединения в пул
+    if not row or not verify_password(body.password, row.get("password_hash")):
+        raise HTTPException(401, "Invalid email or password")
     token = create_access_token(sub=row["email"])
     return TokenOut(access_token=token, token_type="bearer")
 
@@ -51,7 +52,7 @@ async def me(user: UserPublic = Depends(get_current_user)):
 
 # совместимость с твоим апдейтом имени/автосозданием (OAuth/Social)
 @router.post("/upsert", response_model=UserPublic)
-async def upsert_user(body: UserUpsertIn, conn: AsyncConnection = Depends(get_conn)):
+async def upsert_user(body: UserUpsertIn, conn: LazyConn = Depends(get_conn)):
     async with conn.cursor(row_factory=dict_row) as cur:
         await cur.execute("select id::text, email, name from users where lower(email)=lower(%s)", (body.email,))
         row = await cur.fetchone()
@@ -72,69 +73,81 @@ async def upsert_user(body: UserUpsertIn, conn: AsyncConnection = Depends(get_co
 async def update_me(
     body: UserUpdateIn,
     current: UserPublic = Depends(get_current_user),
-    conn: AsyncConnection = Depends(get_conn),
+    conn: LazyConn = Depends(get_conn),
 ):
     # актуальные значения пользователя
     async with conn.cursor(row_factory=dict_row) as cur:
         await cur.execute("select id::text, email, name, password_hash from users where id=%s::uuid", (current.id,))
         row = await cur.fetchone()
-        if not row:
-            raise HTTPException(401, "User not found")
+    if not row:
+        raise HTTPException(401, "User not found")
 
-    old_email = row["email"]
-    changed = False
-
-    # 1) смена имени
-    if body.name is not None and body.name.strip() != row["name"]:
-        async with conn.cursor() as cur:
-            await cur.execute("update users set name=%s where id=%s::uuid", (body.name.strip(), current.id))
-        current.name = body.name.strip()
-        changed = True
-
-    # 2) смена пароля (если передан new_password — требуем current_password и проверяем)
+    # смена пароля (если передан new_password — требуем current_password и проверяем);
+    # bcrypt — вне соединения из пула, как в login
+    pwd_hash = None
     if body.new_password:
         if not body.current_password:
             raise HTTPException(400, "current_password is required to change password")
         if not verify_password(body.current_password, row.get("password_hash")):
             raise HTTPException(400, "Current password is incorrect")
         pwd_hash = hash_password(body.new_password)
-        async with conn.cursor() as cur:
-            await cur.execute("update users set password_hash=%s where id=%s::uuid", (pwd_hash, current.id))
-        changed = True
-
-    # 3) смена email (с каскадными апдейтами там, где у тебя поиск по email)
-    if body.email and body.email.lower() != old_email.lower():
-        # проверка уникальности
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("select 1 from users where lower(email)=lower(%s)", (body.email,))
-            if await cur.fetchone():
-                raise HTTPException(409, "Email already registered")
-
-        async with conn.transaction():
+
+    # все записи — одна транзакция (как раньше): при 409 ничего не коммитим
+    async with conn.acquire():
+        old_email = row["email"]
+        changed = False
+
+        # 1) смена имени
+        if body.name is not None and body.name.strip() != row["name"]:
+            async with conn.cursor() as cur:
+                await cur.execute("update users set name=%s where id=%s::uuid", (body.name.strip(), current.id))
+            current.name = body.name.strip()
+            changed = True
+
+        # 2) смена пароля: хэш проверен выше — пишем, только если он с тех пор не менялся
+        if pwd_hash is not None:
             async with conn.cursor() as cur:
-                # users
-                await cur.execute("update users set email=%s where id=%s::uuid", (body.email, current.id))
-                # addresses.user_email
-                await cur.execute(
-                    "update addresses set user_email=%s where lower(user_email)=lower(%s)",
-                    (body.email, old_email),
-                )
-                # orders.email
-                await cur.execute(
-                    "update orders set email=%s where lower(email)=lower(%s)",
-                    (body.email, old_email),
-                )
-                # orders.customer->>'email'
                 await cur.execute(
-                    "update orders set customer = jsonb_set(coalesce(customer,'{}'::jsonb), '{email}', to_jsonb(%s::text), true)"
-                    " where lower(customer->>'email') = lower(%s)",
-                    (body.email, old_email),
+                    "update users set password_hash=%s where id=%s::uuid and password_hash is not distinct from %s",
+                    (pwd_hash, current.id, row.get("password_hash")),
                 )
-        current.email = body.email
-        changed = True
-
-    if not changed:
-        # ничего не поменяли — вернём текущее
-        return current
-
-    return current
\ No newline at end of file
+                if cur.rowcount == 0:
+                    raise HTTPException(409, "Password was changed concurrently, try again")
+            changed = True
+
+        # 3) смена email (с каскадными апдейтами там, где у тебя поиск по email)
+        if body.email and body.email.lower() != old_email.lower():
+            # проверка уникальности
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute("select 1 from users where lower(email)=lower(%s)", (body.email,))
+                if await cur.fetchone():
+                    raise HTTPException(409, "Email already registered")
+
+            async with conn.transaction():
+                async with conn.cursor() as cur:
+                    # users
+                    await cur.execute("update users set email=%s where id=%s::uuid", (body.email, current.id))
+                    # addresses.user_email
+                    await cur.execute(
+                        "update addresses set user_email=%s where lower(user_email)=lower(%s)",
+                        (body.email, old_email),
+                    )
+                    # orders.email
+                    await cur.execute(
+                        "update orders set email=%s where lower(email)=lower(%s)",
+                        (body.email, old_email),
+                    )
+                    # orders.customer->>'email'
+                    await cur.execute(
+                        "update orders set customer = jsonb_set(coalesce(customer,'{}'::jsonb), '{email}', to_jsonb(%s::text), true)"
+                        " where lower(customer->>'email') = lower(%s)",
+                        (body.email, old_email),
+                    )
+            current.email = body.email
+            changed = True
+
+        if not changed:
+            # ничего не поменяли — вернём текущее
+            return current
+
+        return current
\ No newline at end of file
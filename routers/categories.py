@@ -1,12 +1,16 @@
 # routers/categories.py
 from fastapi import APIRouter, Depends
-from psycopg import AsyncConnection
-from db import get_conn, dict_cursor
+from db import get_read_conn, dict_cursor, LazyConn
+from responses import RawJSONResponse
+from caching import conditional_get
 
 router = APIRouter(prefix="/categories", tags=["categories"])
 
 @router.get("", response_model=list[dict])
-async def list_categories(conn: AsyncConnection = Depends(get_conn)):
+async def list_categories(
+    conn: LazyConn = Depends(get_read_conn),
+    cache: dict = Depends(conditional_get("categories")),
+):
     async with dict_cursor(conn) as cur:
         await cur.execute("""
             select id::text, title, slug, parent_id::text
@@ -30,4 +34,4 @@ async def list_categories(conn: AsyncConnection = Depends(get_conn)):
             roots.append(node)
 
     # Пустые children не мешают; фронту подходит форма из src/data/categories.ts
-    return roots
+    return RawJSONResponse(roots, headers=cache)
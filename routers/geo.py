@@ -1,16 +1,55 @@
 # routers/geo.py
 import os
 from typing import Optional
-from fastapi import APIRouter, Request, HTTPException
-import httpx
+from fastapi import APIRouter, Depends, Request, HTTPException
+
+from geoip import LocalGeoDB
+from outbound import http_client, TTLCache, SingleFlight, dependency, request_budget
 
 router = APIRouter(prefix="/geo", tags=["geo"])
 
 # Можно выбрать провайдер через переменные окружения:
-# GEO_PROVIDER = ipwhois | ipinfo  (default: ipwhois)
+# GEO_PROVIDER = ipwhois | ipinfo | local  (default: ipwhois)
 # IPINFO_TOKEN = <token>            (если выбран ipinfo)
+# GEO_DB_PATH  = <csv>              (если выбран local: start,end,country)
+# GEO_FALLBACK_PROVIDER = ipwhois | ipinfo | none — для local, только на промахах
 GEO_PROVIDER = (os.getenv("GEO_PROVIDER") or "ipwhois").strip().lower()
+GEO_DB_PATH = (os.getenv("GEO_DB_PATH") or "").strip()
+GEO_DB_RELOAD_SEC = float(os.getenv("GEO_DB_RELOAD_SEC", "60"))
+GEO_FALLBACK_PROVIDER = (os.getenv("GEO_FALLBACK_PROVIDER") or "ipwhois").strip().lower()
+REMOTE_PROVIDER = GEO_PROVIDER if GEO_PROVIDER != "local" else GEO_FALLBACK_PROVIDER
 IPINFO_TOKEN = (os.getenv("IPINFO_TOKEN") or "").strip()
+# базовые URL можно переопределить (локальный стаб в тестах/нагрузке)
+IPWHOIS_URL = (os.getenv("GEO_IPWHOIS_URL") or "https://ipwho.is").strip().rstrip("/")
+IPINFO_URL = (os.getenv("GEO_IPINFO_URL") or "https://ipinfo.io").strip().rstrip("/")
+
+# кэш IP → страна: GEO_CACHE_SIZE записей, TTL GEO_CACHE_TTL сек, неудачи — GEO_NEGATIVE_TTL
+GEO_CACHE_SIZE = int(os.getenv("GEO_CACHE_SIZE", "50000"))
+GEO_CACHE_TTL = float(os.getenv("GEO_CACHE_TTL", str(24 * 3600)))
+GEO_NEGATIVE_TTL = float(os.getenv("GEO_NEGATIVE_TTL", "300"))
+
+# защита внешнего сервиса: таймаут вызова, бюджет на весь /geo/country,
+# breaker (GEO_BREAKER_FAILURES ошибок подряд → GEO_BREAKER_RESET сек без вызовов)
+GEO_TIMEOUT = float(os.getenv("GEO_TIMEOUT", "2"))
+GEO_BUDGET = float(os.getenv("GEO_BUDGET", "2.5"))
+_upstream = dependency(
+    "geo",
+    timeout=GEO_TIMEOUT,
+    max_concurrency=int(os.getenv("GEO_MAX_CONCURRENCY", "20")),
+    failure_threshold=int(os.getenv("GEO_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("GEO_BREAKER_RESET", "30")),
+)
+
+_country_cache = TTLCache(GEO_CACHE_SIZE, GEO_CACHE_TTL)
+_inflight = SingleFlight()
+_MISS = object()
+
+_local_db = LocalGeoDB(GEO_DB_PATH, GEO_DB_RELOAD_SEC) if GEO_PROVIDER == "local" and GEO_DB_PATH else None
+
+async def startup():
+    # вызывается из lifespan: база диапазонов грузится до первого запроса
+    if _local_db is not None:
+        await _local_db.load()
 
 _HEADER_COUNTRY_KEYS = [
     "cf-ipcountry",                 # Cloudflare
@@ -40,37 +79,65 @@ def _client_ip(req: Request) -> Optional[str]:
         return xri.strip()
     return (req.client.host if req.client else None)
 
-async def _lookup_country_by_ip(ip: str) -> Optional[str]:
+async def _fetch_country(ip: str) -> Optional[str]:
+    if REMOTE_PROVIDER == "none":
+        return None
     try:
-        timeout = httpx.Timeout(5.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            if GEO_PROVIDER == "ipinfo":
-                if not IPINFO_TOKEN:
-                    return None
-                r = await client.get(f"https://ipinfo.io/{ip}", params={"token": IPINFO_TOKEN})
-                if r.status_code != 200:
-                    return None
-                cc = (r.json() or {}).get("country")
-                return (cc or "").strip().upper() or None
-            # default: ipwho.is
-            r = await client.get(f"https://ipwho.is/{ip}", params={"fields": "success,country_code"})
-            if r.status_code != 200:
+        client = http_client("geo", timeout=GEO_TIMEOUT)
+        if REMOTE_PROVIDER == "ipinfo":
+            if not IPINFO_TOKEN:
                 return None
-            data = r.json() or {}
-            if data.get("success") is False:
+            r = await _upstream.call(
+                lambda t: client.get(f"{IPINFO_URL}/{ip}", params={"token": IPINFO_TOKEN}, timeout=t),
+                failed=_is_server_error,
+            )
+            if r.status_code != 200:
                 return None
-            cc = data.get("country_code")
+            cc = (r.json() or {}).get("country")
             return (cc or "").strip().upper() or None
+        # default: ipwho.is
+        r = await _upstream.call(
+            lambda t: client.get(f"{IPWHOIS_URL}/{ip}", params={"fields": "success,country_code"}, timeout=t),
+            failed=_is_server_error,
+        )
+        if r.status_code != 200:
+            return None
+        data = r.json() or {}
+        if data.get("success") is False:
+            return None
+        cc = data.get("country_code")
+        return (cc or "").strip().upper() or None
     except Exception:
+        # в т.ч. UpstreamUnavailable: breaker открыт — отвечаем сразу, без сети
         return None
 
-@router.get("/country")
+def _is_server_error(r) -> bool:
+    # 429 тоже: сервис просит притормозить
+    return r.status_code >= 500 or r.status_code == 429
+
+async def _fetch_and_cache(ip: str) -> Optional[str]:
+    cc = await _fetch_country(ip)
+    # неудачи тоже кэшируем, но коротко — чтобы не долбить сервис тем же IP;
+    # отказ по открытому breaker'у не кэшируем: после восстановления IP снова спросим
+    if cc or _upstream.state == _upstream.CLOSED:
+        _country_cache.set(ip, cc, ttl=None if cc else GEO_NEGATIVE_TTL)
+    return cc
+
+async def _lookup_country_by_ip(ip: str) -> Optional[str]:
+    cc = _country_cache.get(ip, _MISS)
+    if cc is not _MISS:
+        return cc
+    # всплеск холодных загрузок страницы → один запрос наружу на IP
+    return await _inflight.do(ip, lambda: _fetch_and_cache(ip))
+
+@router.get("/country", dependencies=[Depends(request_budget(GEO_BUDGET))])
 async def country(request: Request):
     """
     Вернёт ISO-код страны клиента (например, {'country':'UA'}).
     Логика:
       1) Пытаемся взять из заголовков CDN/прокси.
-      2) Иначе — берём IP клиента и спрашиваем внешний сервис.
+      2) Иначе — берём IP клиента: локальная база (GEO_PROVIDER=local),
+         при промахе — внешний сервис.
     """
     # 1) заголовки CDN
     cc = _pick_header_country(request)
@@ -83,6 +150,11 @@ async def country(request: Request):
         # не удалось определить
         return {"country": None, "source": "unknown"}
 
+    if _local_db is not None:
+        cc = _local_db.lookup(ip)
+        if cc:
+            return {"country": cc, "source": "local", "ip": ip}
+
     cc = await _lookup_country_by_ip(ip)
     if cc:
         return {"country": cc, "source": "service", "ip": ip}
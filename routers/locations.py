@@ -1,7 +1,17 @@
 # routers/locations.py
 import os
-from fastapi import APIRouter, HTTPException, Query
+import json
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Query
 import httpx
+import psycopg
+
+import jobs
+from db import pool, LazyConn
+from dhl_index import LocalLocations, normalize_location, location_types
+from outbound import http_client, SWRCache, UpstreamUnavailable, dependency, request_budget
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/locations", tags=["locations"])
 
@@ -12,7 +22,44 @@ DHL_BASE_URL = (os.getenv("DHL_BASE_URL") or "https://api.dhl.com/location-finde
 # фронт шлёт "postfiliale", у DHL это "postoffice"
 TYPE_MAP = {"packstation": "packstation", "postfiliale": "postoffice", "parcelshop": "parcelshop"}
 
-@router.get("")
+# кэш ответов DHL: свежие LOCATIONS_CACHE_TTL сек, ещё LOCATIONS_STALE_TTL — отдаём
+# устаревшие, обновляя в фоне
+LOCATIONS_CACHE_TTL = float(os.getenv("LOCATIONS_CACHE_TTL", "3600"))
+LOCATIONS_STALE_TTL = float(os.getenv("LOCATIONS_STALE_TTL", str(24 * 3600)))
+_locations_cache = SWRCache(
+    maxsize=int(os.getenv("LOCATIONS_CACHE_SIZE", "5000")),
+    ttl=LOCATIONS_CACHE_TTL,
+    stale_ttl=LOCATIONS_STALE_TTL,
+)
+
+# защита DHL: таймаут вызова, бюджет на весь запрос /locations, bulkhead и breaker
+DHL_TIMEOUT = float(os.getenv("DHL_TIMEOUT", "5"))
+LOCATIONS_BUDGET = float(os.getenv("LOCATIONS_BUDGET", "6"))
+_upstream = dependency(
+    "dhl",
+    timeout=DHL_TIMEOUT,
+    max_concurrency=int(os.getenv("DHL_MAX_CONCURRENCY", "20")),
+    failure_threshold=int(os.getenv("DHL_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("DHL_BREAKER_RESET", "30")),
+)
+
+# LOCATIONS_SOURCE = auto (локальный индекс, если загружен; иначе DHL) | dhl
+LOCATIONS_SOURCE = (os.getenv("LOCATIONS_SOURCE") or "auto").strip().lower()
+_local: LocalLocations | None = None
+
+async def startup():
+    # вызывается из lifespan: индекс точек и центроиды PLZ — в память
+    global _local
+    if LOCATIONS_SOURCE == "dhl":
+        return
+    try:
+        _local = await LocalLocations.load(LazyConn(pool))
+    except psycopg.errors.UndefinedTable:
+        logger.warning("locations: schema_patch_locations.sql is not applied, using DHL only")
+        return
+    logger.info("locations: %d points, %d zip centroids", len(_local.index), len(_local.centroids))
+
+@router.get("", dependencies=[Depends(request_budget(LOCATIONS_BUDGET))])
 async def list_locations(
     zip: str = Query(..., alias="zip"),
     city: str = Query(""),
@@ -20,24 +67,46 @@ async def list_locations(
     radius: int = Query(5, ge=1, le=50),
     results: int = Query(10, ge=1, le=50),
 ):
+    mapped_type = TYPE_MAP.get(type.lower().strip(), type.lower().strip())
+    if _local is not None and _local.ready:
+        # радиус + k ближайших по локальной сетке; промах (нет PLZ / пусто) — в DHL
+        items = _local.nearest(zip, radius, results, mapped_type)
+        if items is not None:
+            return {"items": items}
+
     if not DHL_KEY:
         raise HTTPException(424, detail="DHL lookup failed: DHL_API_KEY is not configured")
 
     params = {
         "countryCode": "DE",
         "postalCode": zip,
-        "types": TYPE_MAP.get(type.lower().strip(), type.lower().strip()),
+        "types": mapped_type,
         "radius": radius,
         "limit": results,
     }
     if city.strip():
         params["city"] = city.strip()
 
+    key = (zip.strip(), city.strip().lower(), params["types"], radius, results)
+    # одни и те же zip/type на чекауте — из кэша; устаревшее отдаём сразу и обновляем в фоне
+    return await _locations_cache.get_or_fetch(key, lambda: _fetch_locations(params))
+
+
+async def _fetch_locations(params: dict) -> dict:
     headers = {"Accept": "application/json", "DHL-API-Key": DHL_KEY}
 
+    client = http_client("dhl", timeout=DHL_TIMEOUT)
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            resp = await client.get(DHL_BASE_URL, params=params, headers=headers)
+        resp = await _upstream.call(
+            lambda t: client.get(DHL_BASE_URL, params=params, headers=headers, timeout=t),
+            failed=lambda r: r.status_code >= 500 or r.status_code == 429,
+        )
+    except UpstreamUnavailable as e:
+        # breaker открыт / нет слотов / вышел бюджет — отвечаем сразу, без сети
+        raise HTTPException(503, detail=f"DHL unavailable: {e.reason}",
+                            headers={"Retry-After": str(max(1, round(e.retry_after)))})
+    except (httpx.TimeoutException, TimeoutError):
+        raise HTTPException(504, detail="DHL timeout")
     except httpx.RequestError as e:
         raise HTTPException(502, detail=f"DHL network error: {e!s}")
 
@@ -60,23 +129,42 @@ async def list_locations(
     data = resp.json()
     items_raw = data.get("locations") or data.get("items") or []
 
-    items = []
+    items, rows = [], []
     for loc in items_raw:
-        addr = (loc.get("address") or {})
-        geo = ((loc.get("location") or {}).get("geo")) or (loc.get("coordinates") or {})
-        types_list = loc.get("types") or []
-        loc_type = (types_list[0] if types_list else loc.get("type"))
-        items.append({
-            "id": loc.get("locationId") or loc.get("id"),
-            "name": loc.get("name") or loc_type,
-            "type": loc_type,
-            "street": addr.get("streetAddress") or addr.get("street") or "",
-            "house": addr.get("streetNumber") or "",
-            "zip": addr.get("postalCode") or "",
-            "city": addr.get("city") or "",
-            "openingHours": loc.get("openingHours") or loc.get("openingTimes") or [],
-            "lat": geo.get("latitude"),
-            "lng": geo.get("longitude"),
-        })
+        item = normalize_location(loc)
+        items.append(item)
+        types = location_types(loc) | {params["types"]}
+        # DHL — источник обновления локального индекса: что пришло, то и подкладываем
+        if _local is not None:
+            _local.index.add(item, types)
+        if item["id"] is not None and item["lat"] is not None and item["lng"] is not None:
+            rows.append({**item, "types": sorted(types)})
+
+    if rows and _local is not None:
+        # в dhl_locations — фоновой задачей: другим воркерам и после рестарта без похода в DHL
+        try:
+            await jobs.enqueue(None, "dhl.persist", {"items": rows}, dedupe_key=f"dhl.persist:{params['postalCode']}:{params['types']}")
+        except Exception as e:
+            logger.warning("locations: failed to enqueue dhl.persist: %s", e)
 
     return {"items": items}
+
+
+@jobs.job("dhl.persist")
+async def _persist_locations(payload: dict, conn: LazyConn):
+    # тот же upsert, что у импортёра dhl_index.py: типы точки объединяются
+    rows = [
+        (str(i["id"]), i["types"], i["name"], i["type"], i["street"], i["house"], i["zip"], i["city"],
+         json.dumps(i["openingHours"]), float(i["lat"]), float(i["lng"]))
+        for i in payload["items"]
+    ]
+    async with conn.cursor() as cur:
+        await cur.executemany("""
+          insert into dhl_locations (id, types, name, type, street, house, zip, city, opening_hours, lat, lng, updated_at)
+          values (%s, %s, %s, %s, %s, %s, %s, %s, %s::jsonb, %s, %s, now())
+          on conflict (id) do update set
+            types = (select array(select distinct unnest(dhl_locations.types || excluded.types))),
+            name = excluded.name, type = excluded.type, street = excluded.street, house = excluded.house,
+            zip = excluded.zip, city = excluded.city, opening_hours = excluded.opening_hours,
+            lat = excluded.lat, lng = excluded.lng, updated_at = now()
+        """, rows)
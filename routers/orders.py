@@ -1,23 +1,54 @@
 # routers/orders.py
-import uuid, json
-from fastapi import APIRouter, Depends, HTTPException
-from psycopg import AsyncConnection
-from db import get_conn, dict_cursor
+import os, uuid, json
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from admission import CRITICAL, priority
+from db import get_conn, get_conn_ro, dict_cursor, fetch_pipelined, stream_json_array, pg_json_enabled, statement_timeout, LazyConn
 from models import OrderCreateIn, OrderOut, CartItemIn, Totals, Customer, Shipping
 from uuid import UUID
 from security import get_optional_user, get_current_user
 from models import UserPublic
+from responses import RawJSONResponse, parse_fields
 
 router = APIRouter(prefix="/orders", tags=["orders"])
 
+# история заказов по e-mail без лимита — бюджет на запрос, чтобы не держать соединение пула
+ORDERS_LIST_TIMEOUT_MS = int(os.getenv("ORDERS_LIST_TIMEOUT_MS", "5000"))
+
 def _serialize_items(items: list[CartItemIn]) -> list[dict]:
     return [i.model_dump() for i in items]
 
+# поля OrderOut → колонки orders (items собираются отдельно)
+ORDER_COLUMNS = {
+    "id": "o.id::text",
+    "created_at": "o.created_at::timestamptz::text",
+    "items": None,
+    "totals": "o.totals",
+    "customer": "o.customer",
+    "shipping": "o.shipping",
+    "payment": "o.payment",
+    "status": "o.status",
+    "refund": "o.refund",
+}
+ORDER_ITEMS_JSON = """coalesce((
+              select json_agg(json_build_object(
+                'id', oi.product_id::text, 'qty', oi.qty, 'title', oi.title,
+                'price', oi.price::float, 'slug', oi.slug, 'imageUrl', oi.image_url
+              ))
+              from order_items oi where oi.order_id = o.id
+            ), '[]'::json)"""
+
+def _order_out(o: dict, items: list[dict], fields: list[str] | None = None) -> dict:
+    # строка orders + позиции в форме OrderOut (порядок ключей — как у модели).
+    # totals/customer/shipping — jsonb-снапшоты, которые пишет create_order из
+    # тех же моделей, поэтому отдаём их как есть, без ревалидации
+    return {f: (items if f == "items" else o.get(f)) for f in (fields or ORDER_COLUMNS)}
+
 @router.post("", response_model=OrderOut)
 async def create_order(
     body: OrderCreateIn,
     current: UserPublic | None = Depends(get_optional_user),
-    conn: AsyncConnection = Depends(get_conn)
+    conn: LazyConn = Depends(get_conn)
 ):
     order_id = str(uuid.uuid4())
     payment = {
@@ -26,20 +57,19 @@ async def create_order(
         "last4": body.last4 or "",
     }
     # если пользователь авторизован — проставим user_id/email в слоты "старой" схемы
-    user_id = None
-    async with dict_cursor(conn) as cur:
-        if current:
-            await cur.execute("select id::text from users where lower(email)=lower(%s)", (current.email,))
-            urow = await cur.fetchone()
-            user_id = urow["id"] if urow else None
+    # (get_optional_user уже загрузил его по email — повторно в users не ходим)
+    user_id = current.id if current else None
 
-    async with conn.transaction():
-        async with dict_cursor(conn) as cur:
+    # вся запись + чтение обратно — одна транзакция и один flush (pipeline)
+    async with conn.transaction(), conn.pipeline():
+        async with dict_cursor(conn) as cur, dict_cursor(conn) as cur_items:
             await cur.execute(
                 """
                 insert into orders
                 (id, created_at, currency, vat_rate, totals, customer, shipping, payment, status, user_id, email)
                 values (%s, now(), %s, %s, %s::jsonb, %s::jsonb, %s::jsonb, %s::jsonb, 'processing', %s::uuid, %s)
+                returning id::text, created_at::timestamptz::text,
+                          totals, customer, shipping, payment, status, refund
                 """,
                 (
                     order_id,
@@ -54,33 +84,27 @@ async def create_order(
                 ),
             )
 
-            for it in body.items:
-                await cur.execute(
+            async with conn.cursor() as cur_ins:
+                await cur_ins.executemany(
                     """
                     insert into order_items (id, order_id, product_id, title, slug, price, qty, image_url)
                     values (%s,%s,%s,%s,%s,%s,%s,%s)
                     """,
-                    (str(uuid.uuid4()), order_id, it.id, it.title, it.slug, it.price, it.qty, it.imageUrl),
+                    [
+                        (str(uuid.uuid4()), order_id, it.id, it.title, it.slug, it.price, it.qty, it.imageUrl)
+                        for it in body.items
+                    ],
                 )
 
-            await cur.execute(
-                """
-                select id::text, created_at::timestamptz::text,
-                       totals, customer, shipping, payment, status, refund
-                from orders where id=%s::uuid
-                """,
-                (order_id,),
-            )
-            row = await cur.fetchone()
-
-            await cur.execute(
+            await cur_items.execute(
                 """
                 select product_id::text as id, title, slug, price::float, qty, image_url as "imageUrl"
                 from order_items where order_id=%s::uuid
                 """,
                 (order_id,),
             )
-            items = await cur.fetchall()
+            row = await cur.fetchone()
+            items = await cur_items.fetchall()
 
     return OrderOut(
         id=row["id"],
@@ -94,57 +118,80 @@ async def create_order(
         refund=row.get("refund"),
     )
 
-@router.get("", response_model=list[OrderOut])
+@router.get("", response_model=list[OrderOut], dependencies=[Depends(statement_timeout(ORDERS_LIST_TIMEOUT_MS))])
 async def list_orders(
     email: str | None = None,
+    fields: str | None = Query(None, description="через запятую, например id,created_at,status,totals (по умолчанию — все поля)"),
     current: UserPublic | None = Depends(get_optional_user),
-    conn: AsyncConnection = Depends(get_conn),
+    conn: LazyConn = Depends(get_conn_ro),
 ):
     effective_email = (current.email if current else None) or email
     if not effective_email:
         raise HTTPException(401, "Email is required (or send Authorization bearer token)")
+    cols = parse_fields(fields, ORDER_COLUMNS)
+    where_sql = """
+          where lower((o.customer->>'email')) = lower(%s)
+             or lower(o.email) = lower(%s)
+    """
 
-    async with dict_cursor(conn) as cur:
-        await cur.execute(
-            """
-            select id::text, created_at::timestamptz::text,
-                   totals, customer, shipping, payment, status, refund
-            from orders
-            where lower((customer->>'email')) = lower(%s)
-               or lower(email) = lower(%s)
-            order by created_at desc
+    if pg_json_enabled("orders"):
+        # каждый заказ (с вложенными items) собирает Postgres, ответ стримится
+        # построчно — память на запрос не растёт с длиной истории заказов
+        pairs = ", ".join(
+            f"'{f}', " + (ORDER_ITEMS_JSON if f == "items" else ORDER_COLUMNS[f]) for f in cols
+        )
+        sql_json = f"""
+          select json_build_object({pairs})
+          from orders o
+          {where_sql}
+          order by o.created_at desc
+        """
+        return StreamingResponse(
+            stream_json_array(conn, sql_json, (effective_email, effective_email)),
+            media_type="application/json",
+        )
+
+    # "_id" — служебный ключ для группировки позиций, в ответ не попадает
+    select_list = ", ".join(['o.id::text as "_id"'] + [f'{ORDER_COLUMNS[f]} as "{f}"' for f in cols if f != "items"])
+    sql_orders = f"""
+      select {select_list}
+      from orders o
+      {where_sql}
+      order by o.created_at desc
+    """
+    if "items" not in cols:
+        # позиции не нужны — в order_items вообще не ходим
+        async with dict_cursor(conn) as cur:
+            await cur.execute(sql_orders, (effective_email, effective_email))
+            orders = await cur.fetchall()
+        return RawJSONResponse([_order_out(o, [], cols) for o in orders])
+
+    # заказы и все их позиции — два независимых запроса за один round trip
+    # (раньше: 1 + N запросов, по одному на каждый заказ)
+    orders, all_items = await fetch_pipelined(
+        conn,
+        (sql_orders, (effective_email, effective_email)),
+        (
+            f"""
+            select oi.order_id::text as order_id,
+                   oi.product_id::text as id, oi.title, oi.slug, oi.price::float, oi.qty,
+                   oi.image_url as "imageUrl"
+            from order_items oi
+            join orders o on o.id = oi.order_id
+            {where_sql}
             """,
             (effective_email, effective_email),
-        )
-        orders = await cur.fetchall()
+        ),
+    )
 
-        res: list[OrderOut] = []
-        for o in orders:
-            await cur.execute(
-                """
-                select product_id::text as id, title, slug, price::float, qty, image_url as "imageUrl"
-                from order_items where order_id=%s::uuid
-                """,
-                (o["id"],),
-            )
-            items = await cur.fetchall()
-            res.append(
-                OrderOut(
-                    id=o["id"],
-                    created_at=o["created_at"],
-                    items=[CartItemIn.model_validate(i) for i in items],
-                    totals=Totals.model_validate(o["totals"]),
-                    customer=Customer.model_validate(o["customer"]),
-                    shipping=Shipping.model_validate(o["shipping"]),
-                    payment=o["payment"],
-                    status=o["status"],
-                    refund=o.get("refund"),
-                )
-            )
-    return res
+    items_by_order: dict[str, list[dict]] = {}
+    for i in all_items:
+        items_by_order.setdefault(i.pop("order_id"), []).append(i)
+
+    return RawJSONResponse([_order_out(o, items_by_order.get(o["_id"], []), cols) for o in orders])
 
 @router.post("/{order_id}/cancel")
-async def cancel_order(order_id: str, conn: AsyncConnection = Depends(get_conn)):
+async def cancel_order(order_id: str, conn: LazyConn = Depends(get_conn)):
     async with dict_cursor(conn) as cur:
         await cur.execute(
             "select status, (payment->>'status') as pay from orders where id=%s::uuid",
@@ -165,11 +212,14 @@ async def request_return(
     order_id: str,
     reason: str,
     comment: str | None = None,
-    conn: AsyncConnection = Depends(get_conn),
+    conn: LazyConn = Depends(get_conn),
 ):
     async with dict_cursor(conn) as cur:
+        # статус и окно возврата — одной строкой, без второго запроса
         await cur.execute(
-            "select status, created_at, (payment->>'status') as pay from orders where id=%s::uuid",
+            "select status, created_at, (payment->>'status') as pay,"
+            " (now() - created_at) <= interval '30 days' as ok"
+            " from orders where id=%s::uuid",
             (order_id,),
         )
         row = await cur.fetchone()
@@ -179,13 +229,7 @@ async def request_return(
             raise HTTPException(400, "Only paid orders can be returned")
         if row["status"] in ("cancelled", "refund_requested", "refunded"):
             raise HTTPException(400, "Order not eligible")
-
-        await cur.execute(
-            "select (now() - created_at) <= interval '30 days' as ok from orders where id=%s::uuid",
-            (order_id,),
-        )
-        ok = (await cur.fetchone())["ok"]
-        if not ok:
+        if not row["ok"]:
             raise HTTPException(400, "Return window closed")
 
         await cur.execute(
@@ -208,7 +252,7 @@ async def request_return(
 async def approve_refund(
     order_id: str,
     amount: float | None = None,
-    conn: AsyncConnection = Depends(get_conn),
+    conn: LazyConn = Depends(get_conn),
 ):
     async with dict_cursor(conn) as cur:
         await cur.execute(
@@ -242,7 +286,7 @@ async def approve_refund(
     return {"ok": True}
 
 @router.post("/{order_id}/refund/cancel")
-async def cancel_refund_request(order_id: str, conn: AsyncConnection = Depends(get_conn)):
+async def cancel_refund_request(order_id: str, conn: LazyConn = Depends(get_conn)):
     async with dict_cursor(conn) as cur:
         await cur.execute(
             "select status, (payment->>'status') as pay from orders where id=%s::uuid",
@@ -259,46 +303,36 @@ async def cancel_refund_request(order_id: str, conn: AsyncConnection = Depends(g
         )
     return {"ok": True}
 
-@router.get("/{order_id}", response_model=OrderOut)
-async def get_order(order_id: UUID, conn: AsyncConnection = Depends(get_conn)):
+# страница подтверждения сразу после оплаты — наравне с чекаутом
+@router.get("/{order_id}", response_model=OrderOut, dependencies=[Depends(priority(CRITICAL))])
+async def get_order(order_id: UUID, conn: LazyConn = Depends(get_conn_ro)):
     order_id = str(order_id)
-    async with dict_cursor(conn) as cur:
-        await cur.execute(
+    # заказ и позиции — один round trip; позиции несуществующего заказа просто пустые
+    orders, items = await fetch_pipelined(
+        conn,
+        (
             """
             select id::text, created_at::timestamptz::text,
                    totals, customer, shipping, payment, status, refund
             from orders where id=%s::uuid
             """,
             (order_id,),
-        )
-        o = await cur.fetchone()
-        if not o:
-            raise HTTPException(404, "Order not found")
-
-        await cur.execute(
+        ),
+        (
             """
             select product_id::text as id, title, slug, price::float, qty, image_url as "imageUrl"
             from order_items
             where order_id=%s::uuid
             """,
             (order_id,),
-        )
-        items = await cur.fetchall()
-
-    return OrderOut(
-        id=o["id"],
-        created_at=o["created_at"],
-        items=[CartItemIn.model_validate(i) for i in items],
-        totals=Totals.model_validate(o["totals"]),
-        customer=Customer.model_validate(o["customer"]),
-        shipping=Shipping.model_validate(o["shipping"]),
-        payment=o["payment"],
-        status=o["status"],
-        refund=o.get("refund"),
+        ),
     )
+    if not orders:
+        raise HTTPException(404, "Order not found")
+    return RawJSONResponse(_order_out(orders[0], items))
 
 # --- helper: смена статуса с проверками ---
-async def _set_status(conn: AsyncConnection, order_id: str, new_status: str):
+async def _set_status(conn: LazyConn, order_id: str, new_status: str):
     async with dict_cursor(conn) as cur:
         await cur.execute(
             "select status, (payment->>'status') as pay from orders where id=%s::uuid",
@@ -332,22 +366,22 @@ async def _set_status(conn: AsyncConnection, order_id: str, new_status: str):
     return {"ok": True}
 
 @router.post("/{order_id}/packed")
-async def mark_packed(order_id: str, conn: AsyncConnection = Depends(get_conn)):
+async def mark_packed(order_id: str, conn: LazyConn = Depends(get_conn)):
     return await _set_status(conn, order_id, "packed")
 
 @router.post("/{order_id}/shipped")
-async def mark_shipped(order_id: str, conn: AsyncConnection = Depends(get_conn)):
+async def mark_shipped(order_id: str, conn: LazyConn = Depends(get_conn)):
     return await _set_status(conn, order_id, "shipped")
 
 @router.post("/{order_id}/delivered")
-async def mark_delivered(order_id: str, conn: AsyncConnection = Depends(get_conn)):
+async def mark_delivered(order_id: str, conn: LazyConn = Depends(get_conn)):
     return await _set_status(conn, order_id, "delivered")
 
 @router.post("/{order_id}/pay")
 async def mark_paid(
     order_id: str,
     last4: str = "4242",
-    conn: AsyncConnection = Depends(get_conn),
+    conn: LazyConn = Depends(get_conn),
 ):
     async with dict_cursor(conn) as cur:
         await cur.execute("select 1 from orders where id=%s::uuid", (order_id,))
@@ -1,25 +1,110 @@
-# routers/payments.py
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 import os, stripe
+import contextvars
+import httpx
+
+from outbound import UpstreamUnavailable, dependency, request_budget
 
 router = APIRouter(prefix="/payments", tags=["payments"])
 
 stripe.api_key = os.environ.get("STRIPE_SECRET_KEY")
 
+# STRIPE_API_BASE — например, локальный stripe-mock (http://127.0.0.1:12111)
+STRIPE_API_BASE = (os.getenv("STRIPE_API_BASE") or "").strip() or None
+STRIPE_TIMEOUT = float(os.getenv("STRIPE_TIMEOUT", "10"))
+# сколько запросов к Stripe одновременно; остальные ждут не дольше STRIPE_QUEUE_TIMEOUT
+STRIPE_MAX_CONCURRENCY = int(os.getenv("STRIPE_MAX_CONCURRENCY", "20"))
+STRIPE_QUEUE_TIMEOUT = float(os.getenv("STRIPE_QUEUE_TIMEOUT", "2"))
+STRIPE_BUDGET = float(os.getenv("STRIPE_BUDGET", "12"))
+
+_client: stripe.StripeClient | None = None
+_http: stripe.HTTPXClient | None = None
+_upstream = dependency(
+    "stripe",
+    timeout=STRIPE_TIMEOUT,
+    max_concurrency=STRIPE_MAX_CONCURRENCY,
+    queue_timeout=STRIPE_QUEUE_TIMEOUT,
+    failure_threshold=int(os.getenv("STRIPE_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("STRIPE_BREAKER_RESET", "15")),
+)
+# ошибки, на которые Stripe ответил по существу (карта, параметры, ключ) — не отказ сервиса
+_STRIPE_CLIENT_ERRORS = (
+    stripe.CardError, stripe.InvalidRequestError, stripe.AuthenticationError,
+    stripe.PermissionError, stripe.IdempotencyError,
+)
+
+# таймаут текущего вызова (t из _upstream.call): у stripe-клиента таймаут общий,
+# поэтому подставляем его в каждый запрос сами
+_call_timeout: contextvars.ContextVar[float | None] = contextvars.ContextVar("stripe_call_timeout", default=None)
+
+class _HTTPXClient(stripe.HTTPXClient):
+    def _get_request_args_kwargs(self, method, url, headers, post_data):
+        args, kwargs = super()._get_request_args_kwargs(method, url, headers, post_data)
+        t = _call_timeout.get()
+        if t is not None:
+            kwargs["timeout"] = httpx.Timeout(t, connect=min(t, 3.0))
+        return args, kwargs
+
+def _stripe() -> stripe.StripeClient:
+    # один async-клиент (httpx, keep-alive) на всё время жизни приложения:
+    # всплеск чекаутов стоит соединений, а не потоков threadpool'а
+    global _client, _http
+    if _client is None:
+        _http = _HTTPXClient(
+            timeout=httpx.Timeout(STRIPE_TIMEOUT, connect=min(STRIPE_TIMEOUT, 3.0)),
+        )
+        _client = stripe.StripeClient(
+            stripe.api_key,
+            base_addresses={"api": STRIPE_API_BASE} if STRIPE_API_BASE else {},
+            http_client=_http,
+        )
+    return _client
+
+async def shutdown():
+    global _client, _http
+    if _http is not None:
+        await _http.close_async()
+    _client = _http = None
+
 class IntentIn(BaseModel):
     amount: int
     currency: str = "EUR"
+    order_id: str | None = None   # для idempotency key: повтор не создаёт второй PaymentIntent
 
-@router.post("/intent")
-def create_intent(data: IntentIn):
+@router.post("/intent", dependencies=[Depends(request_budget(STRIPE_BUDGET))])
+async def create_intent(data: IntentIn):
     if not stripe.api_key:
         raise HTTPException(500, "STRIPE_SECRET_KEY is not set")
     if data.amount < 50:
         raise HTTPException(400, "Minimum amount is 50 cents")
-    pi = stripe.PaymentIntent.create(
-        amount=data.amount,
-        currency=data.currency.lower(),
-        automatic_payment_methods={"enabled": True},
-    )
+
+    params = {
+        "amount": data.amount,
+        "currency": data.currency.lower(),
+        "automatic_payment_methods": {"enabled": True},
+    }
+    options: stripe.RequestOptions = {}
+    if data.order_id:
+        # тот же заказ и сумма → тот же intent (повтор после таймаута, двойной клик);
+        # сумма/валюта в ключе: иначе смена суммы дала бы IdempotencyError
+        options["idempotency_key"] = f"pi:{data.order_id}:{data.amount}:{params['currency']}"
+
+    async def create(t: float):
+        token = _call_timeout.set(t)
+        try:
+            return await _stripe().payment_intents.create_async(params=params, options=options)
+        finally:
+            _call_timeout.reset(token)
+
+    try:
+        pi = await _upstream.call(create, ok_errors=_STRIPE_CLIENT_ERRORS)
+    except UpstreamUnavailable as e:
+        # занято / breaker открыт — быстрый отказ вместо очереди к лежащему Stripe
+        raise HTTPException(503, "Payment provider is unavailable, retry shortly",
+                            headers={"Retry-After": str(max(1, round(e.retry_after)))})
+    except TimeoutError:
+        raise HTTPException(504, "Stripe timeout")
+    except stripe.APIConnectionError as e:
+        raise HTTPException(504, f"Stripe network error: {e.user_message or e!s}")
     return {"client_secret": pi.client_secret}
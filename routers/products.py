@@ -1,29 +1,108 @@
 # routers/products.py
-from fastapi import APIRouter, Depends, Query
-from psycopg import AsyncConnection
-from db import get_conn, dict_cursor
-from models import ProductsQuery, ProductsPage, ProductOut, PageOut
+import os
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+import psycopg
+import catalog_snapshot
+import jobs
+from admission import search_priority
+from db import get_conn_ro, get_read_conn, dict_cursor, fetch_pipelined, fetch_json, pg_json_enabled, statement_timeout, LazyConn
+from models import ProductsQuery, ProductsPage, ProductOut, CatalogChanges
+from responses import RawJSONResponse, parse_fields
+from caching import conditional_get
+from locales import normalize_locale
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/products", tags=["products"])
 
-SUPPORTED_LOCALES = {"ru", "en", "de", "uk"}   # + uk
-ALIASES = {"ua": "uk"}                         # принимать ua как алиас
+# сжатие лога изменений (compact_catalog_changes() из schema_patch_changes.sql) —
+# периодическая задача jobs.py, цепочка: каждый запуск ставит следующий; 0 — выкл.
+CATALOG_CHANGES_COMPACT_SEC = float(os.getenv("CATALOG_CHANGES_COMPACT_SEC", "3600"))
+COMPACT_JOB = "catalog.compact_changes"
+
+async def _schedule_compaction():
+    # dedupe: одна ожидающая задача на все процессы, повторная постановка — no-op
+    await jobs.enqueue(None, COMPACT_JOB, delay=CATALOG_CHANGES_COMPACT_SEC, dedupe_key=COMPACT_JOB)
+
+@jobs.job(COMPACT_JOB, max_attempts=3)
+async def _compact_changes(payload: dict, conn: LazyConn):
+    # следующий запуск — отдельной транзакцией и до сжатия: упавшее сжатие не
+    # обрывает цепочку (его повтор уступит уже стоящей задаче, см. jobs._requeue)
+    await _schedule_compaction()
+    async with dict_cursor(conn) as cur:
+        await cur.execute("select compact_catalog_changes() as removed")
+        removed = (await cur.fetchone())["removed"]
+    logger.info("catalog changes: compacted %d superseded entries", removed)
+
+async def startup():
+    # вызывается из lifespan: запускает цепочку сжатия, если её ещё нет в очереди
+    if CATALOG_CHANGES_COMPACT_SEC <= 0:
+        return
+    try:
+        await _schedule_compaction()
+    except psycopg.errors.UndefinedTable:
+        logger.warning("products: schema_patch_jobs.sql is not applied, change log is not compacted")
+    except psycopg.Error:
+        # цепочку поставит следующий старт любого процесса
+        logger.exception("products: failed to schedule change log compaction")
 
-def normalize_locale(locale: str | None) -> str | None:
-    if not locale:
-        return None
-    loc = locale.lower()
-    loc = ALIASES.get(loc, loc)
-    return loc if loc in SUPPORTED_LOCALES else None
+# поиск like '%q%' по всему каталогу — не дольше бюджета, иначе 503, а не занятый пул
+PRODUCTS_LIST_TIMEOUT_MS = int(os.getenv("PRODUCTS_LIST_TIMEOUT_MS", "3000"))
+PRODUCT_GET_TIMEOUT_MS = int(os.getenv("PRODUCT_GET_TIMEOUT_MS", "1000"))
 
+# поля ответа (алиасы ProductOut) → колонки products;
+# локализуемые при наличии локали берутся как coalesce(i_loc, p)
+PRODUCT_COLUMNS = {
+    "id": "p.id::text",
+    "slug": "p.slug",
+    "title": "p.title",
+    "category": "p.category",
+    "sub": "p.sub",
+    "leaf": "p.leaf",
+    "price": "p.price::float",
+    "rating": "p.rating::float",
+    "short": "p.short",
+    "description": "p.description",
+    "imageUrl": "p.image_url",
+}
+LOCALIZED_FIELDS = {"slug", "title", "short", "description"}
 
-@router.get("", response_model=ProductsPage)
+FIELDS_DESCRIPTION = "через запятую, например id,slug,title,price,rating,imageUrl (по умолчанию — все поля)"
+
+def product_select(fields: list[str], loc: str | None) -> str:
+    cols = []
+    for f in fields:
+        expr = f"coalesce(i_loc.{f}, p.{f})" if loc and f in LOCALIZED_FIELDS else PRODUCT_COLUMNS[f]
+        cols.append(f'{expr} as "{f}"')
+    return ", ".join(cols)
+
+
+@router.get("", response_model=ProductsPage, dependencies=[Depends(search_priority), Depends(statement_timeout(PRODUCTS_LIST_TIMEOUT_MS))])
 async def list_products(
+    request: Request,
     q: ProductsQuery = Depends(),
     locale: str | None = Query(None, description="ru|en|de|uk (ua → uk)"),
-    conn: AsyncConnection = Depends(get_conn),
+    fields: str | None = Query(None, description=FIELDS_DESCRIPTION),
+    conn: LazyConn = Depends(get_read_conn),
+    cache: dict = Depends(conditional_get("catalog")),
 ):
     loc = normalize_locale(locale)
+    cols = parse_fields(fields, PRODUCT_COLUMNS)
+
+    # фильтры/сортировки каталога — из mmap-снимка той же версии, без SQL; поиск — всегда в БД
+    snap = None if q.search else catalog_snapshot.fresh(getattr(request.state, "cache_version", None))
+    if snap is not None:
+        hit = snap.query(
+            category=q.category, sub=q.sub, leaf=q.leaf, price_min=q.price_min, price_max=q.price_max,
+            rating_min=q.rating_min, sort=q.sort, limit=q.limit, offset=q.offset,
+        )
+        if hit is not None:
+            total, page = hit
+            return RawJSONResponse({
+                "items": [snap.row(r, cols, loc) for r in page],
+                "page": {"total": total, "limit": q.limit, "offset": q.offset},
+            }, headers=cache)
 
     where: list[str] = []
     params: dict = {"limit": q.limit, "offset": q.offset}
@@ -75,35 +154,21 @@ async def list_products(
 
     where_sql = (" where " + " and ".join(where)) if where else ""
 
-    # джойн только если локаль есть
-    join_loc = ""
+    # джойн только если локаль есть и он реально нужен: поиск по переводу
+    # или локализуемые поля в ответе (для count — только ради поиска;
+    # LEFT JOIN по PK строк не размножает)
+    join_loc = join_loc_count = ""
     if loc:
         params["loc"] = loc
-        join_loc = "LEFT JOIN product_i18n i_loc ON i_loc.product_id = p.id AND i_loc.locale = %(loc)s"
+        join_sql = "LEFT JOIN product_i18n i_loc ON i_loc.product_id = p.id AND i_loc.locale = %(loc)s"
+        if q.search:
+            join_loc = join_loc_count = join_sql
+        elif LOCALIZED_FIELDS.intersection(cols):
+            join_loc = join_sql
 
-    # колонки: если локаль есть — coalesce(i_loc, p), иначе — p.*
-    if loc:
-        sel_slug  = "coalesce(i_loc.slug, p.slug)"
-        sel_title = "coalesce(i_loc.title, p.title)"
-        sel_short = "coalesce(i_loc.short, p.short)"
-        sel_desc  = "coalesce(i_loc.description, p.description)"
-    else:
-        sel_slug  = "p.slug"
-        sel_title = "p.title"
-        sel_short = "p.short"
-        sel_desc  = "p.description"
-
-    sql_count = f"select count(*) as c from products p {join_loc}{where_sql}"
+    sql_count = f"select count(*) as c from products p {join_loc_count}{where_sql}"
     sql_items = f"""
-      select
-        p.id::text,
-        {sel_slug} as slug,
-        {sel_title} as title,
-        p.category, p.sub, p.leaf,
-        p.price::float, p.rating::float,
-        {sel_short} as short,
-        {sel_desc} as description,
-        p.image_url as "imageUrl"
+      select {product_select(cols, loc if join_loc else None)}
       from products p
       {join_loc}
       {where_sql}
@@ -111,39 +176,138 @@ async def list_products(
       limit %(limit)s offset %(offset)s
     """
 
+    if pg_json_enabled("products"):
+        # весь ответ собирает Postgres: ключи json_agg(t) = алиасы sql_items
+        # (форма ProductOut), json_agg по отсортированному подзапросу сохраняет порядок
+        sql_json = f"""
+          select json_build_object(
+            'items', coalesce((select json_agg(t) from ({sql_items}) t), '[]'::json),
+            'page', json_build_object(
+              'total', ({sql_count}),
+              'limit', %(limit)s::int,
+              'offset', %(offset)s::int
+            )
+          )
+        """
+        return RawJSONResponse(await fetch_json(conn, sql_json, params), headers=cache)
+
+    # count и items не зависят друг от друга — один round trip
+    count_rows, rows = await fetch_pipelined(conn, (sql_count, params), (sql_items, params))
+    total = count_rows[0]["c"]
+
+    # строки уже в форме ProductOut (алиасы в SQL) — сразу в JSON, без ревалидации
+    return RawJSONResponse({
+        "items": rows,
+        "page": {"total": total, "limit": q.limit, "offset": q.offset},
+    }, headers=cache)
+
+
+# ----- лента изменений (schema_patch_changes.sql) -----
+# Клиент держит локальную копию каталога и тянет только дельты:
+# since=0 — весь каталог (лог заполнен при установке патча), дальше — next из ответа.
+# По каждому ключу в странице — одна запись с текущим состоянием строки;
+# строки уже нет — op=delete.
+
+def _parse_since(since: str) -> tuple[int, int]:
+    if since in ("", "0"):
+        return 0, 0
+    try:
+        tx, change_id = (int(x) for x in since.split(".", 1))
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+    if tx < 0 or change_id < 0:
+        raise HTTPException(400, "Invalid cursor")
+    return tx, change_id
+
+@router.get("/changes", response_model=CatalogChanges, dependencies=[Depends(statement_timeout(PRODUCTS_LIST_TIMEOUT_MS))])
+async def list_changes(
+    since: str = Query("0", description="курсор из next предыдущего ответа; 0 — с начала"),
+    limit: int = Query(1000, ge=1, le=5000),
+    conn: LazyConn = Depends(get_conn_ro),
+):
+    tx, change_id = _parse_since(since)
+    # без conditional_get: изменение может стать видимым ленте позже, чем
+    # сменилась версия каталога (ждёт горизонта), — 304 по версии его бы спрятал.
+    # Primary, а не реплика: курсор сравнивается со снимком транзакций.
     async with dict_cursor(conn) as cur:
-        await cur.execute(sql_count, params)
-        total = (await cur.fetchone())["c"]
-        await cur.execute(sql_items, params)
+        await cur.execute(f"""
+          with page as (
+            select id, tx, entity, product_id, locale
+            from catalog_changes
+            where (tx, id) > (%(tx)s, %(id)s)
+              and tx < pg_snapshot_xmin(pg_current_snapshot())::text::bigint
+            order by tx, id
+            limit %(n)s
+          ), latest as (
+            select distinct on (entity, product_id, locale) id, tx, entity, product_id, locale
+            from page
+            order by entity, product_id, locale, tx desc, id desc
+          )
+          select l.entity, l.product_id::text as product_id, l.locale,
+                 case when l.entity = 'product' then (
+                   select row_to_json(x) from (
+                     select {product_select(list(PRODUCT_COLUMNS), None)} from products p where p.id = l.product_id
+                   ) x
+                 ) end as product,
+                 case when l.entity = 'product_i18n' then (
+                   select row_to_json(x) from (
+                     select i.locale, i.slug, i.title, i.short, i.description
+                     from product_i18n i where i.product_id = l.product_id and i.locale = l.locale
+                   ) x
+                 ) end as translation,
+                 (select count(*) from page) as page_n,
+                 (select tx || '.' || id from page order by tx desc, id desc limit 1) as last
+          from latest l
+          order by l.tx, l.id
+        """, {"tx": tx, "id": change_id, "n": limit})
         rows = await cur.fetchall()
 
-    return ProductsPage(
-        items=[ProductOut.model_validate(r) for r in rows],
-        page=PageOut(total=total, limit=q.limit, offset=q.offset),
-    )
+    changes = []
+    for r in rows:
+        item = {"entity": r["entity"], "op": "upsert", "product_id": r["product_id"]}
+        if r["entity"] == "product":
+            item["product"] = r["product"]
+            live = r["product"] is not None
+        else:
+            item["locale"] = r["locale"]
+            item["translation"] = r["translation"]
+            live = r["translation"] is not None
+        if not live:
+            item["op"] = "delete"
+        changes.append(item)
+    return RawJSONResponse({
+        "changes": changes,
+        "next": rows[0]["last"] if rows else f"{tx}.{change_id}",
+        "has_more": bool(rows) and rows[0]["page_n"] >= limit,
+    })
 
 
-@router.get("/{slug}", response_model=ProductOut | None)
+@router.get("/{slug}", response_model=ProductOut | None, dependencies=[Depends(statement_timeout(PRODUCT_GET_TIMEOUT_MS))])
 async def get_product(
+    request: Request,
     slug: str,
     locale: str | None = Query(None, description="ru|en|de|uk (ua → uk) — поиски по локализованному slug"),
-    conn: AsyncConnection = Depends(get_conn),
+    fields: str | None = Query(None, description=FIELDS_DESCRIPTION),
+    conn: LazyConn = Depends(get_read_conn),
+    cache: dict = Depends(conditional_get("catalog")),
 ):
     loc = normalize_locale(locale)
+    cols = parse_fields(fields, PRODUCT_COLUMNS)
+
+    snap = catalog_snapshot.fresh(getattr(request.state, "cache_version", None))
+    if snap is not None:
+        # тот же порядок, что и в SQL ниже: локализованный slug, затем базовый
+        row = snap.find_slug(slug, loc) if loc else None
+        if row is not None:
+            return RawJSONResponse(snap.row(row, cols, loc), headers=cache)
+        row = snap.find_slug(slug)
+        return RawJSONResponse(snap.row(row, cols, None) if row is not None else None, headers=cache)
 
     async with dict_cursor(conn) as cur:
         if loc:
             # поиск по локализованному slug
             await cur.execute(f"""
-              select
-                p.id::text,
-                coalesce(i_loc.slug, p.slug) as slug,
-                coalesce(i_loc.title, p.title) as title,
-                p.category, p.sub, p.leaf,
-                p.price::float, p.rating::float,
-                coalesce(i_loc.short, p.short) as short,
-                coalesce(i_loc.description, p.description) as description,
-                p.image_url as "imageUrl"
+              select {product_select(cols, loc)}
               from products p
               join product_i18n i_loc on i_loc.product_id = p.id and i_loc.locale = %(loc)s
               where i_loc.slug = %(slug)s
@@ -151,16 +315,14 @@ async def get_product(
             """, {"slug": slug, "loc": loc})
             row = await cur.fetchone()
             if row:
-                return ProductOut.model_validate(row)
+                return RawJSONResponse(row, headers=cache)
 
         # фолбэк — базовый slug
-        await cur.execute("""
-          select
-            id::text, slug, title, category, sub, leaf, price::float, rating::float,
-            short, description, image_url as "imageUrl"
-          from products
-          where slug = %(slug)s
+        await cur.execute(f"""
+          select {product_select(cols, None)}
+          from products p
+          where p.slug = %(slug)s
           limit 1
         """, {"slug": slug})
         row = await cur.fetchone()
-        return ProductOut.model_validate(row) if row else None
+    return RawJSONResponse(row, headers=cache)
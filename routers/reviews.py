@@ -1,27 +1,104 @@
 # routers/reviews.py
-import uuid, datetime as dt
-from fastapi import APIRouter, Depends, HTTPException
-from psycopg import AsyncConnection
-from db import get_conn, dict_cursor
-from models import ReviewOut, ReviewCreate
+import base64, binascii, uuid, datetime as dt
+from fastapi import APIRouter, Depends, HTTPException, Query
+from admission import BROWSE, priority
+import votes
+from db import get_conn, get_read_conn, dict_cursor, fetch_json_row, pg_json_enabled, LazyConn
+from models import ReviewOut, ReviewCreate, ReviewSummary
+from responses import RawJSONResponse
+from caching import conditional_get, reviews_key
 
 router = APIRouter(prefix="/reviews", tags=["reviews"])
 
+# курсор — (created_at, id) последнего отзыва страницы, непрозрачной строкой
+def _encode_cursor(created_at: str, review_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{created_at}|{review_id}".encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, review_id = raw.rsplit("|", 1)
+        dt.datetime.fromisoformat(created_at)
+        return created_at, str(uuid.UUID(review_id))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(400, "Invalid cursor")
+
 @router.get("", response_model=list[ReviewOut])
-async def list_reviews(product_id: str, conn: AsyncConnection = Depends(get_conn)):
+async def list_reviews(
+    product_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = Query(None, description="X-Next-Cursor из ответа на предыдущую страницу"),
+    conn: LazyConn = Depends(get_read_conn),
+    cache: dict = Depends(conditional_get("reviews", reviews_key)),
+):
+    # keyset-пагинация по индексу (product_id, created_at desc, id desc):
+    # страница — всегда один index range scan, без offset. Берём limit + 1,
+    # лишняя строка лишь говорит, что следующая страница есть.
+    # helpful — только из БД: ответ кэшируется по ETag версии reviews:<pid>, а она
+    # меняется лишь на flush буфера голосов. Свой голос клиент видит в ответе POST /vote.
+    params = {"pid": product_id, "n": limit}
+    after = ""
+    if cursor:
+        params["ts"], params["rid"] = _decode_cursor(cursor)
+        after = "and (r.created_at, r.id) < (%(ts)s::timestamptz, %(rid)s::uuid)"
+    sql = f"""
+      select r.id::text, r.product_id::text, r.author, r.rating, r.text, r.created_at::timestamptz::text,
+             r.helpful
+      from reviews r
+      where r.product_id = %(pid)s {after}
+      order by r.created_at desc, r.id desc
+      limit %(n)s + 1
+    """
+    headers = dict(cache)
+    if pg_json_enabled("reviews"):
+        # массив собирает Postgres, ключи = алиасы выше (форма ReviewOut)
+        sql_json = f"""
+          with page as (select t.*, row_number() over () as rn from ({sql}) t)
+          select
+            coalesce((select json_agg(p) from (
+              select id, product_id, author, rating, text, created_at, helpful
+              from page where rn <= %(n)s order by rn
+            ) p), '[]'::json),
+            (select created_at || '|' || id from page
+             where rn = %(n)s and exists (select 1 from page where rn > %(n)s))
+        """
+        body, next_key = await fetch_json_row(conn, sql_json, params)
+        if next_key:
+            headers["X-Next-Cursor"] = _encode_cursor(*next_key.rsplit("|", 1))
+        return RawJSONResponse(body, headers=headers)
+
+    async with dict_cursor(conn) as cur:
+        await cur.execute(sql, params)
+        rows = await cur.fetchall()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = _encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    return RawJSONResponse([ReviewOut.model_validate(r).model_dump() for r in rows], headers=headers)
+
+@router.get("/summary", response_model=ReviewSummary)
+async def review_summary(
+    product_id: str,
+    conn: LazyConn = Depends(get_read_conn),
+    cache: dict = Depends(conditional_get("reviews", reviews_key)),
+):
+    # review_stats ведёт триггер (schema_patch_reviews.sql) — одна строка по PK
     async with dict_cursor(conn) as cur:
         await cur.execute("""
-          select id::text, product_id::text, author, rating, text, created_at::timestamptz::text, helpful
-          from reviews
-          where product_id = %s
-          order by created_at desc
-          limit 200
+          select reviews_count, rating_sum, stars_1, stars_2, stars_3, stars_4, stars_5
+          from review_stats where product_id = %s
         """, (product_id,))
-        rows = await cur.fetchall()
-    return [ReviewOut.model_validate(r) for r in rows]
+        row = await cur.fetchone()
+    row = row or dict.fromkeys(("reviews_count", "rating_sum", "stars_1", "stars_2", "stars_3", "stars_4", "stars_5"), 0)
+    count = row["reviews_count"]
+    return RawJSONResponse({
+        "product_id": product_id,
+        "count": count,
+        "average": round(row["rating_sum"] / count, 2) if count else None,
+        "histogram": {str(k): row[f"stars_{k}"] for k in range(1, 6)},
+    }, headers=cache)
 
-@router.post("", response_model=ReviewOut)
-async def add_review(body: ReviewCreate, conn: AsyncConnection = Depends(get_conn)):
+@router.post("", response_model=ReviewOut, dependencies=[Depends(priority(BROWSE))])
+async def add_review(body: ReviewCreate, conn: LazyConn = Depends(get_conn)):
     rid = str(uuid.uuid4())
     now = dt.datetime.utcnow().isoformat()
     async with dict_cursor(conn) as cur:
@@ -33,10 +110,18 @@ async def add_review(body: ReviewCreate, conn: AsyncConnection = Depends(get_con
         row = await cur.fetchone()
     return ReviewOut.model_validate(row)
 
-@router.post("/{review_id}/vote")
-async def vote_helpful(review_id: str, conn: AsyncConnection = Depends(get_conn)):
+@router.post("/{review_id}/vote", dependencies=[Depends(priority(BROWSE))])
+async def vote_helpful(review_id: str, conn: LazyConn = Depends(get_conn)):
+    # сама запись — в votes.buffer, батчем; здесь только чтение по PK без блокировок.
+    # В ответе — с голосами, ещё не дошедшими до БД: список отзывов покажет их после flush
+    try:
+        review_id = str(uuid.UUID(review_id))
+    except ValueError:
+        raise HTTPException(404, "Review not found")
     async with dict_cursor(conn) as cur:
-        await cur.execute("update reviews set helpful = helpful + 1 where id = %s", (review_id,))
-        if cur.rowcount == 0:
-            raise HTTPException(404, "Review not found")
-    return {"ok": True}
+        await cur.execute("select helpful from reviews where id = %s", (review_id,))
+        row = await cur.fetchone()
+    if row is None:
+        raise HTTPException(404, "Review not found")
+    votes.buffer.add(review_id)
+    return {"ok": True, "helpful": row["helpful"] + votes.buffer.pending(review_id)}
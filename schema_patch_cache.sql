@@ -0,0 +1,55 @@
+-- schema_patch_cache.sql
+-- Дешёвые версии ресурсов для HTTP-кэша (ETag/Last-Modified):
+-- счётчик на ключ, который поднимают триггеры при любом изменении.
+--   catalog            — products, product_i18n
+--   categories         — categories
+--   reviews:<product>  — reviews конкретного товара
+SET search_path TO mira, public;
+
+CREATE TABLE IF NOT EXISTS cache_versions (
+  key        text PRIMARY KEY,
+  version    bigint NOT NULL DEFAULT 0,
+  updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION bump_cache_version(k text) RETURNS void
+LANGUAGE sql SET search_path = mira, public AS $$
+  INSERT INTO cache_versions (key, version, updated_at) VALUES (k, 1, now())
+  ON CONFLICT (key) DO UPDATE
+    SET version = cache_versions.version + 1, updated_at = now();
+$$;
+
+-- statement-level: массовый апдейт/импорт = один bump
+CREATE OR REPLACE FUNCTION trg_bump_cache_version() RETURNS trigger
+LANGUAGE plpgsql SET search_path = mira, public AS $$
+BEGIN
+  PERFORM bump_cache_version(TG_ARGV[0]);
+  RETURN NULL;
+END$$;
+
+CREATE OR REPLACE FUNCTION trg_bump_reviews_version() RETURNS trigger
+LANGUAGE plpgsql SET search_path = mira, public AS $$
+BEGIN
+  PERFORM bump_cache_version('reviews:' || coalesce(NEW.product_id, OLD.product_id)::text);
+  RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS products_cache_version ON products;
+CREATE TRIGGER products_cache_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON products
+  FOR EACH STATEMENT EXECUTE FUNCTION trg_bump_cache_version('catalog');
+
+DROP TRIGGER IF EXISTS product_i18n_cache_version ON product_i18n;
+CREATE TRIGGER product_i18n_cache_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON product_i18n
+  FOR EACH STATEMENT EXECUTE FUNCTION trg_bump_cache_version('catalog');
+
+DROP TRIGGER IF EXISTS categories_cache_version ON categories;
+CREATE TRIGGER categories_cache_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON categories
+  FOR EACH STATEMENT EXECUTE FUNCTION trg_bump_cache_version('categories');
+
+DROP TRIGGER IF EXISTS reviews_cache_version ON reviews;
+CREATE TRIGGER reviews_cache_version
+  AFTER INSERT OR UPDATE OR DELETE ON reviews
+  FOR EACH ROW EXECUTE FUNCTION trg_bump_reviews_version();
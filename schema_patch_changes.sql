@@ -0,0 +1,97 @@
+-- schema_patch_changes.sql
+-- Лента изменений каталога для /products/changes: каждая вставка/правка/
+-- удаление в products и product_i18n пишет строку в catalog_changes.
+--
+-- Курсор — (tx, id). Голый bigserial не годится: номер выдаётся до commit,
+-- и транзакция с меньшим id может закоммититься позже той, что клиент уже
+-- прочитал, — изменение было бы пропущено. Поэтому отдаём только строки
+-- транзакций ниже pg_snapshot_xmin(pg_current_snapshot()): все они уже
+-- завершены, и новых строк с таким tx не появится. Цена — лента отстаёт
+-- на время самой долгой открытой транзакции.
+SET search_path TO mira, public;
+
+CREATE TABLE IF NOT EXISTS catalog_changes (
+  id         bigserial PRIMARY KEY,
+  -- xid8 как bigint: row-сравнение (tx, id) и btree-индекс без opclass для xid8
+  tx         bigint NOT NULL DEFAULT pg_current_xact_id()::text::bigint,
+  entity     text NOT NULL CHECK (entity IN ('product', 'product_i18n')),
+  product_id uuid NOT NULL,
+  locale     text,
+  changed_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_catalog_changes_cursor ON catalog_changes (tx, id);
+-- для сжатия: последняя запись по каждому ключу
+CREATE INDEX IF NOT EXISTS idx_catalog_changes_key ON catalog_changes (entity, product_id, locale, tx DESC, id DESC);
+
+CREATE OR REPLACE FUNCTION trg_log_product_change() RETURNS trigger
+LANGUAGE plpgsql SET search_path = mira, public AS $$
+BEGIN
+  INSERT INTO catalog_changes (entity, product_id) VALUES ('product', coalesce(NEW.id, OLD.id));
+  -- id товара сменился — старый для клиента исчез
+  IF TG_OP = 'UPDATE' AND NEW.id <> OLD.id THEN
+    INSERT INTO catalog_changes (entity, product_id) VALUES ('product', OLD.id);
+  END IF;
+  RETURN NULL;
+END$$;
+
+CREATE OR REPLACE FUNCTION trg_log_i18n_change() RETURNS trigger
+LANGUAGE plpgsql SET search_path = mira, public AS $$
+BEGIN
+  INSERT INTO catalog_changes (entity, product_id, locale)
+  VALUES ('product_i18n', coalesce(NEW.product_id, OLD.product_id), coalesce(NEW.locale, OLD.locale));
+  IF TG_OP = 'UPDATE' AND (NEW.product_id, NEW.locale) IS DISTINCT FROM (OLD.product_id, OLD.locale) THEN
+    INSERT INTO catalog_changes (entity, product_id, locale) VALUES ('product_i18n', OLD.product_id, OLD.locale);
+  END IF;
+  RETURN NULL;
+END$$;
+
+-- UPDATE без фактических изменений строку в лог не пишет
+DROP TRIGGER IF EXISTS products_change_log ON products;
+CREATE TRIGGER products_change_log
+  AFTER INSERT OR DELETE ON products
+  FOR EACH ROW EXECUTE FUNCTION trg_log_product_change();
+
+DROP TRIGGER IF EXISTS products_change_log_update ON products;
+CREATE TRIGGER products_change_log_update
+  AFTER UPDATE ON products
+  FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION trg_log_product_change();
+
+DROP TRIGGER IF EXISTS product_i18n_change_log ON product_i18n;
+CREATE TRIGGER product_i18n_change_log
+  AFTER INSERT OR DELETE ON product_i18n
+  FOR EACH ROW EXECUTE FUNCTION trg_log_i18n_change();
+
+DROP TRIGGER IF EXISTS product_i18n_change_log_update ON product_i18n;
+CREATE TRIGGER product_i18n_change_log_update
+  AFTER UPDATE ON product_i18n
+  FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION trg_log_i18n_change();
+
+-- сжатие: по каждому ключу нужна только последняя запись — клиент всё равно
+-- получает текущее состояние. Курсоры клиентов не ломаются: удаляется запись,
+-- только если после неё по тому же ключу есть более поздняя. Вызывает задача
+-- catalog.compact_changes (routers/products.py) раз в CATALOG_CHANGES_COMPACT_SEC.
+CREATE OR REPLACE FUNCTION compact_catalog_changes() RETURNS bigint
+LANGUAGE sql SET search_path = mira, public AS $$
+  WITH gone AS (
+    DELETE FROM catalog_changes c
+    USING catalog_changes n
+    WHERE n.entity = c.entity AND n.product_id = c.product_id
+      AND n.locale IS NOT DISTINCT FROM c.locale
+      AND (n.tx, n.id) > (c.tx, c.id)
+    RETURNING 1
+  )
+  SELECT count(*) FROM gone;
+$$;
+
+-- первичное заполнение: с since=0 клиент получает весь каталог
+INSERT INTO catalog_changes (entity, product_id)
+SELECT 'product', p.id FROM products p
+WHERE NOT EXISTS (SELECT 1 FROM catalog_changes c WHERE c.entity = 'product' AND c.product_id = p.id);
+
+INSERT INTO catalog_changes (entity, product_id, locale)
+SELECT 'product_i18n', i.product_id, i.locale FROM product_i18n i
+WHERE NOT EXISTS (
+  SELECT 1 FROM catalog_changes c
+  WHERE c.entity = 'product_i18n' AND c.product_id = i.product_id AND c.locale = i.locale
+);
@@ -0,0 +1,43 @@
+-- schema_patch_jobs.sql
+-- Очередь фоновых задач (jobs.py): хэндлеры только ставят задачу,
+-- воркеры в процессах API разбирают её через FOR UPDATE SKIP LOCKED.
+--   queued  — ждёт run_at (новая или отложенная повторная попытка)
+--   running — взята воркером; если не закончена за lease — снова доступна
+--   failed  — попытки исчерпаны, остаётся для разбора (/admin/jobs)
+-- Успешно выполненные задачи удаляются.
+SET search_path TO mira, public;
+
+CREATE TABLE IF NOT EXISTS jobs (
+  id           bigserial PRIMARY KEY,
+  kind         text NOT NULL,
+  payload      jsonb NOT NULL DEFAULT '{}'::jsonb,
+  status       text NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'failed')),
+  attempts     integer NOT NULL DEFAULT 0,
+  max_attempts integer NOT NULL DEFAULT 5,
+  run_at       timestamptz NOT NULL DEFAULT now(),
+  created_at   timestamptz NOT NULL DEFAULT now(),
+  started_at   timestamptz,
+  finished_at  timestamptz,
+  locked_by    text,
+  last_error   text,
+  dedupe_key   text
+);
+
+-- выборка готовых к запуску и просроченных running
+CREATE INDEX IF NOT EXISTS idx_jobs_queued  ON jobs (run_at, id) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS idx_jobs_running ON jobs (started_at) WHERE status = 'running';
+-- одна ожидающая задача на ключ: повторный enqueue — no-op
+CREATE UNIQUE INDEX IF NOT EXISTS uq_jobs_dedupe ON jobs (dedupe_key) WHERE status = 'queued';
+
+-- будим воркеров на commit вставки; statement-level: пачка задач = одно уведомление
+CREATE OR REPLACE FUNCTION trg_jobs_notify() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  PERFORM pg_notify('mira_jobs', '');
+  RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS jobs_notify ON jobs;
+CREATE TRIGGER jobs_notify
+  AFTER INSERT ON jobs
+  FOR EACH STATEMENT EXECUTE FUNCTION trg_jobs_notify();
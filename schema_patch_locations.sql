@@ -0,0 +1,29 @@
+-- schema_patch_locations.sql
+-- Локальная копия точек DHL (Packstation/Postfiliale/...) и центроиды PLZ —
+-- для ответа /locations без похода в DHL. Заполняется через dhl_index.py.
+SET search_path TO mira, public;
+
+CREATE TABLE IF NOT EXISTS dhl_locations (
+  id            text PRIMARY KEY,
+  types         text[] NOT NULL DEFAULT '{}',
+  name          text,
+  type          text,
+  street        text NOT NULL DEFAULT '',
+  house         text NOT NULL DEFAULT '',
+  zip           text NOT NULL DEFAULT '',
+  city          text NOT NULL DEFAULT '',
+  opening_hours jsonb NOT NULL DEFAULT '[]'::jsonb,
+  lat           double precision NOT NULL,
+  lng           double precision NOT NULL,
+  updated_at    timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_dhl_locations_zip ON dhl_locations(zip);
+
+-- центроиды немецких почтовых индексов: zip → координаты
+CREATE TABLE IF NOT EXISTS postal_centroids (
+  zip  text PRIMARY KEY,
+  city text,
+  lat  double precision NOT NULL,
+  lng  double precision NOT NULL
+);
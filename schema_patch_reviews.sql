@@ -0,0 +1,98 @@
+-- schema_patch_reviews.sql
+-- Сводка отзывов по товару (число, сумма, гистограмма 1–5), которую триггер
+-- обновляет в той же транзакции, что и сам отзыв: /reviews/summary — один
+-- запрос по PK, без чтения всех отзывов. Из сводки же держится products.rating
+-- (на нём сортировка popular).
+SET search_path TO mira, public;
+
+CREATE TABLE IF NOT EXISTS review_stats (
+  product_id    uuid PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+  reviews_count integer NOT NULL DEFAULT 0,
+  rating_sum    bigint  NOT NULL DEFAULT 0,
+  stars_1       integer NOT NULL DEFAULT 0,
+  stars_2       integer NOT NULL DEFAULT 0,
+  stars_3       integer NOT NULL DEFAULT 0,
+  stars_4       integer NOT NULL DEFAULT 0,
+  stars_5       integer NOT NULL DEFAULT 0,
+  updated_at    timestamptz NOT NULL DEFAULT now()
+);
+
+-- keyset-пагинация /reviews: (created_at, id) < курсор
+CREATE INDEX IF NOT EXISTS idx_reviews_product_created
+  ON reviews (product_id, created_at DESC, id DESC);
+
+-- products.rating = среднее, округлённое до 0.1; пишем только если значение
+-- изменилось, иначе каждый отзыв поднимал бы версию всего каталога
+CREATE OR REPLACE FUNCTION sync_product_rating(pid uuid, cnt integer, total bigint) RETURNS void
+LANGUAGE plpgsql SET search_path = mira, public AS $$
+DECLARE
+  r numeric := CASE WHEN cnt > 0 THEN round(total::numeric / cnt, 1) END;
+BEGIN
+  IF EXISTS (SELECT 1 FROM products WHERE id = pid AND rating IS DISTINCT FROM r) THEN
+    UPDATE products SET rating = r WHERE id = pid;
+  END IF;
+END$$;
+
+-- d = +1 (отзыв добавлен) / -1 (удалён)
+CREATE OR REPLACE FUNCTION review_stats_apply(pid uuid, stars integer, d integer) RETURNS void
+LANGUAGE plpgsql SET search_path = mira, public AS $$
+DECLARE
+  cnt integer;
+  total bigint;
+BEGIN
+  INSERT INTO review_stats AS s (product_id, reviews_count, rating_sum, stars_1, stars_2, stars_3, stars_4, stars_5)
+  VALUES (pid, d, d * stars,
+          CASE WHEN stars = 1 THEN d ELSE 0 END, CASE WHEN stars = 2 THEN d ELSE 0 END,
+          CASE WHEN stars = 3 THEN d ELSE 0 END, CASE WHEN stars = 4 THEN d ELSE 0 END,
+          CASE WHEN stars = 5 THEN d ELSE 0 END)
+  ON CONFLICT (product_id) DO UPDATE SET
+    reviews_count = s.reviews_count + EXCLUDED.reviews_count,
+    rating_sum    = s.rating_sum    + EXCLUDED.rating_sum,
+    stars_1       = s.stars_1       + EXCLUDED.stars_1,
+    stars_2       = s.stars_2       + EXCLUDED.stars_2,
+    stars_3       = s.stars_3       + EXCLUDED.stars_3,
+    stars_4       = s.stars_4       + EXCLUDED.stars_4,
+    stars_5       = s.stars_5       + EXCLUDED.stars_5,
+    updated_at    = now()
+  RETURNING reviews_count, rating_sum INTO cnt, total;
+  PERFORM sync_product_rating(pid, cnt, total);
+END$$;
+
+CREATE OR REPLACE FUNCTION trg_review_stats() RETURNS trigger
+LANGUAGE plpgsql SET search_path = mira, public AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM review_stats_apply(OLD.product_id, OLD.rating, -1);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM review_stats_apply(NEW.product_id, NEW.rating, 1);
+  END IF;
+  RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS reviews_stats ON reviews;
+CREATE TRIGGER reviews_stats
+  AFTER INSERT OR DELETE OR UPDATE OF product_id, rating ON reviews
+  FOR EACH ROW EXECUTE FUNCTION trg_review_stats();
+
+-- пересчёт с нуля: первичное заполнение и после массовой загрузки
+-- с выключенными триггерами (bench/seed.py)
+CREATE OR REPLACE FUNCTION rebuild_review_stats() RETURNS void
+LANGUAGE sql SET search_path = mira, public AS $$
+  DELETE FROM review_stats;
+  INSERT INTO review_stats (product_id, reviews_count, rating_sum, stars_1, stars_2, stars_3, stars_4, stars_5)
+  SELECT product_id, count(*), sum(rating),
+         count(*) FILTER (WHERE rating = 1), count(*) FILTER (WHERE rating = 2),
+         count(*) FILTER (WHERE rating = 3), count(*) FILTER (WHERE rating = 4),
+         count(*) FILTER (WHERE rating = 5)
+  FROM reviews
+  GROUP BY product_id;
+  UPDATE products p SET rating = round(s.rating_sum::numeric / s.reviews_count, 1)
+  FROM review_stats s
+  WHERE s.product_id = p.id AND p.rating IS DISTINCT FROM round(s.rating_sum::numeric / s.reviews_count, 1);
+$$;
+
+BEGIN;
+LOCK TABLE reviews IN SHARE MODE;
+SELECT rebuild_review_stats();
+COMMIT;
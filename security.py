@@ -7,16 +7,18 @@ from typing import Optional
 
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from psycopg import AsyncConnection
 from psycopg.rows import dict_row
 
-from db import get_conn
+from db import get_conn, LazyConn
 from models import UserPublic
 
 JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret-change-me")
 JWT_ALG = os.getenv("JWT_ALG", "HS256")
 ACCESS_TOKEN_EXPIRES_MIN = int(os.getenv("ACCESS_TOKEN_EXPIRES_MIN", "60"))
 
+# админские эндпоинты (/admin/...): e-mail'ы через запятую
+ADMIN_EMAILS = {e.strip().lower() for e in (os.getenv("ADMIN_EMAILS") or "").split(",") if e.strip()}
+
 bearer_scheme = HTTPBearer(auto_error=False)
 
 
@@ -51,7 +53,7 @@ def decode_token(token: str) -> dict:
         raise HTTPException(401, "Invalid token")
 
 
-async def _load_user_by_email(conn: AsyncConnection, email: str) -> Optional[UserPublic]:
+async def _load_user_by_email(conn: LazyConn, email: str) -> Optional[UserPublic]:
     async with conn.cursor(row_factory=dict_row) as cur:
         await cur.execute("select id::text, email, name from users where lower(email)=lower(%s)", (email,))
         row = await cur.fetchone()
@@ -60,7 +62,7 @@ async def _load_user_by_email(conn: AsyncConnection, email: str) -> Optional[Use
 
 async def get_current_user(
     creds: HTTPAuthorizationCredentials | None = Depends(bearer_scheme),
-    conn: AsyncConnection = Depends(get_conn),
+    conn: LazyConn = Depends(get_conn),
 ) -> UserPublic:
     if not creds:
         raise HTTPException(401, "Authorization required")
@@ -76,7 +78,7 @@ async def get_current_user(
 
 async def get_optional_user(
     creds: HTTPAuthorizationCredentials | None = Depends(bearer_scheme),
-    conn: AsyncConnection = Depends(get_conn),
+    conn: LazyConn = Depends(get_conn),
 ) -> Optional[UserPublic]:
     if not creds:
         return None
@@ -89,3 +91,9 @@ async def get_optional_user(
         return user
     except HTTPException:
         return None
+
+
+async def require_admin(user: UserPublic = Depends(get_current_user)) -> UserPublic:
+    if user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(403, "Admin only")
+    return user
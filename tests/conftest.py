@@ -0,0 +1,8 @@
+# tests/conftest.py
+# Юнит-тесты без Postgres: db.py создаёт пул при импорте, но не открывает его,
+# так что DSN-заглушки достаточно. Запуск: python -m pytest -q из корня репо.
+import os
+import sys
+
+os.environ.setdefault("DATABASE_URL", "postgresql://test/test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,36 @@
+from starlette.requests import Request
+
+from caching import _etag, _etag_matches, _not_modified_since
+
+
+def _request(path: str, query: str = "") -> Request:
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": query.encode(),
+                    "headers": [], "server": ("test", 80), "scheme": "http"})
+
+
+def test_etag_depends_on_version_and_query():
+    base = _etag("catalog", 1, _request("/products", "category=a"))
+    assert base.startswith('W/"') and base.endswith('"')
+    assert base == _etag("catalog", 1, _request("/products", "category=a"))
+    assert base != _etag("catalog", 2, _request("/products", "category=a"))
+    assert base != _etag("catalog", 1, _request("/products", "category=b"))
+    assert base != _etag("reviews:x", 1, _request("/products", "category=a"))
+
+
+def test_etag_matches_weak_list_and_star():
+    etag = 'W/"abc"'
+    assert _etag_matches(etag, 'W/"abc"')
+    assert _etag_matches(etag, '"abc"')                    # weak-сравнение
+    assert _etag_matches(etag, '"x", W/"abc" ,"y"')
+    assert _etag_matches(etag, " * ")
+    assert not _etag_matches(etag, '"abcd"')
+    assert not _etag_matches(etag, "abc")                  # без кавычек — другой тег
+
+
+def test_not_modified_since():
+    from datetime import datetime, timezone
+    updated = datetime(2024, 5, 1, 12, 0, 0, 500000, tzinfo=timezone.utc)
+    assert _not_modified_since(updated, "Wed, 01 May 2024 12:00:00 GMT")   # доли секунды не считаются
+    assert not _not_modified_since(updated, "Wed, 01 May 2024 11:59:59 GMT")
+    assert not _not_modified_since(updated, "garbage")
+    assert not _not_modified_since(None, "Wed, 01 May 2024 12:00:00 GMT")
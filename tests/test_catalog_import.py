@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from catalog_import import RowError, i18n_row, product_row, records
+
+
+def _parse(data: bytes, fmt: str, chunk: int = 7) -> list:
+    async def chunks():
+        for i in range(0, len(data), chunk):
+            yield data[i:i + chunk]
+
+    async def collect():
+        return [x async for x in records(chunks(), fmt)]
+
+    return asyncio.run(collect())
+
+
+def _errors(out: list) -> list:
+    return [(line, str(rec)) for line, rec in out if isinstance(rec, RowError)]
+
+
+# ----- разбор потока -----
+
+def test_ndjson_lines_blank_and_bad_json():
+    data = b'{"slug": "a"}\n\n{bad\n{"slug": "b"}'
+    out = _parse(data, "ndjson")
+    assert [(n, r) for n, r in out if not isinstance(r, RowError)] == [(1, {"slug": "a"}), (4, {"slug": "b"})]
+    assert [n for n, _ in _errors(out)] == [3]
+
+
+@pytest.mark.parametrize("chunk", [1, 5, 1000])
+def test_csv_quoted_newlines_bom_and_empty_values(chunk):
+    data = ('﻿slug,title,price\r\n'
+            'a,"Line 1\nLine 2",10\r\n'
+            'b,,"1,5"\r\n'
+            '\r\n'
+            'c,"say ""hi""",3\n').encode()
+    out = _parse(data, "csv", chunk)
+    assert out == [
+        (2, {"slug": "a", "title": "Line 1\nLine 2", "price": "10"}),
+        (4, {"slug": "b", "title": None, "price": "1,5"}),
+        (6, {"slug": "c", "title": 'say "hi"', "price": "3"}),
+    ]
+
+
+def test_csv_column_count_and_unterminated_quote():
+    out = _parse(b'slug,price\na,1,extra\nb,"2\n', "csv")
+    assert _errors(out) == [(2, "expected 2 columns, got 3"), (3, "unterminated quoted field")]
+
+
+def test_csv_utf8_split_across_chunks():
+    data = "slug,title\nx,Привет\n".encode()
+    assert _parse(data, "csv", 1) == [(2, {"slug": "x", "title": "Привет"})]
+
+
+# ----- строки товаров -----
+
+BASE = {"slug": " tee ", "title": "Tee", "category": "men"}
+
+
+@pytest.mark.parametrize("raw, price", [(10, 10.0), ("19.90", 19.9), ("0", 0.0), (" 5 ", 5.0)])
+def test_product_price_normalized(raw, price):
+    row = product_row({**BASE, "price": raw})
+    assert row[6] == price and isinstance(row[6], float)
+    assert row[1] == "tee"   # slug обрезается
+
+
+@pytest.mark.parametrize("raw", [None, "", "abc", "nan", "inf", "-inf", "-1", [1]])
+def test_product_bad_price(raw):
+    with pytest.raises(RowError):
+        product_row({**BASE, "price": raw})
+
+
+def test_product_fields():
+    pid = "0F8FAD5B-D9CB-469F-A165-70867728950E"
+    row = product_row({**BASE, "price": 1, "id": pid, "imageUrl": "x.png", "sub": "  "})
+    assert row[0] == pid.lower()
+    assert row[4] is None            # пустая строка — NULL
+    assert row[9] == "x.png"         # imageUrl — алиас image_url
+    with pytest.raises(RowError, match="id is not a uuid"):
+        product_row({**BASE, "price": 1, "id": "42"})
+    with pytest.raises(RowError, match="title is required"):
+        product_row({**BASE, "price": 1, "title": None})
+    with pytest.raises(RowError, match="must be a string"):
+        product_row({**BASE, "price": 1, "short": {"a": 1}})
+
+
+def test_i18n_row_locales():
+    rec = {"product_slug": "tee", "title": "Футболка", "slug": "futbolka"}
+    assert i18n_row({**rec, "locale": "UA"})[2] == "uk"
+    assert i18n_row({**rec, "locale": "de"})[:3] == (None, "tee", "de")
+    with pytest.raises(RowError, match="unsupported locale"):
+        i18n_row({**rec, "locale": "xx"})
+    with pytest.raises(RowError, match="product_id or product_slug"):
+        i18n_row({"locale": "de", "title": "T", "slug": "t"})
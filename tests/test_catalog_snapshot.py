@@ -0,0 +1,115 @@
+# Снимок против эталона с порядком SQL-ветки list_products:
+# popular — rating desc nulls last, price asc, id; по цене — цена, затем popular.
+import random
+import uuid
+
+import pytest
+
+import catalog_snapshot
+from catalog_snapshot import Snapshot, _write
+from locales import LOCALES
+
+CATS = {"a": ["a1", "a2"], "b": ["b1"], "c": ["c1", "c2", "c3"]}
+
+
+def _popular_key(p):
+    return (p[7] is None, -(p[7] or 0), p[6], p[0])
+
+
+def _catalog(n: int, rnd: random.Random):
+    products = []
+    for i in range(n):
+        cat = rnd.choice(list(CATS))
+        sub = rnd.choice(CATS[cat] + [None])
+        leaf = rnd.choice([f"{sub}-x", f"{sub}-y", None]) if sub else None
+        price = float(rnd.choice([5, 10, 10, 19.99, 20, 50, 100]))  # много равных цен
+        rating = rnd.choice([None, 3.0, 4.0, 4.5, 5.0])
+        products.append((str(uuid.UUID(int=rnd.getrandbits(128))), f"slug-{i:04d}", f"Title {i}",
+                         cat, sub, leaf, price, rating, None, None, None))
+    products.sort(key=_popular_key)
+    i18n = {loc: {} for loc in LOCALES}
+    for p in products:
+        if rnd.random() < 0.5:
+            i18n["de"][p[0]] = (f"de-{p[1]}", f"Titel {p[2]}", None, None)
+    return products, i18n
+
+
+def _expected(products, category=None, sub=None, leaf=None, price_min=None, price_max=None,
+              rating_min=None, sort="popular", limit=24, offset=0):
+    rows = [
+        r for r, p in enumerate(products)
+        if (not category or p[3] == category) and (not sub or p[4] == sub) and (not leaf or p[5] == leaf)
+        and (price_min is None or p[6] >= price_min) and (price_max is None or p[6] <= price_max)
+        and (rating_min is None or (p[7] is not None and p[7] >= rating_min))
+    ]
+    if sort == "price-asc":
+        rows.sort(key=lambda r: (products[r][6], r))
+    elif sort == "price-desc":
+        rows.sort(key=lambda r: (-products[r][6], r))
+    return len(rows), rows[offset:offset + limit]
+
+
+@pytest.fixture(scope="module")
+def snap(tmp_path_factory):
+    products, i18n = _catalog(400, random.Random(7))
+    path = str(tmp_path_factory.mktemp("snap") / "catalog.snap")
+    _write(path, 3, products, i18n)
+    return Snapshot(path), products, i18n
+
+
+def test_header(snap):
+    s, products, _ = snap
+    assert (s.version, s.rows) == (3, len(products))
+
+
+def test_query_matches_sql_order(snap):
+    s, products, _ = snap
+    rnd = random.Random(11)
+    for _ in range(500):
+        cat = rnd.choice([None, "", "zz"] + list(CATS))
+        sub = rnd.choice([None, ""] + (CATS.get(cat) or ["a1"]))
+        q = dict(
+            category=cat, sub=sub,
+            leaf=rnd.choice([None, "", f"{sub}-x"]) if sub else None,
+            price_min=rnd.choice([None, 10.0, 20.0]),
+            price_max=rnd.choice([None, 19.99, 50.0]),
+            rating_min=rnd.choice([None, 4.0]),
+            sort=rnd.choice(["popular", "price-asc", "price-desc"]),
+            limit=rnd.choice([1, 5, 24, 100]),
+            offset=rnd.choice([0, 3, 40]),
+        )
+        assert s.query(**q) == _expected(products, **q), q
+
+
+def test_scan_limit_falls_back_to_sql(snap, monkeypatch):
+    s, _, _ = snap
+    monkeypatch.setattr(catalog_snapshot, "CATALOG_SNAPSHOT_SCAN_MAX", 10)
+    assert s.query(price_min=1.0) is None
+    # без фильтров и сортировки внутри группы — перестановки, скан не нужен
+    assert s.query(sort="price-desc") is not None
+
+
+def test_find_slug_and_row(snap):
+    s, products, i18n = snap
+    for r, p in enumerate(products):
+        assert s.find_slug(p[1]) == r
+        tr = i18n["de"].get(p[0])
+        if tr:
+            assert s.find_slug(tr[0], "de") == r
+        else:
+            assert s.find_slug(p[1], "de") is None
+    assert s.find_slug("nope") is None
+    assert s.find_slug("", "en") is None
+
+    r = next(r for r, p in enumerate(products) if p[7] is None and p[0] in i18n["de"])
+    row = s.row(r, ["id", "title", "price", "rating", "imageUrl"], "de")
+    assert row == {"id": products[r][0], "title": i18n["de"][products[r][0]][1],
+                   "price": products[r][6], "rating": None, "imageUrl": None}
+    assert s.row(r, ["title"], None) == {"title": products[r][2]}
+
+
+def test_not_a_snapshot(tmp_path):
+    path = tmp_path / "bad.snap"
+    path.write_bytes(b"NOTASNAP" + b"\0" * 16)
+    with pytest.raises(ValueError):
+        Snapshot(str(path))
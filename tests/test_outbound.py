@@ -0,0 +1,228 @@
+import asyncio
+
+import pytest
+
+import outbound
+from outbound import Dependency, SingleFlight, TTLCache, UpstreamUnavailable
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(outbound.time, "monotonic", c)
+    return c
+
+
+# ----- TTLCache -----
+
+def test_ttl_expiry_and_per_entry_ttl(clock):
+    c = TTLCache(maxsize=10, ttl=5)
+    c.set("a", 1)
+    c.set("neg", None, ttl=1)
+    assert c.get("a") == 1 and c.get("neg") is None
+    clock.now += 1
+    assert c.get("neg", "miss") == "miss"
+    assert c.get("a") == 1
+    clock.now += 4
+    assert c.get("a", "miss") == "miss"
+    assert len(c) == 0
+    assert (c.hits, c.misses) == (3, 2)
+
+
+def test_ttl_lru_eviction(clock):
+    c = TTLCache(maxsize=2, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2)
+    c.get("a")          # a — свежее b
+    c.set("c", 3)
+    assert c.get("b", None) is None
+    assert c.get("a") == 1 and c.get("c") == 3
+
+
+# ----- SingleFlight -----
+
+def test_singleflight_shares_one_call():
+    async def main():
+        sf, calls = SingleFlight(), 0
+        gate = asyncio.Event()
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await gate.wait()
+            return "v"
+
+        waiters = [asyncio.ensure_future(sf.do("k", fetch)) for _ in range(5)]
+        await asyncio.sleep(0)
+        assert len(sf) == 1
+        gate.set()
+        assert await asyncio.gather(*waiters) == ["v"] * 5
+        assert calls == 1 and len(sf) == 0
+
+    asyncio.run(main())
+
+
+def test_singleflight_cancel_one_waiter_keeps_call():
+    async def main():
+        sf = SingleFlight()
+        gate = asyncio.Event()
+
+        async def fetch():
+            await gate.wait()
+            return 42
+
+        a = asyncio.ensure_future(sf.do("k", fetch))
+        b = asyncio.ensure_future(sf.do("k", fetch))
+        await asyncio.sleep(0)
+        a.cancel()
+        await asyncio.sleep(0)
+        gate.set()
+        assert await b == 42
+        assert a.cancelled()
+
+    asyncio.run(main())
+
+
+# ----- Dependency: breaker -----
+
+def _dep(**kw) -> Dependency:
+    kw.setdefault("timeout", 1.0)
+    kw.setdefault("failure_threshold", 2)
+    kw.setdefault("reset_timeout", 10.0)
+    return Dependency("test", **kw)
+
+
+async def _ok(t):
+    return "ok"
+
+
+async def _boom(t):
+    raise RuntimeError("down")
+
+
+async def _fail(d: Dependency, n: int):
+    for _ in range(n):
+        with pytest.raises(RuntimeError):
+            await d.call(_boom)
+
+
+def test_breaker_opens_and_recovers(clock):
+    async def main():
+        d = _dep()
+        await _fail(d, 2)
+        assert d.state == d.OPEN
+        with pytest.raises(UpstreamUnavailable) as e:
+            await d.call(_ok)
+        assert e.value.retry_after == pytest.approx(10.0)
+        clock.now += 10
+        assert await d.call(_ok) == "ok"
+        assert d.state == d.CLOSED
+
+    asyncio.run(main())
+
+
+def test_ok_errors_do_not_count(clock):
+    async def main():
+        d = _dep()
+        for _ in range(3):
+            with pytest.raises(ValueError):
+                await d.call(lambda t: _raise(ValueError()), ok_errors=(ValueError,))
+        assert d.state == d.CLOSED
+
+    async def _raise(e):
+        raise e
+
+    asyncio.run(main())
+
+
+def test_half_open_admits_only_half_open_max(clock):
+    async def main():
+        d = _dep(half_open_max=1)
+        await _fail(d, 2)
+        clock.now += 10
+        gate = asyncio.Event()
+
+        async def slow(t):
+            await gate.wait()
+            return "ok"
+
+        probe = asyncio.ensure_future(d.call(slow))
+        await asyncio.sleep(0)
+        assert d.state == d.HALF_OPEN
+        with pytest.raises(UpstreamUnavailable):
+            await d.call(_ok)
+        gate.set()
+        assert await probe == "ok"
+        assert d.state == d.CLOSED
+
+    asyncio.run(main())
+
+
+def test_call_from_closed_era_does_not_free_probe_slot(clock):
+    async def main():
+        d = _dep(half_open_max=1)
+        gate = asyncio.Event()
+
+        async def slow(t):
+            await gate.wait()
+            raise asyncio.CancelledError  # клиент ушёл — не отказ и не успех
+
+        # начат при CLOSED, завершится уже в half-open
+        old = asyncio.ensure_future(d.call(slow))
+        await asyncio.sleep(0)
+        await _fail(d, 2)
+        clock.now += 10
+        probe_gate = asyncio.Event()
+
+        async def probe_fn(t):
+            await probe_gate.wait()
+            return "ok"
+
+        probe = asyncio.ensure_future(d.call(probe_fn))
+        await asyncio.sleep(0)
+        gate.set()
+        with pytest.raises(asyncio.CancelledError):
+            await old
+        # слот пробы всё ещё занят — второй вызов не проходит
+        with pytest.raises(UpstreamUnavailable):
+            await d.call(_ok)
+        probe_gate.set()
+        assert await probe == "ok"
+
+    asyncio.run(main())
+
+
+def test_probe_from_previous_window_is_not_counted(clock):
+    async def main():
+        d = _dep(half_open_max=1)
+        await _fail(d, 2)
+        clock.now += 10
+        gate = asyncio.Event()
+
+        async def slow(t):
+            await gate.wait()
+            return "ok"
+
+        stale = asyncio.ensure_future(d.call(slow))       # проба окна 1
+        await asyncio.sleep(0)
+        d._record(False, None)                           # окно 1 провалено другой пробой
+        assert d.state == d.OPEN
+        clock.now += 10
+        fresh = asyncio.ensure_future(d.call(slow))       # проба окна 2
+        await asyncio.sleep(0)
+        assert d._half_open_inflight == 1
+        # завершение пробы окна 1 не освобождает слот окна 2 (и закрывает breaker успехом)
+        d._release_probe(1)
+        assert d._half_open_inflight == 1
+        gate.set()
+        assert await stale == "ok" and await fresh == "ok"
+
+    asyncio.run(main())
@@ -0,0 +1,23 @@
+import pytest
+from fastapi import HTTPException
+
+from responses import parse_fields
+
+ALLOWED = ["id", "slug", "title", "price"]
+
+
+def test_empty_means_all_fields():
+    assert parse_fields(None, ALLOWED) == ALLOWED
+    assert parse_fields("", ALLOWED) == ALLOWED
+    assert parse_fields(" , ,", ALLOWED) == ALLOWED
+
+
+def test_model_order_and_dedup():
+    assert parse_fields("price, id,price", ALLOWED) == ["id", "price"]
+
+
+def test_unknown_field_is_400():
+    with pytest.raises(HTTPException) as e:
+        parse_fields("id,nope,zzz", ALLOWED)
+    assert e.value.status_code == 400
+    assert "nope, zzz" in e.value.detail
@@ -0,0 +1,121 @@
+# votes.py
+# Буфер голосов «полезно»: клики копятся в памяти воркера (review_id → +n)
+# и раз в VOTES_FLUSH_MS или по набору VOTES_FLUSH_MAX голосов уходят одним
+# UPDATE на все затронутые отзывы. Число записей растёт с числом разных
+# отзывов, а не кликов; горячий отзыв — одна строка раз в интервал, а не
+# очередь на row lock.
+#
+# Потери ограничены: при падении процесса — голоса за последний интервал;
+# на остановке lifespan вызывает close() — финальный flush.
+import asyncio
+import logging
+import os
+
+from metrics import Counter, collector
+
+logger = logging.getLogger(__name__)
+
+VOTES_FLUSH_MS = int(os.getenv("VOTES_FLUSH_MS", "1000"))
+VOTES_FLUSH_MAX = int(os.getenv("VOTES_FLUSH_MAX", "500"))
+# если БД недоступна, неотправленное копится до этого числа разных отзывов, дальше — сброс
+VOTES_MAX_PENDING = int(os.getenv("VOTES_MAX_PENDING", "50000"))
+
+FLUSHES = Counter("votes_flushes_total", "Helpful-vote buffer flushes", ("outcome",))
+VOTES_FLUSHED = Counter("votes_flushed_total", "Helpful votes written to the database")
+VOTES_DROPPED = Counter("votes_dropped_total", "Helpful votes dropped because the buffer overflowed")
+
+# id в одном порядке во всех воркерах — без дедлоков между параллельными flush'ами
+_FLUSH_SQL = """
+  update reviews r set helpful = r.helpful + v.n
+  from unnest(%s::uuid[], %s::int[]) as v(id, n)
+  where r.id = v.id
+"""
+
+
+class VoteBuffer:
+    def __init__(self):
+        self._pending: dict[str, int] = {}
+        # уже отправляется, но ещё не закоммичено — для ответа POST /vote это ещё pending
+        self._inflight: dict[str, int] = {}
+        self._votes = 0
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    def add(self, review_id: str, n: int = 1):
+        self._pending[review_id] = self._pending.get(review_id, 0) + n
+        self._votes += n
+        if self._votes >= VOTES_FLUSH_MAX:
+            self._wake.set()
+
+    def pending(self, review_id: str) -> int:
+        return self._pending.get(review_id, 0) + self._inflight.get(review_id, 0)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), VOTES_FLUSH_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        from db import pool
+
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending, self._votes = self._pending, {}, 0
+            self._inflight = batch
+            ids = sorted(batch)
+            try:
+                async with pool.connection() as conn:
+                    await conn.execute(_FLUSH_SQL, (ids, [batch[i] for i in ids]))
+            except Exception:
+                FLUSHES.inc("error")
+                logger.exception("votes: flush of %d reviews failed, keeping them for retry", len(batch))
+                self._merge_back(batch)
+                return
+            except asyncio.CancelledError:
+                # остановка посреди flush: вернуть в буфер, close() отправит их ещё раз
+                self._merge_back(batch)
+                raise
+            finally:
+                self._inflight = {}
+            FLUSHES.inc("ok")
+            VOTES_FLUSHED.inc(amount=sum(batch.values()))
+
+    def _merge_back(self, batch: dict[str, int]):
+        for rid, n in batch.items():
+            if rid not in self._pending and len(self._pending) >= VOTES_MAX_PENDING:
+                VOTES_DROPPED.inc(amount=n)
+                continue
+            # без _wake: повтор — по обычному интервалу, а не сразу же
+            self._pending[rid] = self._pending.get(rid, 0) + n
+            self._votes += n
+
+
+buffer = VoteBuffer()
+
+
+@collector
+def _vote_metrics():
+    yield ("votes_pending", "gauge", "Helpful votes buffered in this worker, not yet flushed",
+           [({}, buffer._votes)])
+    yield ("votes_pending_reviews", "gauge", "Distinct reviews with buffered votes",
+           [({}, len(buffer._pending))])